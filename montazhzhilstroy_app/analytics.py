@@ -0,0 +1,184 @@
+import sqlite3
+from array import array
+from itertools import islice
+from database import create_connection, archive_database_exists
+from money import from_kopecks
+from cancellation import CANCELLED, OperationCancelled, watch, is_interrupted
+
+try:
+    import numpy as np
+except ImportError: # NumPy необязателен: без него агрегаты считаются на чистом Python
+    np = None
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+DEFAULT_CHUNK_SIZE = 200000 # Строк в одном блоке: ограничивает память независимо от объема истории
+
+# Все столбцы блока целочисленные: деньги в копейках, период - число вида ГГГГММДД / ГГГГММ / ГГГГ
+ORDER_LINE_COLUMNS = ("order_id", "period", "client_id", "product_id", "quantity", "price_per_unit", "cost_per_unit")
+PERIOD_KEY_SQL = {
+    "day": "CAST(strftime('%Y%m%d', o.order_date) AS INTEGER)",
+    "month": "CAST(strftime('%Y%m', o.order_date) AS INTEGER)",
+    "year": "CAST(strftime('%Y', o.order_date) AS INTEGER)",
+}
+AGGREGATION_KEYS = {"period": "period", "product": "product_id", "category": "product_id", "client": "client_id"}
+if np is not None:
+    ORDER_LINE_DTYPE = np.dtype([(name, np.int64) for name in ORDER_LINE_COLUMNS])
+
+def _order_lines_query(period, date_from, date_to, include_archived, include_cancelled):
+    if period not in PERIOD_KEY_SQL: raise ValueError(f"Неизвестный период: {period}")
+    items_source, orders_source = ("all_order_items", "all_orders") if include_archived else ("order_items", "orders")
+    sql = f"""
+    SELECT oi.order_id, {PERIOD_KEY_SQL[period]}, o.client_id, oi.product_id,
+           oi.quantity, oi.price_per_unit, COALESCE(p.cost_price, 0)
+    FROM {items_source} oi
+    JOIN {orders_source} o ON o.id = oi.order_id
+    JOIN products p ON p.id = oi.product_id
+    WHERE 1 = 1
+    """
+    params = []
+    if not include_cancelled: sql += " AND o.status <> 'Отменен'"
+    if date_from: sql += " AND o.order_date >= ?"; params.append(date_from)
+    if date_to: sql += " AND o.order_date < ?"; params.append(date_to)
+    return sql, params
+
+def iter_order_line_chunks(chunk_size=DEFAULT_CHUNK_SIZE, period="month", date_from=None, date_to=None,
+                           include_archived=False, include_cancelled=False, as_frame=False, conn=None):
+    """
+    Потоково отдает позиции заказов (order_items + orders + products) блоками по столбцам:
+    словарь {столбец: массив} с ключами ORDER_LINE_COLUMNS. Массивы - numpy.int64, если NumPy
+    установлен, иначе array('q'). С as_frame=True и установленным pandas блок отдается как DataFrame.
+    date_from / date_to - строки 'ГГГГ-ММ-ДД' (date_to не включается).
+    Если conn передан, используется он (например, снимок для отчетов); иначе открывается свое соединение.
+    """
+    sql, params = _order_lines_query(period, date_from, date_to, include_archived, include_cancelled)
+    close_conn_locally = conn is None
+    if close_conn_locally:
+        conn = create_connection(attach_archive=include_archived and archive_database_exists())
+        if conn is None: return
+        if include_archived and not archive_database_exists():
+            sql = sql.replace("all_order_items", "order_items").replace("all_orders", "orders")
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            if np is not None:
+                block = np.fromiter(islice(cur, chunk_size), dtype=ORDER_LINE_DTYPE)
+                if len(block) == 0: break
+                columns = {name: np.ascontiguousarray(block[name]) for name in ORDER_LINE_COLUMNS}
+            else:
+                rows = cur.fetchmany(chunk_size)
+                if not rows: break
+                columns = {name: array('q', values) for name, values in zip(ORDER_LINE_COLUMNS, zip(*rows))}
+            yield pd.DataFrame(columns) if as_frame and pd is not None else columns
+    finally:
+        cur.close()
+        if close_conn_locally: conn.close()
+
+def _track_chunks(chunks, cancel_token):
+    """Прогресс по числу прочитанных позиций и проверка отмены между блоками."""
+    done = 0
+    for columns in chunks:
+        cancel_token.check()
+        done += len(columns["order_id"])
+        cancel_token.report(done)
+        yield columns
+
+def _group_sum_numpy(keys, values):
+    """Группирует по keys и суммирует каждый массив из values (сортировкой, точно в int64)."""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return sorted_keys[starts], [np.add.reduceat(v[order], starts) for v in values]
+
+def _aggregate_numpy(chunks, key_column):
+    acc_keys, acc_values = None, None
+    for columns in chunks:
+        keys = columns[key_column]
+        quantity = columns["quantity"]
+        chunk_values = [quantity, quantity * columns["price_per_unit"], quantity * columns["cost_per_unit"],
+                        np.ones(len(keys), dtype=np.int64)]
+        chunk_keys, chunk_values = _group_sum_numpy(keys, chunk_values)
+        if acc_keys is None:
+            acc_keys, acc_values = chunk_keys, chunk_values
+        else: # Сливаем частичные итоги: их не больше, чем групп, поэтому память не растет с историей
+            acc_keys, acc_values = _group_sum_numpy(np.concatenate((acc_keys, chunk_keys)),
+                                                    [np.concatenate(pair) for pair in zip(acc_values, chunk_values)])
+    if acc_keys is None: return {}
+    return {int(k): [int(v) for v in vals] for k, vals in zip(acc_keys, zip(*acc_values))}
+
+def _aggregate_python(chunks, key_column):
+    totals = {}
+    for columns in chunks:
+        for key, quantity, price, cost in zip(columns[key_column], columns["quantity"],
+                                              columns["price_per_unit"], columns["cost_per_unit"]):
+            acc = totals.get(key)
+            if acc is None: acc = totals[key] = [0, 0, 0, 0]
+            acc[0] += quantity; acc[1] += quantity * price; acc[2] += quantity * cost; acc[3] += 1
+    return totals
+
+def _fetch_labels(conn, by, keys):
+    """Подписи групп: названия товаров / категорий / имена клиентов."""
+    if by == "period": return {k: str(k) for k in keys}
+    table, column = ("clients", "full_name") if by == "client" else ("products", "name" if by == "product" else "category")
+    labels, keys = {}, list(keys)
+    for i in range(0, len(keys), 900): # Ограничение SQLite на число параметров
+        batch = keys[i:i + 900]
+        rows = conn.execute(f"SELECT id, {column} FROM {table} WHERE id IN ({', '.join('?' for _ in batch)})", batch).fetchall()
+        labels.update(rows)
+    return labels
+
+def aggregate_sales(by="product", period="month", date_from=None, date_to=None, include_archived=False,
+                    include_cancelled=False, chunk_size=DEFAULT_CHUNK_SIZE, conn=None, cancel_token=None):
+    """
+    Выручка, себестоимость, маржа и количество по группам: by = 'period' | 'product' | 'category' | 'client'.
+    Считается векторно по блокам iter_order_line_chunks; деньги суммируются в копейках без погрешности.
+    Маржа считается по текущей закупочной цене товара (products.cost_price).
+    Возвращает список словарей, для периодов - по возрастанию периода, иначе - по убыванию выручки.
+    cancel_token (cancellation.CancelToken) - прогресс и отмена (возвращается "Cancelled").
+    """
+    if by not in AGGREGATION_KEYS: raise ValueError(f"Неизвестная группировка: {by}")
+    close_conn_locally = conn is None
+    if close_conn_locally:
+        conn = create_connection(attach_archive=include_archived and archive_database_exists())
+        if conn is None: return "ConnectionError"
+        include_archived = include_archived and archive_database_exists()
+    try:
+        with watch(cancel_token, conn):
+            chunks = iter_order_line_chunks(chunk_size, period, date_from, date_to, include_archived, include_cancelled, conn=conn)
+            if cancel_token is not None: chunks = _track_chunks(chunks, cancel_token)
+            key_column = AGGREGATION_KEYS[by]
+            totals = _aggregate_numpy(chunks, key_column) if np is not None else _aggregate_python(chunks, key_column)
+            labels = _fetch_labels(conn, by, totals.keys())
+    except OperationCancelled: return CANCELLED
+    except sqlite3.Error as e:
+        if is_interrupted(e, cancel_token): return CANCELLED
+        raise
+    finally:
+        if close_conn_locally: conn.close()
+
+    if by == "category": # Категория - свойство товара, поэтому сначала считаем по товарам, затем сворачиваем
+        by_category = {}
+        for product_id, values in totals.items():
+            acc = by_category.setdefault(labels.get(product_id) or "", [0, 0, 0, 0])
+            for i, v in enumerate(values): acc[i] += v
+        totals, labels = by_category, {k: k or "Без категории" for k in by_category}
+
+    result = []
+    for key, (quantity, revenue, cost, lines) in totals.items():
+        margin = revenue - cost
+        result.append({
+            "key": key, "label": labels.get(key, str(key)), "quantity": quantity, "lines": lines,
+            "revenue": from_kopecks(revenue), "cost": from_kopecks(cost), "margin": from_kopecks(margin),
+            "margin_percent": round(100 * margin / revenue, 2) if revenue else None
+        })
+    if by == "period": result.sort(key=lambda row: row["key"])
+    else: result.sort(key=lambda row: row["revenue"], reverse=True)
+    return result
+
+if __name__ == '__main__':
+    for group_by in ("period", "category", "product"):
+        print(f"--- Продажи по группировке '{group_by}' ---")
+        for row in aggregate_sales(by=group_by, include_archived=True)[:20]:
+            print(f"{row['label']:<40} кол-во: {row['quantity']:>8}  выручка: {row['revenue']:>14}  маржа: {row['margin']:>14}")
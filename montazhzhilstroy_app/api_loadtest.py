@@ -0,0 +1,120 @@
+"""
+Нагрузочный тест API (api_server.py). Сервер должен быть запущен: python main.py --serve
+Пример: python api_loadtest.py --concurrency 32 --duration 10 --etag
+Печатает пропускную способность и задержки (p50 / p90 / p99 / максимум).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+DEFAULT_PATHS = ["/products?limit=50", "/clients?limit=50", "/orders?limit=50", "/products/{product_id}", "/orders/{order_id}"]
+
+def percentile(sorted_values, percent):
+    """Перцентиль методом ближайшего ранга по отсортированному списку."""
+    if not sorted_values: return 0.0
+    rank = max(1, int(round(percent / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class Connection:
+    """Одно keep-alive соединение с сервером: запрос -> (статус, заголовки, тело)."""
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(payload)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        response_headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                response_headers[name.strip().lower()] = value.strip()
+        length = int(response_headers.get("content-length", 0))
+        response_body = await self.reader.readexactly(length) if length else b""
+        if response_headers.get("connection", "").lower() == "close": self.close()
+        return int(status_line.split(" ")[1]), response_headers, response_body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+async def _sample_ids(host, port):
+    """Берет id существующих товаров и заказов, чтобы запросы по одной записи не били в пустоту."""
+    conn = Connection(host, port)
+    ids = {}
+    for key, path in (("product_id", "/products?limit=1000"), ("order_id", "/orders?limit=1000")):
+        status, _, body = await conn.request("GET", path)
+        items = json.loads(body)["items"] if status == 200 else []
+        ids[key] = [item["id"] for item in items] or [1]
+    conn.close()
+    return ids
+
+async def _worker(host, port, paths, ids, deadline, remaining, use_etag, latencies, statuses):
+    conn = Connection(host, port)
+    etags = {}
+    try:
+        while time.perf_counter() < deadline:
+            if remaining is not None:
+                if remaining[0] <= 0: break
+                remaining[0] -= 1
+            path = random.choice(paths).format(**{key: random.choice(values) for key, values in ids.items()})
+            headers = {"If-None-Match": etags[path]} if use_etag and path in etags else None
+            started = time.perf_counter()
+            try:
+                status, response_headers, _ = await conn.request("GET", path, headers=headers)
+            except (OSError, asyncio.IncompleteReadError):
+                conn.close()
+                statuses["error"] = statuses.get("error", 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if use_etag and "etag" in response_headers: etags[path] = response_headers["etag"]
+    finally:
+        conn.close()
+
+async def run_load_test(host, port, concurrency, duration, total_requests, paths, use_etag):
+    ids = await _sample_ids(host, port)
+    latencies, statuses = [], {}
+    remaining = [total_requests] if total_requests else None
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_worker(host, port, paths, ids, deadline, remaining, use_etag, latencies, statuses)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies), "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2), "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2), "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API МонтажЖилСтрой")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных keep-alive соединений")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность теста, секунд")
+    parser.add_argument("--requests", type=int, default=0, help="остановиться после стольких запросов (0 - по времени)")
+    parser.add_argument("--path", action="append", dest="paths", help="путь для GET (можно несколько; {product_id}, {order_id})")
+    parser.add_argument("--etag", action="store_true", help="отправлять If-None-Match с полученными ETag")
+    args = parser.parse_args()
+    report = asyncio.run(run_load_test(args.host, args.port, args.concurrency, args.duration, args.requests,
+                                       args.paths or DEFAULT_PATHS, args.etag))
+    print(f"Запросов: {report['requests']} за {report['elapsed_s']} с, пропускная способность: {report['throughput_rps']} запр/с")
+    print(f"Задержка, мс: p50 {report['p50_ms']}  p90 {report['p90_ms']}  p99 {report['p99_ms']}  макс {report['max_ms']}")
+    print(f"Статусы: {report['statuses']}")
+
+if __name__ == '__main__':
+    main()
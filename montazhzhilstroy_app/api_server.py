@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from urllib.parse import urlsplit, parse_qs
+
+import database
+import product_crud as pc
+import client_crud as cc
+import order_crud as oc
+from change_feed import get_change_counters
+from app_logging import get_logger
+
+logger = get_logger("api")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 8 # Потоков для запросов к БД (и соединений в пуле)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 100
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+HTTP_REASONS = {200: "OK", 201: "Created", 204: "No Content", 304: "Not Modified", 400: "Bad Request",
+                404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+# Коды ошибок CRUD-слоя -> HTTP-статус. Ищется по префиксу: у части кодов после ':' идут подробности
+CONFLICT_ERRORS = ("IntegrityError", "EmailExistsError", "HasOrderItemsError", "HasOrdersError",
+                   "InsufficientStockError", "StockReturnError")
+NOT_FOUND_ERRORS = ("NotFound", "ProductNotFoundForStockUpdate")
+
+PRODUCT_FIELDS = ("name", "article_number", "category", "description", "price", "stock_quantity", "cost_price", "reorder_level")
+CLIENT_FIELDS = ("full_name", "phone_number", "email", "address")
+
+class ApiError(Exception):
+    def __init__(self, status, code):
+        super().__init__(code)
+        self.status, self.code = status, code
+
+def _status_for_result(result):
+    if result == "ConnectionError": return 503
+    if "FOREIGN KEY constraint failed" in result: return 409 # Например, заказ на несуществующего клиента
+    if result.startswith("SQLiteError") or result == "OrderCreationError": return 500
+    if result.startswith(NOT_FOUND_ERRORS): return 404
+    if result.startswith(CONFLICT_ERRORS): return 409
+    return 400
+
+def _check_result(result):
+    """Превращает строковый код ошибки CRUD-функции в ApiError; остальные значения пропускает."""
+    if isinstance(result, str): raise ApiError(_status_for_result(result), result)
+    return result
+
+def _json_default(value):
+    if isinstance(value, Decimal): return str(value) # Деньги отдаются строкой, без потерь float
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+def _page_params(query):
+    try:
+        limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+        offset = int(query.get("offset", 0))
+    except ValueError: raise ApiError(400, "InvalidPaginationError")
+    if limit < 1 or offset < 0: raise ApiError(400, "InvalidPaginationError")
+    return min(limit, MAX_PAGE_SIZE), offset
+
+def _page(items, limit, offset):
+    return {"items": items, "limit": limit, "offset": offset,
+            "next_offset": offset + limit if len(items) == limit else None}
+
+def _fields(body, allowed, required=()):
+    if not isinstance(body, dict): raise ApiError(400, "InvalidBodyError")
+    missing = [name for name in required if body.get(name) is None]
+    if missing: raise ApiError(400, f"MissingFieldError:{','.join(missing)}")
+    unknown = [name for name in body if name not in allowed]
+    if unknown: raise ApiError(400, f"UnknownFieldError:{','.join(unknown)}")
+    return {name: body[name] for name in allowed if body.get(name) is not None}
+
+def _int_fields(data, *names):
+    try:
+        for name in names:
+            if name in data: data[name] = int(data[name])
+    except (TypeError, ValueError): raise ApiError(400, f"InvalidNumberError:{name}")
+    return data
+
+# --- Обработчики: (совпадение пути, параметры запроса, тело) -> (статус, данные) ---
+
+def list_products(match, query, body):
+    limit, offset = _page_params(query)
+    return 200, _page(pc.get_all_products(limit, offset), limit, offset)
+
+def get_product(match, query, body):
+    product = pc.get_product_by_id(int(match["id"]))
+    if product is None: raise ApiError(404, "NotFound")
+    return 200, product
+
+def create_product(match, query, body):
+    data = _int_fields(_fields(body, PRODUCT_FIELDS, required=("name", "article_number", "price", "stock_quantity")),
+                       "stock_quantity", "reorder_level")
+    if data["stock_quantity"] < 0: raise ApiError(400, "StockCannotBeNegative")
+    return 201, {"id": _check_result(pc.add_product(data["name"], data["article_number"], data.get("category"),
+                                                    data.get("description"), data["price"], data["stock_quantity"],
+                                                    data.get("cost_price", 0), data.get("reorder_level", 0)))}
+
+def update_product(match, query, body):
+    data = _int_fields(_fields(body, PRODUCT_FIELDS), "stock_quantity", "reorder_level")
+    _check_result(pc.update_product(int(match["id"]), **data))
+    return 200, pc.get_product_by_id(int(match["id"]))
+
+def delete_product(match, query, body):
+    _check_result(pc.delete_product(int(match["id"])))
+    return 204, None
+
+def list_clients(match, query, body):
+    limit, offset = _page_params(query)
+    return 200, _page(cc.get_all_clients(limit, offset), limit, offset)
+
+def get_client(match, query, body):
+    client = cc.get_client_by_id(int(match["id"]))
+    if client is None: raise ApiError(404, "NotFound")
+    return 200, client
+
+def create_client(match, query, body):
+    data = _fields(body, CLIENT_FIELDS, required=("full_name",))
+    return 201, {"id": _check_result(cc.add_client(**data))}
+
+def update_client(match, query, body):
+    _check_result(cc.update_client(int(match["id"]), **_fields(body, CLIENT_FIELDS)))
+    return 200, cc.get_client_by_id(int(match["id"]))
+
+def delete_client(match, query, body):
+    _check_result(cc.delete_client(int(match["id"])))
+    return 204, None
+
+def list_orders(match, query, body):
+    limit, offset = _page_params(query)
+    include_archived = query.get("include_archived", "0").lower() in ("1", "true", "yes")
+    return 200, _page(oc.get_all_orders_with_details(include_archived, limit, offset), limit, offset)
+
+def get_order(match, query, body):
+    order = oc.get_order_details_by_id(int(match["id"]))
+    if order is None: raise ApiError(404, "NotFound")
+    return 200, order
+
+def create_order(match, query, body):
+    data = _int_fields(_fields(body, ("client_id", "items", "status"), required=("client_id", "items")), "client_id")
+    items = data["items"]
+    if not isinstance(items, list) or not items: raise ApiError(400, "EmptyOrderError")
+    try:
+        items = [{"product_id": int(item["product_id"]), "quantity": int(item["quantity"]),
+                  "price_per_unit": item["price_per_unit"]} for item in items]
+    except (KeyError, TypeError, ValueError): raise ApiError(400, "InvalidOrderItemError")
+    if any(item["quantity"] <= 0 for item in items): raise ApiError(400, "InvalidOrderItemError")
+    status = data.get("status", oc.ORDER_STATUSES[0])
+    if status not in oc.ORDER_STATUSES: raise ApiError(400, "InvalidStatusError")
+    return 201, {"id": _check_result(oc.add_order(data["client_id"], items, status))}
+
+def update_order(match, query, body):
+    data = _fields(body, ("status",), required=("status",))
+    _check_result(oc.update_order_status(int(match["id"]), data["status"]))
+    return 200, oc.get_order_details_by_id(int(match["id"]))
+
+def delete_order(match, query, body):
+    _check_result(oc.delete_order(int(match["id"])))
+    return 204, None
+
+# (метод, шаблон пути, обработчик, таблицы change_counters, от которых зависит ответ GET)
+ROUTES = [
+    ("GET", r"/products", list_products, ("products",)),
+    ("POST", r"/products", create_product, None),
+    ("GET", r"/products/(?P<id>\d+)", get_product, ("products",)),
+    ("PATCH", r"/products/(?P<id>\d+)", update_product, None),
+    ("DELETE", r"/products/(?P<id>\d+)", delete_product, None),
+    ("GET", r"/clients", list_clients, ("clients",)),
+    ("POST", r"/clients", create_client, None),
+    ("GET", r"/clients/(?P<id>\d+)", get_client, ("clients",)),
+    ("PATCH", r"/clients/(?P<id>\d+)", update_client, None),
+    ("DELETE", r"/clients/(?P<id>\d+)", delete_client, None),
+    ("GET", r"/orders", list_orders, ("orders", "clients")),
+    ("POST", r"/orders", create_order, None),
+    ("GET", r"/orders/(?P<id>\d+)", get_order, ("orders", "clients", "products")),
+    ("PATCH", r"/orders/(?P<id>\d+)", update_order, None),
+    ("DELETE", r"/orders/(?P<id>\d+)", delete_order, None),
+]
+COMPILED_ROUTES = [(method, re.compile(pattern + r"/?\Z"), handler, tables) for method, pattern, handler, tables in ROUTES]
+
+def _make_etag(path, query, tables):
+    """
+    ETag строится по версиям таблиц, а не по содержимому ответа: проверка If-None-Match
+    стоит одного чтения change_counters и не выполняет сам запрос.
+    """
+    versions = _check_result(get_change_counters(tables))
+    key = f"{path}?{sorted(query.items())}|{sorted(versions.items())}"
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+def dispatch(method, target, body=None, if_none_match=None):
+    """
+    Выполняет один запрос синхронно (в рабочем потоке). Возвращает (статус, данные, etag).
+    Используется и для обычных запросов, и для элементов /batch.
+    """
+    parts = urlsplit(target)
+    path = parts.path
+    query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    path_matched = False
+    for route_method, pattern, handler, tables in COMPILED_ROUTES:
+        match = pattern.match(path)
+        if not match: continue
+        path_matched = True
+        if route_method != method: continue
+        try:
+            etag = _make_etag(path, query, tables) if method == "GET" else None
+            if etag and if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                return 304, None, etag
+            status, payload = handler(match, query, body)
+            return status, payload, etag
+        except ApiError as e:
+            return e.status, {"error": e.code}, None
+    if path_matched: return 405, {"error": "MethodNotAllowed"}, None
+    return 404, {"error": "UnknownPath"}, None
+
+def dispatch_batch(body):
+    """
+    POST /batch: {"requests": [{"method": "GET", "path": "/products/1", "body": {...}}, ...]}.
+    Запросы выполняются по порядку в одном рабочем потоке, каждый со своей транзакцией: пакет не атомарен,
+    поэтому у каждого элемента свой статус, и сбой одного элемента не скрывает результат уже выполненных.
+    """
+    requests = body.get("requests") if isinstance(body, dict) else None
+    if not isinstance(requests, list): return 400, {"error": "InvalidBodyError"}
+    if len(requests) > MAX_BATCH_SIZE: return 413, {"error": "BatchTooLargeError"}
+    responses = []
+    for request in requests:
+        if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+            responses.append({"status": 400, "body": {"error": "InvalidBodyError"}}); continue
+        method = str(request.get("method", "GET")).upper()
+        try: status, payload, etag = dispatch(method, request["path"], request.get("body"), request.get("if_none_match"))
+        except Exception: # Как в handle_request, но только для этого элемента
+            logger.exception(f"Ошибка обработки {method} {request['path']} в /batch", extra={"operation": f"{method} {urlsplit(request['path']).path}"})
+            status, payload, etag = 500, {"error": "InternalError"}, None
+        responses.append({"status": status, "body": payload, "etag": etag})
+    return 200, {"responses": responses}
+
+def handle_request(method, target, raw_body, if_none_match):
+    if raw_body:
+        try: body = json.loads(raw_body)
+        except (ValueError, UnicodeDecodeError): return 400, {"error": "InvalidJSON"}, None
+    else: body = None
+    try:
+        if urlsplit(target).path.rstrip("/") == "/batch":
+            if method != "POST": return 405, {"error": "MethodNotAllowed"}, None
+            return (*dispatch_batch(body), None)
+        return dispatch(method, target, body, if_none_match)
+    except Exception: # Ошибка обработчика не должна ронять соединение клиента
+        logger.exception(f"Ошибка обработки {method} {target}", extra={"operation": f"{method} {urlsplit(target).path}"})
+        return 500, {"error": "InternalError"}, None
+
+class ApiServer:
+    """HTTP/1.1 сервер на asyncio: разбор протокола в цикле событий, работа с SQLite - в пуле потоков."""
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+        self.host, self.port, self.workers = host, port, workers
+        self.executor = None
+        self.server = None
+
+    async def start(self):
+        database.initialize_database()
+        database.enable_connection_pool(max_idle=self.workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="api-db")
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1] # Если задан порт 0
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None: await self.start()
+        print(f"API сервер запущен: http://{self.host}:{self.port}")
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server is not None: self.server.close()
+        if self.executor is not None: self.executor.shutdown(wait=True)
+        database.disable_connection_pool()
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError: break # Клиент закрыл соединение
+                except asyncio.LimitOverrunError:
+                    await self._write_response(writer, 413, {"error": "HeadersTooLarge"}, None, False); break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try: method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._write_response(writer, 400, {"error": "BadRequestLine"}, None, False); break
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                try: length = int(headers.get("content-length", 0) or 0)
+                except ValueError: length = -1
+                if length < 0 or length > MAX_BODY_BYTES:
+                    await self._write_response(writer, 413, {"error": "BodyTooLarge"}, None, False); break
+                raw_body = await reader.readexactly(length) if length else b""
+
+                loop = asyncio.get_running_loop()
+                status, payload, etag = await loop.run_in_executor(self.executor, handle_request, method.upper(), target,
+                                                                   raw_body, headers.get("if-none-match"))
+                await self._write_response(writer, status, payload, etag, keep_alive)
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write_response(self, writer, status, payload, etag, keep_alive):
+        body = b"" if payload is None or status in (204, 304) else \
+            json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}", f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if body: lines.append("Content-Type: application/json; charset=utf-8")
+        if etag: lines.append(f"ETag: {etag}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+def run_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    """Запускает API без графического интерфейса (см. main.py --serve)."""
+    try:
+        asyncio.run(ApiServer(host, port, workers).serve_forever())
+    except KeyboardInterrupt:
+        print("API сервер остановлен.")
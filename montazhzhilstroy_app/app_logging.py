@@ -0,0 +1,137 @@
+import atexit
+import copy
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import datetime
+
+LOG_FILE = "app_errors.log"
+ROOT_LOGGER = "montazh"
+# Области логирования и уровни по умолчанию: crud - операции *_crud.py, gui - интерфейс, db - соединение и схема БД
+DEFAULT_LOG_LEVELS = {"crud": "WARNING", "gui": "ERROR", "db": "WARNING", "api": "WARNING"}
+LOG_LEVELS_ENV = "MONTAZH_LOG_LEVELS" # Например: MONTAZH_LOG_LEVELS="crud=INFO,db=DEBUG"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_ROTATION_MODES = ("size", "time")
+STRUCTURED_FIELDS = ("operation", "entity_id", "duration_ms", "result")
+
+_listener = None
+
+def get_logger(area):
+    """Логгер области ('crud', 'gui', 'db', ...). Пока setup_logging не вызван, пишет только ошибки в stderr."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{area}")
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, логгер, сообщение и поля STRUCTURED_FIELDS, если они заданы."""
+    def format(self, record):
+        data = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None: data[field] = value
+        if record.exc_info and not record.exc_text: record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text: data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Стандартный QueueHandler склеивает сообщение с трассировкой в одну строку. Здесь в потоке вызова
+    только подставляются аргументы и форматируется трассировка; JSON и запись в файл - в потоке QueueListener.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def parse_log_levels(spec):
+    """'crud=INFO,db=DEBUG' -> {"crud": "INFO", "db": "DEBUG"}. Бросает ValueError при неизвестном уровне."""
+    levels = {}
+    for part in filter(None, (item.strip() for item in (spec or "").split(","))):
+        area, _, level = part.partition("=")
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int): raise ValueError(f"Неизвестный уровень логирования: {part!r}")
+        levels[area.strip()] = level
+    return levels
+
+def _file_handler(log_file, rotation, max_bytes, backup_count):
+    directory = os.path.dirname(log_file)
+    if directory: os.makedirs(directory, exist_ok=True)
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(log_file, when="midnight", backupCount=backup_count, encoding="utf-8")
+    return logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+def setup_logging(log_file=LOG_FILE, levels=None, rotation="size", max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Настраивает логирование приложения: вызовы логгеров только кладут запись в очередь,
+    форматирование в JSON и запись в файл с ротацией (по размеру или раз в сутки) идут в фоновом потоке.
+    levels - уровни по областям поверх DEFAULT_LOG_LEVELS и переменной окружения MONTAZH_LOG_LEVELS.
+    Повторный вызов перенастраивает логирование.
+    """
+    global _listener
+    if rotation not in LOG_ROTATION_MODES: raise ValueError(f"Неизвестный режим ротации: {rotation!r}")
+    shutdown_logging()
+    effective = {**DEFAULT_LOG_LEVELS, **parse_log_levels(os.environ.get(LOG_LEVELS_ENV)), **(levels or {})}
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(logging.DEBUG) # Фильтруют уровни областей; корень пропускает все, что они пропустили
+    root.propagate = False
+    for area, level in effective.items():
+        get_logger(area).setLevel(level)
+    log_queue = queue.SimpleQueue()
+    file_handler = _file_handler(log_file, rotation, max_bytes, backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    root.addHandler(_StructuredQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    return effective
+
+def shutdown_logging():
+    """Дописывает очередь в файл и останавливает фоновый поток (вызывается и при выходе из программы)."""
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers: handler.close()
+        _listener = None
+
+atexit.register(shutdown_logging)
+
+TECHNICAL_ERROR_PREFIXES = ("SQLiteError", "IntegrityError", "ConnectionError")
+
+def _is_success(result):
+    return result is True or type(result) is int or isinstance(result, (dict, list))
+
+def _result_level(result):
+    if _is_success(result): return logging.INFO
+    # Отказы по бизнес-правилам (NotFound, HasOrdersError, ...) - штатная ситуация, ошибки БД - нет
+    return logging.WARNING if isinstance(result, str) and result.startswith(TECHNICAL_ERROR_PREFIXES) else logging.INFO
+
+def log_crud(operation):
+    """
+    Декоратор CRUD-функции: пишет операцию, id сущности (первый аргумент или id созданной записи),
+    итог и длительность. Успех и отказы по правилам ("NotFound") - INFO, ошибки БД ("SQLiteError...") - WARNING.
+    """
+    logger = get_logger("crud")
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = func(*args, **kwargs)
+            success, level = _is_success(result), _result_level(result)
+            if logger.isEnabledFor(level):
+                entity_id = result if type(result) is int else (args[0] if args else None)
+                if isinstance(entity_id, (list, tuple, set)): entity_id = f"{len(entity_id)} шт."
+                logger.log(level, f"{operation}: {'ok' if success else 'ошибка'}",
+                           extra={"operation": operation, "entity_id": entity_id, "result": None if success else str(result),
+                                  "duration_ms": round((time.perf_counter() - started) * 1000, 3)})
+            return result
+        return wrapper
+    return decorator
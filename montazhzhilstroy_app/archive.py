@@ -0,0 +1,72 @@
+import sqlite3
+from database import create_connection, ORDER_COLUMNS, ORDER_ITEM_COLUMNS
+
+CLOSED_ORDER_STATUSES = ('Выполнен', 'Отменен')
+DEFAULT_ARCHIVE_AGE_DAYS = 365
+DEFAULT_ARCHIVE_CHUNK_SIZE = 500
+
+def archive_closed_orders(older_than_days=DEFAULT_ARCHIVE_AGE_DAYS, chunk_size=DEFAULT_ARCHIVE_CHUNK_SIZE, vacuum=False):
+    """
+    Переносит закрытые заказы ('Выполнен', 'Отменен') старше older_than_days дней
+    в архивную БД. Каждая порция из chunk_size заказов переносится отдельной транзакцией,
+    поэтому оперативная БД не блокируется надолго.
+    Возвращает количество перенесенных заказов или строку с ошибкой.
+    """
+    if int(older_than_days) < 0 or int(chunk_size) <= 0:
+        return "InvalidArchiveParams"
+    conn = create_connection(attach_archive=True)
+    if conn is None: return "ConnectionError"
+
+    cur = conn.cursor()
+    archived_count = 0
+    try:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY);")
+        while True:
+            conn.execute("BEGIN IMMEDIATE TRANSACTION;") # Сразу берем блокировку на запись
+            cur.execute("DELETE FROM temp.archive_batch;")
+            cur.execute(f"""
+                INSERT INTO temp.archive_batch (id)
+                SELECT id FROM main.orders
+                WHERE status IN ({', '.join('?' for _ in CLOSED_ORDER_STATUSES)})
+                  AND order_date < datetime('now', ?)
+                ORDER BY id LIMIT ?
+            """, (*CLOSED_ORDER_STATUSES, f"-{int(older_than_days)} days", int(chunk_size)))
+            batch_size = cur.rowcount
+            if batch_size <= 0:
+                conn.execute("ROLLBACK;")
+                break
+
+            # Перенос в архив - не удаление: триггер аудита пропускает эти заказы (database.SQL_CREATE_AUDIT_SUPPRESSED_ORDERS_TABLE)
+            cur.execute("INSERT OR IGNORE INTO main.audit_suppressed_orders (order_id) SELECT id FROM temp.archive_batch;")
+            # OR REPLACE делает перенос идемпотентным, если прошлый запуск прервался между файлами
+            cur.execute(f"""
+                INSERT OR REPLACE INTO archive.orders ({ORDER_COLUMNS})
+                SELECT {ORDER_COLUMNS} FROM main.orders WHERE id IN (SELECT id FROM temp.archive_batch)
+            """)
+            cur.execute(f"""
+                INSERT OR REPLACE INTO archive.order_items ({ORDER_ITEM_COLUMNS})
+                SELECT {ORDER_ITEM_COLUMNS} FROM main.order_items WHERE order_id IN (SELECT id FROM temp.archive_batch)
+            """)
+            cur.execute("DELETE FROM main.orders WHERE id IN (SELECT id FROM temp.archive_batch);") # order_items удалятся каскадно
+            cur.execute("DELETE FROM main.audit_suppressed_orders;")
+            conn.commit()
+            archived_count += batch_size
+
+        if vacuum and archived_count > 0:
+            conn.execute("VACUUM main;") # Возвращаем освободившееся место файловой системе
+        return archived_count
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.execute("ROLLBACK;")
+        return f"SQLiteErrorArchive: {e}"
+    finally:
+        if conn: conn.close()
+
+def get_archive_stats():
+    """Возвращает количество заказов и позиций в архиве."""
+    conn = create_connection(attach_archive=True)
+    if conn is None: return None
+    cur = conn.cursor()
+    cur.execute("SELECT (SELECT COUNT(*) FROM archive.orders), (SELECT COUNT(*) FROM archive.order_items)")
+    row = cur.fetchone()
+    conn.close()
+    return {"orders": row[0], "order_items": row[1]}
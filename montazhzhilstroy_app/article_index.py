@@ -0,0 +1,52 @@
+import product_crud as pc
+
+def normalize_article(code):
+    """Артикул для поиска: без пробелов и в верхнем регистре ('ab-12 ' и 'AB-12' - один артикул)."""
+    return "".join(str(code).split()).upper() if code else ""
+
+class ArticleIndex:
+    """
+    Словарь артикул -> товар для режима сканера: поиск за O(1) без обращения к БД.
+    Держится в актуальном состоянии по журналу изменений (change_feed): refresh() перечитывает
+    только изменившиеся товары, None - весь список.
+    """
+    def __init__(self):
+        self.by_article = {}
+        self.article_by_id = {} # id -> ключ в by_article, чтобы убрать старый артикул при переименовании
+
+    def __len__(self):
+        return len(self.by_article)
+
+    def load(self):
+        self.by_article, self.article_by_id = {}, {}
+        for product in pc.get_all_products():
+            self._put(product)
+
+    def refresh(self, product_ids):
+        """Обновляет индекс по множеству измененных id товаров (из ChangeWatcher.poll); None - полная перезагрузка."""
+        if product_ids is None:
+            self.load(); return
+        fresh = {product["id"]: product for product in pc.get_products_by_ids(product_ids)}
+        for product_id in map(int, product_ids):
+            self._remove(product_id)
+            if product_id in fresh: self._put(fresh[product_id])
+
+    def get(self, product_id):
+        """Товар по id (тоже без обращения к БД) или None."""
+        key = self.article_by_id.get(int(product_id))
+        return self.by_article.get(key) if key is not None else None
+
+    def lookup(self, code):
+        """Товар (словарь как в get_all_products) по отсканированному коду или None."""
+        return self.by_article.get(normalize_article(code))
+
+    def _put(self, product):
+        key = normalize_article(product["article_number"])
+        if not key: return
+        self.by_article[key] = product
+        self.article_by_id[product["id"]] = key
+
+    def _remove(self, product_id):
+        key = self.article_by_id.pop(product_id, None)
+        if key is not None and self.by_article.get(key, {}).get("id") == product_id:
+            del self.by_article[key]
@@ -0,0 +1,194 @@
+import hashlib
+import io
+import mimetypes
+import os
+import sqlite3
+import threading
+from database import create_connection
+
+try:
+    from PIL import Image
+except ImportError: # Pillow необязателен: без него вложения работают, но миниатюры не строятся
+    Image = None
+
+BLOB_CHUNK_SIZE = 256 * 1024 # Вложения читаются и пишутся блоками через blobopen, целиком в память не грузятся
+MAX_ATTACHMENT_BYTES = 100 * 1024 * 1024
+THUMBNAIL_SIZE = (160, 160)
+THUMBNAIL_CACHE_DIR = "data/thumbnails"
+THUMBNAIL_CACHE_MAX_BYTES = 50 * 1024 * 1024
+IMAGE_MIME_PREFIX = "image/"
+
+def add_product_attachment(product_id, file_path):
+    """
+    Добавляет файл к товару. Содержимое пишется потоково: строка создается с zeroblob нужного размера
+    и заполняется блоками через Connection.blobopen, попутно считается SHA-256 (ключ кэша миниатюр).
+    """
+    try: size = os.path.getsize(file_path)
+    except OSError as e: return f"AttachmentFileError:{e}"
+    if size > MAX_ATTACHMENT_BYTES: return "AttachmentTooLargeError"
+    mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        conn.execute("BEGIN TRANSACTION;")
+        cur = conn.execute("INSERT INTO product_attachments (product_id, file_name, mime_type, size) VALUES (?, ?, ?, ?)",
+                           (product_id, os.path.basename(file_path), mime_type, size))
+        attachment_id = cur.lastrowid
+        conn.execute("INSERT INTO product_attachment_data (attachment_id, data) VALUES (?, zeroblob(?))", (attachment_id, size))
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as source, conn.blobopen("product_attachment_data", "data", attachment_id) as blob:
+            while True:
+                chunk = source.read(BLOB_CHUNK_SIZE)
+                if not chunk: break
+                if blob.tell() + len(chunk) > size: raise OSError("Файл изменился во время загрузки")
+                blob.write(chunk)
+                digest.update(chunk)
+        conn.execute("UPDATE product_attachments SET sha256 = ? WHERE id = ?", (digest.hexdigest(), attachment_id))
+        conn.commit()
+        return attachment_id
+    except OSError as e:
+        conn.rollback()
+        return f"AttachmentFileError:{e}"
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        return "NotFound" if "FOREIGN KEY" in str(e) else f"IntegrityError: {e}"
+    except sqlite3.Error as e:
+        conn.rollback()
+        return f"SQLiteErrorAttachment: {e}"
+    finally:
+        conn.close()
+
+def get_product_attachments(product_id):
+    """Список вложений товара - только метаданные, содержимое не читается."""
+    conn = create_connection()
+    if conn is None: return []
+    rows = conn.execute("""
+    SELECT id, file_name, mime_type, size, sha256, added_at FROM product_attachments
+    WHERE product_id = ? ORDER BY id
+    """, (product_id,)).fetchall()
+    conn.close()
+    return [{"id": row[0], "file_name": row[1], "mime_type": row[2], "size": row[3], "sha256": row[4],
+             "added_at": row[5], "is_image": (row[2] or "").startswith(IMAGE_MIME_PREFIX)} for row in rows]
+
+def iter_attachment_chunks(attachment_id, chunk_size=BLOB_CHUNK_SIZE):
+    """Отдает содержимое вложения блоками (bytes), не загружая его целиком."""
+    conn = create_connection()
+    if conn is None: return
+    try:
+        with conn.blobopen("product_attachment_data", "data", attachment_id, readonly=True) as blob:
+            while True:
+                chunk = blob.read(chunk_size)
+                if not chunk: break
+                yield chunk
+    finally:
+        conn.close()
+
+def export_product_attachment(attachment_id, destination_path):
+    """Сохраняет вложение в файл потоково; недописанный файл при ошибке удаляется."""
+    try:
+        with open(destination_path, "wb") as target:
+            for chunk in iter_attachment_chunks(attachment_id):
+                target.write(chunk)
+        return True
+    except (OSError, sqlite3.Error) as e:
+        try: os.remove(destination_path)
+        except OSError: pass
+        if isinstance(e, sqlite3.OperationalError): return "NotFound" # blobopen: нет строки с таким rowid
+        if isinstance(e, OSError): return f"AttachmentFileError:{e}"
+        return f"SQLiteErrorAttachment: {e}"
+
+def delete_product_attachment(attachment_id):
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        cur = conn.execute("DELETE FROM product_attachments WHERE id = ?", (attachment_id,)) # Данные удаляются каскадно
+        conn.commit()
+        return True if cur.rowcount > 0 else "NotFound"
+    except sqlite3.Error as e: return f"SQLiteErrorAttachment: {e}"
+    finally:
+        conn.close()
+
+class ThumbnailCache:
+    """
+    Дисковый LRU-кэш миниатюр: файл <sha256>_<ш>x<в>.png, время доступа - mtime файла.
+    Одинаковые картинки у разных товаров делят одну миниатюру. При превышении max_bytes
+    удаляются давно не использованные файлы.
+    """
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.cache_dir, self.max_bytes = cache_dir, max_bytes
+        self.lock = threading.Lock()
+        self.entries = None # {путь: [mtime, размер]}, читается с диска при первом обращении
+
+    def _load(self):
+        if self.entries is not None: return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = {}
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".png") and os.path.isfile(path):
+                stat = os.stat(path)
+                self.entries[path] = [stat.st_mtime, stat.st_size]
+
+    def path_for(self, sha256, size):
+        return os.path.join(self.cache_dir, f"{sha256}_{size[0]}x{size[1]}.png")
+
+    def get(self, sha256, size):
+        """Путь к миниатюре из кэша или None; попадание обновляет время использования."""
+        path = self.path_for(sha256, size)
+        with self.lock:
+            self._load()
+            entry = self.entries.get(path)
+            if entry is None: return None
+            if not os.path.exists(path):
+                del self.entries[path]; return None
+            os.utime(path)
+            entry[0] = os.stat(path).st_mtime
+        return path
+
+    def put(self, sha256, size, png_bytes):
+        path = self.path_for(sha256, size)
+        with self.lock:
+            self._load()
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f: f.write(png_bytes)
+            os.replace(tmp_path, path) # Читатель не увидит недописанный файл
+            self.entries[path] = [os.stat(path).st_mtime, len(png_bytes)]
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = sum(size for _, size in self.entries.values())
+        for path, (_, size) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes: break
+            try: os.remove(path)
+            except OSError: pass
+            del self.entries[path]
+            total -= size
+
+thumbnail_cache = ThumbnailCache()
+
+def get_cached_thumbnail(attachment, size=THUMBNAIL_SIZE):
+    """Путь к готовой миниатюре вложения из дискового кэша или None; картинку не читает - годится для потока Tk."""
+    if not attachment.get("is_image") or not attachment.get("sha256") or Image is None: return None
+    return thumbnail_cache.get(attachment["sha256"], size)
+
+def get_attachment_thumbnail(attachment, size=THUMBNAIL_SIZE):
+    """
+    Путь к PNG-миниатюре вложения-картинки (словарь из get_product_attachments) или None.
+    Миниатюра строится один раз и дальше берется из дискового кэша; без Pillow - всегда None.
+    Построение читает всю картинку (до MAX_ATTACHMENT_BYTES): из GUI вызывается в фоновом потоке.
+    """
+    cached = get_cached_thumbnail(attachment, size)
+    if cached: return cached
+    if not attachment.get("is_image") or not attachment.get("sha256") or Image is None: return None
+    try:
+        original = io.BytesIO()
+        for chunk in iter_attachment_chunks(attachment["id"]):
+            original.write(chunk)
+        original.seek(0)
+        with Image.open(original) as image:
+            image.thumbnail(size)
+            png = io.BytesIO()
+            image.save(png, format="PNG")
+    except (OSError, ValueError, sqlite3.Error): return None # Поврежденная картинка или неизвестный формат
+    return thumbnail_cache.put(attachment["sha256"], size, png.getvalue())
@@ -0,0 +1,198 @@
+"""
+Журнал аудита товаров, клиентов и заказов (таблица audit_log, пишется триггерами, см. database.AUDIT_TABLES).
+    python audit.py --history products 12      история одной сущности
+    python audit.py --prune --days 365         очистка записей старше срока хранения
+    python audit.py --stats                    размер журнала
+    python audit.py --benchmark                накладные расходы аудита на оформление заказов
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+import database
+from database import create_connection
+from money import from_kopecks
+
+AUDIT_RETENTION_DAYS = 365
+AUDIT_PRUNE_BATCH = 5000 # Записей за одну транзакцию очистки: оформление заказов не ждет ее целиком
+AUDIT_OPERATIONS = {"I": "Создание", "U": "Изменение", "D": "Удаление"}
+AUDIT_ENTITIES = ("products", "clients", "orders") # Позиции заказа входят в историю заказа
+AUDIT_COLUMN_TITLES = {
+    "name": "Название", "article_number": "Артикул", "category": "Категория", "description": "Описание", "price": "Цена",
+    "cost_price": "Закупочная цена", "reorder_level": "Мин. остаток", "added_date": "Добавлен",
+    "full_name": "ФИО", "phone_number": "Телефон", "email": "Email", "address": "Адрес", "registration_date": "Зарегистрирован",
+    "client_id": "Клиент (ID)", "order_date": "Дата заказа", "status": "Статус",
+    "product_id": "Товар (ID)", "quantity": "Количество", "price_per_unit": "Цена за ед.", "item": "Позиция",
+}
+AUDIT_MONEY_COLUMNS = ("price", "cost_price", "price_per_unit") # Хранятся в копейках
+
+def get_entity_history(table, row_id, limit=None):
+    """
+    История сущности, новые записи первыми: [{"id", "changed_at", "table", "operation", "changes"}].
+    Позиции заказа входят в его записи оформления и удаления (changes["items"]); в журналах, начатых до этого,
+    они записаны отдельно (table == "order_items", id позиции - changes["id"]) и тоже включаются.
+    """
+    if table not in AUDIT_ENTITIES: return f"InvalidAuditTableError:{table}"
+    tables = ("orders", "order_items") if table == "orders" else (table,)
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        rows = conn.execute(f"""
+            SELECT id, ts, table_name, operation, changes FROM audit_log
+            WHERE table_name IN ({', '.join('?' for _ in tables)}) AND row_id = ?
+            ORDER BY ts DESC, id DESC LIMIT ?""", (*tables, int(row_id), -1 if limit is None else int(limit))).fetchall()
+    except sqlite3.Error as e: return f"SQLiteErrorAudit: {e}"
+    finally:
+        conn.close()
+    return [{"id": entry_id, "changed_at": datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), "table": table_name,
+             "operation": operation, "changes": json.loads(changes)} for entry_id, ts, table_name, operation, changes in rows]
+
+def describe_changes(entry):
+    """
+    Строки (столбец, было, стало) записи истории. У вставки "было" - None, у удаления "стало" - None.
+    Каждая позиция заказа - отдельная строка ("item", ...) со словарем позиции в качестве значения.
+    """
+    rows = []
+    for column, value in entry["changes"].items():
+        if column == "id" and entry["table"] == "order_items": continue
+        if column == "items":
+            rows.extend(("item", None, item) if entry["operation"] == "I" else ("item", item, None) for item in value)
+            continue
+        if entry["operation"] == "U": old_value, new_value = value
+        elif entry["operation"] == "I": old_value, new_value = None, value
+        else: old_value, new_value = value, None
+        rows.append((column, old_value, new_value))
+    return rows
+
+def format_audit_value(column, value):
+    """Значение из журнала для показа: деньги - в рублях, отсутствующее - пустая строка."""
+    if value is None: return ""
+    if column == "item":
+        return f"{value['id']}: товар ID {value['product_id']}, {value['quantity']} шт. по {from_kopecks(value['price_per_unit']):.2f}"
+    if column in AUDIT_MONEY_COLUMNS: return f"{from_kopecks(value):.2f}"
+    return str(value)
+
+def prune_audit_log(retention_days=AUDIT_RETENTION_DAYS, batch_size=AUDIT_PRUNE_BATCH):
+    """
+    Удаляет записи старше retention_days пачками по batch_size, каждая пачка - своя короткая транзакция.
+    id растут вместе со временем, поэтому пачка берется с начала таблицы и очистка не сканирует свежие записи.
+    Возвращает число удаленных записей.
+    """
+    cutoff = int(time.time()) - int(retention_days) * 86400
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    deleted = 0
+    try:
+        while True:
+            cur = conn.execute("DELETE FROM audit_log WHERE id IN (SELECT id FROM audit_log ORDER BY id LIMIT ?) AND ts < ?",
+                               (int(batch_size), cutoff))
+            conn.commit()
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size: return deleted
+    except sqlite3.Error as e:
+        conn.rollback()
+        return f"SQLiteErrorAudit: {e}"
+    finally:
+        conn.close()
+
+def get_audit_stats():
+    """Объем журнала по таблицам: {таблица: {"entries", "bytes"}} (bytes - размер JSON изменений)."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        rows = conn.execute("SELECT table_name, COUNT(*), COALESCE(SUM(length(changes)), 0) FROM audit_log GROUP BY table_name").fetchall()
+        return {table: {"entries": entries, "bytes": size} for table, entries, size in rows}
+    except sqlite3.Error as e: return f"SQLiteErrorAudit: {e}"
+    finally:
+        conn.close()
+
+def _set_audit_triggers(db_path, enabled):
+    conn = sqlite3.connect(db_path)
+    try:
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name GLOB 'trg_*_audit_*'")]
+        for name in names: conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        if enabled:
+            for sql_statement in database._audit_trigger_sqls(): conn.execute(sql_statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+def benchmark_audit_overhead(db_path=database.DATABASE_NAME, orders=150, items_per_order=3, rounds=40, pooled=True):
+    """
+    Пропускная способность add_order с аудитом и без (триггеры аудита удаляются на копии db_path).
+    pooled - соединения из пула, как в GUI и API; без пула (отдельные скрипты) каждый вызов заново разбирает схему с триггерами.
+    Каждый раунд - пара замеров с аудитом и без, порядок в паре чередуется. Отдельные раунды на общем диске
+    расходятся на десятки процентов из-за fsync, поэтому итог - медиана по раундам, а не лучший раунд.
+    Возвращает {"with_audit", "without_audit" (медиана заказов в секунду), "overhead_pct" (медиана потери пропускной способности)}.
+    """
+    import order_crud as oc
+    workdir = tempfile.mkdtemp(prefix="audit_bench_", dir=os.path.dirname(os.path.abspath(db_path))) # Тот же диск, что у рабочей БД
+    copy_path = os.path.join(workdir, os.path.basename(db_path))
+    saved_name, saved_archive = database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(copy_path)
+    try: source.backup(target)
+    finally:
+        target.close(); source.close()
+    database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME = copy_path, os.path.join(workdir, "archive.db")
+    try:
+        database.disable_connection_pool()
+        database.initialize_database() # Копия старой БД получает таблицу и триггеры аудита
+        if pooled: database.enable_connection_pool()
+        conn = sqlite3.connect(copy_path)
+        client_id = conn.execute("SELECT id FROM clients ORDER BY id LIMIT 1").fetchone()[0]
+        product_ids = [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id LIMIT ?", (items_per_order,))]
+        conn.execute(f"UPDATE products SET stock_quantity = stock_quantity + ? WHERE id IN ({', '.join('?' for _ in product_ids)})",
+                     ((orders + 1) * rounds * 2, *product_ids))
+        conn.commit(); conn.close()
+        items = [{"product_id": product_id, "quantity": 1, "price_per_unit": "100.00"} for product_id in product_ids]
+        throughput = {True: [], False: []}
+        for round_no in range(rounds):
+            for enabled in ((True, False) if round_no % 2 == 0 else (False, True)):
+                _set_audit_triggers(copy_path, enabled)
+                oc.add_order(client_id, items) # Первый вызов после смены схемы заново готовит запросы - не в замер
+                started = time.perf_counter()
+                for _ in range(orders):
+                    result = oc.add_order(client_id, items)
+                    if not isinstance(result, int): return result
+                throughput[enabled].append(orders / (time.perf_counter() - started))
+        losses = [1 - with_audit / without_audit for with_audit, without_audit in zip(throughput[True], throughput[False])]
+        return {"with_audit": round(statistics.median(throughput[True]), 1), "without_audit": round(statistics.median(throughput[False]), 1),
+                "overhead_pct": round(statistics.median(losses) * 100, 1)}
+    finally:
+        database.disable_connection_pool()
+        database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME = saved_name, saved_archive
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Журнал аудита изменений")
+    parser.add_argument("--history", nargs=2, metavar=("TABLE", "ID"), help="история сущности: products, clients или orders и id")
+    parser.add_argument("--prune", action="store_true", help="удалить записи старше срока хранения")
+    parser.add_argument("--days", type=int, default=AUDIT_RETENTION_DAYS, help="срок хранения, дней")
+    parser.add_argument("--stats", action="store_true", help="размер журнала по таблицам")
+    parser.add_argument("--benchmark", action="store_true", help="замерить накладные расходы аудита на add_order")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.history:
+        history = get_entity_history(args.history[0], args.history[1])
+        if isinstance(history, str): print(history)
+        else:
+            for entry in history:
+                print(f"{entry['changed_at']}  {AUDIT_OPERATIONS[entry['operation']]}"
+                      f"{' позиции ' + str(entry['changes']['id']) if entry['table'] == 'order_items' else ''}")
+                for column, old_value, new_value in describe_changes(entry):
+                    print(f"    {AUDIT_COLUMN_TITLES.get(column, column)}: {format_audit_value(column, old_value)} -> {format_audit_value(column, new_value)}")
+    if args.prune: print(f"Удалено записей: {prune_audit_log(args.days)}")
+    if args.stats: print(get_audit_stats())
+    if args.benchmark:
+        report = benchmark_audit_overhead()
+        if isinstance(report, str): print(report)
+        else: print(f"С аудитом: {report['with_audit']} заказов/с, без аудита: {report['without_audit']} заказов/с, "
+                    f"накладные расходы: {report['overhead_pct']}%")
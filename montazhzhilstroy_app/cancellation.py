@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+CANCELLED = "Cancelled" # Код результата отмененной операции (как "NotFound" и другие строки CRUD-функций)
+PROGRESS_HANDLER_STEPS = 20000 # Инструкций виртуальной машины SQLite между проверками отмены (доли миллисекунды)
+
+class OperationCancelled(Exception):
+    """Бросается в коде между запросами (check()), когда операцию отменили."""
+
+class CancelToken:
+    """
+    Отмена и прогресс долгой операции. Создается в GUI, передается в функцию слоя данных (cancel_token=...),
+    которая работает в фоновом потоке. cancel() можно вызывать из любого потока:
+    идущий запрос прерывается через Connection.interrupt() и обработчик прогресса SQLite,
+    транзакция откатывается, функция возвращает CANCELLED.
+    progress(done, total) вызывается из потока операции; total=None - объем заранее неизвестен.
+    """
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.event = threading.Event()
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            try: conn.interrupt()
+            except sqlite3.ProgrammingError: pass # Соединение уже закрыто
+
+    def check(self):
+        if self.event.is_set(): raise OperationCancelled()
+
+    def report(self, done, total=None):
+        if self.progress is not None: self.progress(done, total)
+
+    @contextmanager
+    def watch(self, conn, steps=PROGRESS_HANDLER_STEPS):
+        """Пока блок выполняется, запросы conn прерываются отменой (sqlite3.OperationalError 'interrupted')."""
+        with self.lock:
+            self.connections.add(conn)
+        conn.set_progress_handler(self.event.is_set, steps) # Ненулевой ответ обработчика прерывает запрос
+        try:
+            self.check()
+            yield conn
+        finally:
+            conn.set_progress_handler(None, steps)
+            with self.lock:
+                self.connections.discard(conn)
+
+def watch(cancel_token, conn):
+    """token.watch(conn) или пустой контекст, если токена нет: для функций с необязательным cancel_token."""
+    return cancel_token.watch(conn) if cancel_token is not None else _no_watch(conn)
+
+@contextmanager
+def _no_watch(conn):
+    yield conn
+
+def is_interrupted(error, cancel_token):
+    """Ошибка SQLite вызвана отменой (а не сбоем БД)."""
+    return cancel_token is not None and cancel_token.cancelled and "interrupt" in str(error)
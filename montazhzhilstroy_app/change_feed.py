@@ -0,0 +1,116 @@
+import sqlite3
+from database import create_connection, CHANGE_FEED_TABLES
+
+DEFAULT_MAX_CHANGED_ROWS = 200 # Больше изменений за один опрос - дешевле перечитать таблицу целиком
+DEFAULT_CHANGE_LOG_KEEP = 10000
+
+class ChangeWatcher:
+    """
+    Дешевый опрос изменений БД, сделанных любым соединением (в том числе другими процессами).
+    Держит собственное соединение: PRAGMA data_version меняется только после чужих коммитов,
+    поэтому пока данные не менялись, опрос не читает ни одной таблицы.
+    """
+    def __init__(self, tables=CHANGE_FEED_TABLES, max_changed_rows=DEFAULT_MAX_CHANGED_ROWS):
+        self.tables = tuple(tables)
+        self.max_changed_rows = max_changed_rows
+        self.conn = None
+        self.data_version = None
+        self.table_versions = {}
+        self.last_seq = 0
+
+    def start(self):
+        """Открывает соединение и запоминает текущее состояние как исходное."""
+        self.conn = create_connection()
+        if self.conn is None: return "ConnectionError"
+        try:
+            self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            self.table_versions = self._read_table_versions()
+            self.last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        except sqlite3.Error as e:
+            self.close()
+            return f"SQLiteErrorChangeFeed: {e}"
+        return True
+
+    def _read_table_versions(self):
+        placeholders = ", ".join("?" for _ in self.tables)
+        rows = self.conn.execute(f"SELECT table_name, version FROM change_counters WHERE table_name IN ({placeholders})", self.tables).fetchall()
+        return dict(rows)
+
+    def poll(self):
+        """
+        Возвращает словарь {таблица: множество id измененных строк} только для изменившихся таблиц.
+        Значение None означает, что изменений слишком много (или журнал уже очищен) и таблицу
+        нужно перечитать целиком. Пустой словарь - изменений нет.
+        """
+        if self.conn is None: return {}
+        try:
+            data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version:
+                return {}
+            self.data_version = data_version
+
+            self.conn.execute("BEGIN;") # Счетчики и журнал читаем из одного снимка
+            try:
+                table_versions = self._read_table_versions()
+                changed_tables = [t for t in self.tables if table_versions.get(t) != self.table_versions.get(t)]
+                if not changed_tables:
+                    self.table_versions = table_versions
+                    return {}
+                min_seq = self.conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+                rows = self.conn.execute("SELECT seq, table_name, row_id FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                                         (self.last_seq, self.max_changed_rows * len(changed_tables) + 1)).fetchall()
+            finally:
+                self.conn.execute("COMMIT;")
+        except sqlite3.Error:
+            return {table: None for table in self.tables} # При ошибке безопаснее перечитать все
+
+        self.table_versions = table_versions
+        log_truncated = min_seq is None or min_seq > self.last_seq + 1 # Часть журнала удалена до нашего чтения
+        overflow = len(rows) > self.max_changed_rows * len(changed_tables)
+        changes = {table: set() for table in changed_tables}
+        for seq, table_name, row_id in rows:
+            if table_name in changes and changes[table_name] is not None:
+                changes[table_name].add(row_id)
+        if rows:
+            self.last_seq = rows[-1][0]
+        if log_truncated or overflow:
+            if overflow:
+                self.last_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+            return {table: None for table in changed_tables}
+        for table in changed_tables:
+            if len(changes[table]) > self.max_changed_rows:
+                changes[table] = None
+        return changes
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+def prune_change_log(keep_last=DEFAULT_CHANGE_LOG_KEEP):
+    """Удаляет старые записи журнала изменений, оставляя keep_last последних."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    cur = conn.cursor()
+    try:
+        cur.execute("DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?", (int(keep_last),))
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e: return f"SQLiteErrorChangeFeed: {e}"
+    finally:
+        if conn: conn.close()
+
+def get_change_counters(tables=CHANGE_FEED_TABLES):
+    """
+    Текущие версии таблиц из change_counters: {таблица: версия}. Версия растет при любом изменении
+    строк таблицы, поэтому по ней можно строить ETag без чтения самих данных.
+    """
+    tables = tuple(tables)
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        rows = conn.execute(f"SELECT table_name, version FROM change_counters WHERE table_name IN ({', '.join('?' for _ in tables)})", tables).fetchall()
+        return dict(rows)
+    except sqlite3.Error as e: return f"SQLiteErrorChangeFeed: {e}"
+    finally:
+        conn.close()
@@ -1,13 +1,24 @@
 import sqlite3
-from database import create_connection 
+from database import create_connection, attach_archive_database, archive_database_exists
+from contacts import normalize_phone, normalize_email
+from app_logging import log_crud
 
+def _email_taken(cur, email_norm, except_client_id=None):
+    """Есть ли другой клиент с тем же email с точностью до регистра и пробелов (поиск по индексу email_norm)."""
+    if email_norm is None: return False
+    cur.execute("SELECT 1 FROM clients WHERE email_norm = ? AND id IS NOT ? LIMIT 1", (email_norm, except_client_id))
+    return cur.fetchone() is not None
+
+@log_crud("add_client")
 def add_client(full_name, phone_number=None, email=None, address=None):
     conn = create_connection()
     if conn is None: return "ConnectionError"
-    sql = ''' INSERT INTO clients(full_name, phone_number, email, address) VALUES(?,?,?,?) '''
+    sql = ''' INSERT INTO clients(full_name, phone_number, email, address, phone_norm, email_norm) VALUES(?,?,?,?,?,?) '''
     cur = conn.cursor()
     try:
-        cur.execute(sql, (full_name, phone_number, email, address))
+        email_norm = normalize_email(email)
+        if _email_taken(cur, email_norm): return "EmailExistsError"
+        cur.execute(sql, (full_name, phone_number, email, address, normalize_phone(phone_number), email_norm))
         conn.commit()
         return cur.lastrowid
     except sqlite3.IntegrityError as e:
@@ -29,28 +40,46 @@ def get_client_by_id(client_id):
                 "email": row[3], "address": row[4], "registration_date": row[5]}
     return None
 
-def get_all_clients():
+def get_all_clients(limit=None, offset=0):
+    """Список клиентов по ФИО. limit/offset - постраничная выборка (limit=None - все клиенты)."""
     conn = create_connection()
     if conn is None: return []
     cur = conn.cursor()
-    cur.execute("SELECT id, full_name, email FROM clients ORDER BY full_name ASC") # Для комбобокса достаточно id и имени
+    cur.execute("SELECT id, full_name, email, phone_number, address FROM clients ORDER BY full_name ASC, id ASC LIMIT ? OFFSET ?",
+                (-1 if limit is None else int(limit), int(offset)))
     rows = cur.fetchall()
     conn.close()
     clients = []
     for row in rows:
-        clients.append({"id": row[0], "full_name": row[1], "email": row[2]})
+        clients.append({"id": row[0], "full_name": row[1], "email": row[2], "phone_number": row[3], "address": row[4]})
     return clients
 
+def get_clients_by_ids(client_ids):
+    """Получает строки списка клиентов (как в get_all_clients) только для указанных id."""
+    client_ids = [int(client_id) for client_id in client_ids]
+    if not client_ids: return []
+    conn = create_connection()
+    if conn is None: return []
+    cur = conn.cursor()
+    cur.execute(f"SELECT id, full_name, email, phone_number, address FROM clients WHERE id IN ({', '.join('?' for _ in client_ids)})", client_ids)
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": row[0], "full_name": row[1], "email": row[2], "phone_number": row[3], "address": row[4]} for row in rows]
+
+@log_crud("update_client")
 def update_client(client_id, full_name=None, phone_number=None, email=None, address=None):
     conn = create_connection()
     if conn is None: return "ConnectionError"
     cur = conn.cursor()
     fields_to_update, params = [], []
     if full_name is not None: fields_to_update.append("full_name = ?"); params.append(full_name)
-    if phone_number is not None: fields_to_update.append("phone_number = ?"); params.append(phone_number)
-    if email is not None: fields_to_update.append("email = ?"); params.append(email)
+    if phone_number is not None:
+        fields_to_update += ["phone_number = ?", "phone_norm = ?"]; params += [phone_number, normalize_phone(phone_number)]
+    if email is not None:
+        if _email_taken(cur, normalize_email(email), client_id): conn.close(); return "EmailExistsError"
+        fields_to_update += ["email = ?", "email_norm = ?"]; params += [email, normalize_email(email)]
     if address is not None: fields_to_update.append("address = ?"); params.append(address)
-    if not fields_to_update: return "NoDataToUpdate"
+    if not fields_to_update: conn.close(); return "NoDataToUpdate"
     sql = f"UPDATE clients SET {', '.join(fields_to_update)} WHERE id = ?"
     params.append(client_id)
     try:
@@ -64,11 +93,16 @@ def update_client(client_id, full_name=None, phone_number=None, email=None, addr
     finally:
         if conn: conn.close()
 
+@log_crud("delete_client")
 def delete_client(client_id):
     conn = create_connection()
     if conn is None: return "ConnectionError"
     cur = conn.cursor()
     try:
+        if archive_database_exists(): # Внешние ключи не действуют между файлами, проверяем архив вручную
+            attach_archive_database(conn)
+            cur.execute("SELECT 1 FROM archive.orders WHERE client_id = ? LIMIT 1", (client_id,))
+            if cur.fetchone(): return "HasOrdersError"
         cur.execute('DELETE FROM clients WHERE id=?', (client_id,))
         conn.commit()
         return True if cur.rowcount > 0 else "NotFound"
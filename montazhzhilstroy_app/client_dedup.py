@@ -0,0 +1,222 @@
+import re
+import sqlite3
+import time
+from itertools import combinations
+from database import create_connection, attach_archive_database, archive_database_exists
+from contacts import normalize_phone, normalize_email
+from client_stats import rebuild_client_stats
+
+MAX_BLOCK_SIZE = 50 # Большие блоки (частое имя, общий телефон офиса) не сравниваем: O(n^2) внутри блока
+DEFAULT_MIN_SCORE = 0.5
+# Вес признаков в оценке пары; одно похожее ФИО без подтверждения контактами порог не проходит
+SCORE_WEIGHTS = {"name": 0.45, "phone": 0.35, "email": 0.35, "email_local": 0.15, "address": 0.1}
+
+# Упрощенный фонетический ключ для русских имен: оглушение согласных, редукция гласных, без ь/ъ
+PHONETIC_TABLE = str.maketrans({"ё": "и", "е": "и", "э": "и", "ы": "и", "й": "и", "я": "а", "о": "а", "ю": "у",
+                                "б": "п", "в": "ф", "г": "к", "д": "т", "ж": "ш", "з": "с", "щ": "ш", "ъ": None, "ь": None})
+NON_LETTERS_RE = re.compile(r"[^a-zа-яё]+")
+REPEATS_RE = re.compile(r"(.)\1+")
+
+def _name_tokens(full_name):
+    return [token for token in NON_LETTERS_RE.sub(" ", (full_name or "").lower()).split() if len(token) > 1]
+
+def phonetic_key(word):
+    code = word.lower().translate(PHONETIC_TABLE)
+    return REPEATS_RE.sub(r"\1", code) if REPEATS_RE.search(code) else code
+
+def _trigrams(full_name):
+    text = f"  {' '.join(sorted(_name_tokens(full_name))).replace('ё', 'е')} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _email_local(email_norm):
+    """Локальная часть адреса без точек и '+метки': ivan.petrov+shop@x.ru -> ivanpetrov."""
+    return email_norm.split("@", 1)[0].split("+", 1)[0].replace(".", "") if email_norm else None
+
+def blocking_keys(full_name, phone_norm, email_norm, phonetic_cache=None):
+    """
+    Ключи блоков клиента: кандидаты в дубли сравниваются только внутри общего блока.
+    phonetic_cache - словарь для запоминания фонетических ключей (имена сильно повторяются).
+    """
+    if phonetic_cache is None: phonetic_cache = {}
+    def code(token):
+        cached = phonetic_cache.get(token)
+        if cached is None: cached = phonetic_cache[token] = phonetic_key(token)
+        return cached
+    keys = []
+    if phone_norm: keys.append("p:" + phone_norm[-10:])
+    local = _email_local(email_norm)
+    if local and len(local) >= 3: keys.append("e:" + local)
+    tokens = _name_tokens(full_name)
+    if tokens:
+        codes = sorted(code(token) for token in tokens)
+        keys.append("n:" + " ".join(codes)) # Полное ФИО в любом порядке слов
+        if len(tokens) > 1: # Фамилия + инициал: 'Иванов Иван Иванович' и 'Иванов И.'
+            longest = max(tokens, key=len)
+            initials = sorted(token[0] for token in tokens if token is not longest)
+            keys.append(f"i:{code(longest)} {initials[0]}")
+    return keys
+
+def _contact_score(a, b):
+    """Вклад контактов (без ФИО) - дешевое сравнение кортежей (телефон, email, имя ящика, адрес)."""
+    score = 0.0
+    if a[0] and a[0] == b[0]: score += SCORE_WEIGHTS["phone"]
+    if a[1] and a[1] == b[1]: score += SCORE_WEIGHTS["email"]
+    elif a[2] and a[2] == b[2]: score += SCORE_WEIGHTS["email_local"]
+    if a[3] and a[3] == b[3]: score += SCORE_WEIGHTS["address"]
+    return score
+
+def score_pair(a, b):
+    """Оценка 0..1 и список совпавших признаков для пары клиентов (словари с *_norm полями и trigrams)."""
+    reasons, score = [], 0.0
+    union = len(a["trigrams"] | b["trigrams"])
+    name_similarity = len(a["trigrams"] & b["trigrams"]) / union if union else 0.0
+    if name_similarity >= 0.3:
+        score += SCORE_WEIGHTS["name"] * name_similarity; reasons.append(f"ФИО {name_similarity:.0%}")
+    if a["phone_norm"] and a["phone_norm"] == b["phone_norm"]:
+        score += SCORE_WEIGHTS["phone"]; reasons.append("телефон")
+    if a["email_norm"] and a["email_norm"] == b["email_norm"]:
+        score += SCORE_WEIGHTS["email"]; reasons.append("email")
+    elif a["email_local"] and a["email_local"] == b["email_local"]:
+        score += SCORE_WEIGHTS["email_local"]; reasons.append("имя ящика email")
+    if a["address"] and a["address"] == b["address"]:
+        score += SCORE_WEIGHTS["address"]; reasons.append("адрес")
+    return min(score, 1.0), reasons
+
+def find_duplicate_clients(min_score=DEFAULT_MIN_SCORE, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Ищет вероятные дубли среди всех клиентов: блокировка по ключам, сравнение пар только внутри блоков.
+    Найденные пары заменяют прежний список на проверку (client_duplicate_candidates со статусом 'new');
+    пары, отмеченные как 'не дубль', повторно не предлагаются.
+    Возвращает {"clients", "blocks", "pairs_compared", "pairs_scored", "candidates", "elapsed_s"} или строку ошибки.
+    """
+    started = time.perf_counter()
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        clients, contacts, blocks, phonetic_cache = {}, {}, {}, {}
+        for client_id, full_name, address, phone_norm, email_norm in conn.execute(
+                "SELECT id, full_name, address, phone_norm, email_norm FROM clients"):
+            for key in blocking_keys(full_name, phone_norm, email_norm, phonetic_cache):
+                blocks.setdefault(key, []).append(client_id)
+            clients[client_id] = full_name
+            contacts[client_id] = (phone_norm, email_norm, _email_local(email_norm),
+                                   " ".join(address.lower().split()) if address else None)
+
+        # Пары из блоков отсеиваются по верхней оценке: ФИО дает не больше своего веса,
+        # поэтому дорогое сравнение триграмм делается только для пар, способных пройти порог
+        name_weight = SCORE_WEIGHTS["name"]
+        pairs, pairs_compared, used_blocks = set(), 0, 0
+        for ids in blocks.values():
+            if not 1 < len(ids) <= max_block_size: continue
+            used_blocks += 1
+            ids.sort()
+            for client_id, duplicate_id in combinations(ids, 2):
+                pairs_compared += 1
+                if _contact_score(contacts[client_id], contacts[duplicate_id]) + name_weight >= min_score:
+                    pairs.add((client_id, duplicate_id))
+
+        trigrams = {}
+        def feature(client_id):
+            grams = trigrams.get(client_id)
+            if grams is None: grams = trigrams[client_id] = _trigrams(clients[client_id])
+            phone_norm, email_norm, email_local, address = contacts[client_id]
+            return {"trigrams": grams, "phone_norm": phone_norm, "email_norm": email_norm,
+                    "email_local": email_local, "address": address}
+
+        candidates = []
+        for client_id, duplicate_id in pairs:
+            score, reasons = score_pair(feature(client_id), feature(duplicate_id))
+            if score >= min_score:
+                candidates.append((client_id, duplicate_id, round(score, 3), ", ".join(reasons)))
+
+        conn.execute("BEGIN TRANSACTION;")
+        conn.execute("DELETE FROM client_duplicate_candidates WHERE status = 'new'")
+        conn.executemany("""INSERT OR IGNORE INTO client_duplicate_candidates (client_id, duplicate_id, score, reasons)
+                            VALUES (?, ?, ?, ?)""", candidates)
+        conn.commit()
+        return {"clients": len(clients), "blocks": used_blocks, "pairs_compared": pairs_compared, "pairs_scored": len(pairs),
+                "candidates": len(candidates), "elapsed_s": round(time.perf_counter() - started, 3)}
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorDedup: {e}"
+    finally:
+        conn.close()
+
+def get_duplicate_candidates(limit=500):
+    """Пары на проверку, самые вероятные первыми."""
+    conn = create_connection()
+    if conn is None: return []
+    rows = conn.execute("""
+    SELECT d.id, d.score, d.reasons,
+           a.id, a.full_name, a.phone_number, a.email,
+           b.id, b.full_name, b.phone_number, b.email
+    FROM client_duplicate_candidates d
+    JOIN clients a ON a.id = d.client_id
+    JOIN clients b ON b.id = d.duplicate_id
+    WHERE d.status = 'new'
+    ORDER BY d.score DESC, d.id
+    LIMIT ?
+    """, (int(limit),)).fetchall()
+    conn.close()
+    return [{"id": row[0], "score": row[1], "reasons": row[2],
+             "client": {"id": row[3], "full_name": row[4], "phone_number": row[5], "email": row[6]},
+             "duplicate": {"id": row[7], "full_name": row[8], "phone_number": row[9], "email": row[10]}} for row in rows]
+
+def dismiss_duplicate_candidate(candidate_id):
+    """Отмечает пару как 'не дубль': при следующем поиске она не появится."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        cur = conn.execute("UPDATE client_duplicate_candidates SET status = 'dismissed' WHERE id = ?", (candidate_id,))
+        conn.commit()
+        return True if cur.rowcount > 0 else "NotFound"
+    except sqlite3.Error as e: return f"SQLiteErrorDedup: {e}"
+    finally:
+        conn.close()
+
+def merge_clients(keep_id, duplicate_id):
+    """
+    Объединяет дубль с основным клиентом в одной транзакции: заказы (и архивные) переводятся на keep_id,
+    пустые поля основного клиента заполняются данными дубля, дубль удаляется.
+    Пары с дублем в списке на проверку удаляются каскадно.
+    """
+    if int(keep_id) == int(duplicate_id): return "SameClientError"
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        if archive_database_exists(): attach_archive_database(conn) # ATTACH нельзя внутри транзакции
+        conn.execute("BEGIN TRANSACTION;")
+        cur = conn.cursor()
+        cur.execute("SELECT id, full_name, phone_number, email, address FROM clients WHERE id IN (?, ?)", (keep_id, duplicate_id))
+        found = {row[0]: row for row in cur.fetchall()}
+        if len(found) < 2:
+            conn.rollback()
+            return "NotFound"
+        _, _, dup_phone, dup_email, dup_address = found[int(duplicate_id)]
+        cur.execute("UPDATE orders SET client_id = ? WHERE client_id = ?", (keep_id, duplicate_id))
+        if archive_database_exists():
+            cur.execute("UPDATE archive.orders SET client_id = ? WHERE client_id = ?", (keep_id, duplicate_id))
+        cur.execute("DELETE FROM clients WHERE id = ?", (duplicate_id,)) # До переноса email: он UNIQUE
+        cur.execute("""
+        UPDATE clients SET
+            phone_number = COALESCE(NULLIF(phone_number, ''), ?),
+            email = COALESCE(NULLIF(email, ''), ?),
+            address = COALESCE(NULLIF(address, ''), ?)
+        WHERE id = ?
+        """, (dup_phone, dup_email, dup_address, keep_id))
+        phone, email = cur.execute("SELECT phone_number, email FROM clients WHERE id = ?", (keep_id,)).fetchone()
+        cur.execute("UPDATE clients SET phone_norm = ?, email_norm = ? WHERE id = ?",
+                    (normalize_phone(phone), normalize_email(email), keep_id))
+        rebuild_client_stats([keep_id], conn=conn) # Итоги дубля удалились вместе с ним, у основного - пересчет по всем заказам
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorDedup: {e}"
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    print(find_duplicate_clients())
+    for candidate in get_duplicate_candidates(20):
+        print(f"{candidate['score']:.2f}  {candidate['client']['full_name']} / {candidate['duplicate']['full_name']}  ({candidate['reasons']})")
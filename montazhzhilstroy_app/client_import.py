@@ -0,0 +1,237 @@
+import csv
+import os
+import sqlite3
+import time
+from database import create_connection
+from contacts import normalize_phone, normalize_email
+from cancellation import OperationCancelled, watch, is_interrupted
+
+DEFAULT_IMPORT_CHUNK_SIZE = 5000 # Строк в одной транзакции
+CLIENT_IMPORT_FIELDS = ("full_name", "phone_number", "email", "address")
+# Допустимые заголовки столбцов CSV (без учета регистра)
+IMPORT_COLUMN_ALIASES = {
+    "full_name": ("full_name", "фио", "клиент", "имя", "name"),
+    "phone_number": ("phone_number", "phone", "телефон"),
+    "email": ("email", "e-mail", "почта"),
+    "address": ("address", "адрес"),
+}
+# Итог по строке файла для отчета
+IMPORT_ACTIONS = ("inserted", "merged", "unchanged", "duplicate_in_file", "conflict", "invalid")
+REPORT_COLUMNS = ("row_number", "action", "client_id", "full_name", "details")
+AMBIGUOUS = object() # Один телефон у нескольких клиентов БД: по нему одному сопоставлять нельзя
+
+class _ClientRecord:
+    """Клиент (из БД или новый из файла), с которым сопоставляются строки импорта."""
+    __slots__ = ("id", "values", "dirty")
+
+    def __init__(self, client_id, values):
+        self.id, self.values, self.dirty = client_id, values, False
+
+def _clean(value):
+    value = (value or "").strip()
+    return value or None
+
+def _same_name(a, b):
+    return " ".join(a.split()).casefold() == " ".join(b.split()).casefold()
+
+class ClientImporter:
+    """
+    Потоковый импорт клиентов: строки обрабатываются блоками по chunk_size, каждый блок - одна транзакция.
+    Существующие клиенты ищутся по индексированным clients.email_norm / phone_norm только для ключей блока.
+    Совпадение по email важнее совпадения по телефону; найденный клиент дополняется пустыми полями
+    (заполненные поля не перезаписываются, расхождения попадают в отчет).
+    При отмене (cancel_token) блок, который пишется, откатывается; уже записанные блоки остаются,
+    сводка получает "cancelled": True и считает только их.
+    """
+    def __init__(self, report_writer=None, chunk_size=DEFAULT_IMPORT_CHUNK_SIZE, cancel_token=None):
+        self.report_writer = report_writer
+        self.chunk_size = chunk_size
+        self.cancel_token = cancel_token
+        self.by_email, self.by_phone = {}, {}
+        self.loaded_ids = set()
+        self.counts = dict.fromkeys(IMPORT_ACTIONS, 0)
+
+    def run(self, rows):
+        """rows - итерируемое из (номер строки, словарь с полями CLIENT_IMPORT_FIELDS). Возвращает сводку или строку ошибки."""
+        conn = create_connection()
+        if conn is None: return "ConnectionError"
+        started = time.perf_counter()
+        total, cancelled = 0, False
+        try:
+            with watch(self.cancel_token, conn):
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_keys (kind TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (kind, key)) WITHOUT ROWID")
+                chunk = []
+                for row in rows:
+                    chunk.append(row)
+                    if len(chunk) >= self.chunk_size:
+                        total += self._process_tracked_chunk(conn, chunk, total); chunk = []
+                if chunk:
+                    total += self._process_tracked_chunk(conn, chunk, total)
+        except OperationCancelled:
+            if conn.in_transaction: conn.rollback()
+            cancelled = True
+        except sqlite3.Error as e:
+            if conn.in_transaction: conn.rollback()
+            if not is_interrupted(e, self.cancel_token): return f"SQLiteErrorImport: {e}"
+            cancelled = True
+        finally:
+            conn.close()
+        elapsed = time.perf_counter() - started
+        return {"rows": total, **self.counts, "elapsed_s": round(elapsed, 3),
+                "rows_per_second": round(total / elapsed) if elapsed else total, "cancelled": cancelled}
+
+    def _process_tracked_chunk(self, conn, chunk, done):
+        if self.cancel_token is not None: self.cancel_token.check()
+        self._process_chunk(conn, chunk)
+        if self.cancel_token is not None: self.cancel_token.report(done + len(chunk))
+        return len(chunk)
+
+    def _load_existing(self, conn, parsed):
+        """Подгружает клиентов БД, совпадающих с ключами блока, одним запросом по индексам."""
+        keys = {("e", values["email_norm"]) for _, values in parsed if values and values["email_norm"] and values["email_norm"] not in self.by_email}
+        keys |= {("p", values["phone_norm"]) for _, values in parsed if values and values["phone_norm"] and values["phone_norm"] not in self.by_phone}
+        if not keys: return
+        conn.execute("DELETE FROM temp.import_keys")
+        conn.executemany("INSERT OR IGNORE INTO temp.import_keys (kind, key) VALUES (?, ?)", keys)
+        rows = conn.execute("""
+        SELECT id, full_name, phone_number, email, address, phone_norm, email_norm FROM clients
+        WHERE email_norm IN (SELECT key FROM temp.import_keys WHERE kind = 'e')
+        UNION
+        SELECT id, full_name, phone_number, email, address, phone_norm, email_norm FROM clients
+        WHERE phone_norm IN (SELECT key FROM temp.import_keys WHERE kind = 'p')
+        ORDER BY 1
+        """).fetchall()
+        for client_id, full_name, phone, email, address, phone_norm, email_norm in rows:
+            if client_id in self.loaded_ids: continue
+            self.loaded_ids.add(client_id)
+            record = _ClientRecord(client_id, {"full_name": full_name, "phone_number": phone, "email": email, "address": address,
+                                               "phone_norm": phone_norm, "email_norm": email_norm})
+            if email_norm: self.by_email.setdefault(email_norm, record)
+            if phone_norm:
+                known = self.by_phone.get(phone_norm)
+                self.by_phone[phone_norm] = record if known is None else AMBIGUOUS
+
+    def _parse(self, fields):
+        values = {name: _clean(fields.get(name)) for name in CLIENT_IMPORT_FIELDS}
+        if not values["full_name"]: return None, "не указано ФИО"
+        values["phone_norm"] = normalize_phone(values["phone_number"])
+        values["email_norm"] = normalize_email(values["email"])
+        if values["email"] and values["email_norm"] is None: return None, f"некорректный email '{values['email']}'"
+        return values, None
+
+    def _match(self, row_number, values, report):
+        email_match = self.by_email.get(values["email_norm"]) if values["email_norm"] else None
+        phone_match = self.by_phone.get(values["phone_norm"]) if values["phone_norm"] else None
+        if phone_match is AMBIGUOUS:
+            if email_match is None:
+                report.append((row_number, "conflict", None, values["full_name"], "телефон есть у нескольких клиентов")); return
+            phone_match = None
+        if email_match is not None and phone_match is not None and email_match is not phone_match:
+            report.append((row_number, "conflict", None, values["full_name"],
+                           "email и телефон принадлежат разным клиентам")); return
+        target = email_match or phone_match
+        if target is None:
+            record = _ClientRecord(None, values)
+            if values["email_norm"]: self.by_email[values["email_norm"]] = record
+            if values["phone_norm"]: self.by_phone.setdefault(values["phone_norm"], record)
+            report.append((row_number, "inserted", record, values["full_name"], ""))
+            return record
+
+        filled, differences = [], []
+        for name in CLIENT_IMPORT_FIELDS:
+            new_value, old_value = values[name], target.values[name]
+            if new_value is None: continue
+            if old_value is None:
+                target.values[name] = new_value; filled.append(name)
+            elif name == "full_name" and not _same_name(old_value, new_value) or \
+                 name == "phone_number" and normalize_phone(old_value) != values["phone_norm"] or \
+                 name == "address" and old_value.strip() != new_value:
+                differences.append(f"{name}: '{old_value}' -> '{new_value}' (не изменено)")
+        if "phone_number" in filled:
+            target.values["phone_norm"] = values["phone_norm"]
+            if values["phone_norm"]: self.by_phone.setdefault(values["phone_norm"], target)
+        if "email" in filled:
+            target.values["email_norm"] = values["email_norm"]
+            self.by_email[values["email_norm"]] = target
+        if filled and target.id is not None: target.dirty = True
+        action = "duplicate_in_file" if target.id is None or target.id not in self.loaded_ids else ("merged" if filled else "unchanged")
+        details = "; ".join(([f"дополнено: {', '.join(filled)}"] if filled else []) + differences)
+        report.append((row_number, action, target, values["full_name"], details))
+
+    def _process_chunk(self, conn, chunk):
+        parsed, report = [], []
+        for row_number, fields in chunk:
+            values, error = self._parse(fields)
+            if error: report.append((row_number, "invalid", None, _clean(fields.get("full_name")), error))
+            else: parsed.append((row_number, values))
+        conn.execute("BEGIN TRANSACTION;") # Поиск и запись блока - в одной транзакции
+        self._load_existing(conn, parsed)
+
+        new_records = []
+        for row_number, values in parsed:
+            record = self._match(row_number, values, report)
+            if record is not None: new_records.append(record)
+
+        cur = conn.cursor()
+        for record in new_records:
+            v = record.values
+            cur.execute("INSERT INTO clients (full_name, phone_number, email, address, phone_norm, email_norm) VALUES (?, ?, ?, ?, ?, ?)",
+                        (v["full_name"], v["phone_number"], v["email"], v["address"], v["phone_norm"], v["email_norm"]))
+            record.id = cur.lastrowid
+        dirty = {id(record): record for _, _, record, _, _ in report if isinstance(record, _ClientRecord) and record.dirty}
+        cur.executemany("UPDATE clients SET full_name = ?, phone_number = ?, email = ?, address = ?, phone_norm = ?, email_norm = ? WHERE id = ?",
+                        [(r.values["full_name"], r.values["phone_number"], r.values["email"], r.values["address"],
+                          r.values["phone_norm"], r.values["email_norm"], r.id) for r in dirty.values()])
+        conn.commit()
+        for record in dirty.values(): record.dirty = False
+
+        for row_number, action, record, full_name, details in sorted(report, key=lambda entry: entry[0]):
+            self.counts[action] += 1
+            if self.report_writer is not None:
+                self.report_writer.writerow((row_number, action, record.id if isinstance(record, _ClientRecord) else "",
+                                             full_name or "", details))
+
+def _read_csv_rows(file, delimiter=None):
+    """Строки CSV как (номер строки файла, словарь полей); заголовки сопоставляются через IMPORT_COLUMN_ALIASES."""
+    if delimiter is None:
+        sample = file.read(8192); file.seek(0)
+        try: delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+        except csv.Error: delimiter = ","
+    reader = csv.reader(file, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None: return
+    columns = {}
+    for index, title in enumerate(header):
+        for field, aliases in IMPORT_COLUMN_ALIASES.items():
+            if title.strip().lower() in aliases and field not in columns: columns[field] = index
+    if "full_name" not in columns: raise ValueError("В файле нет столбца с ФИО клиента")
+    for row in reader:
+        if not any(cell.strip() for cell in row): continue
+        yield reader.line_num, {field: row[index] if index < len(row) else None for field, index in columns.items()}
+
+def import_clients_csv(path, report_path=None, chunk_size=DEFAULT_IMPORT_CHUNK_SIZE, delimiter=None, encoding="utf-8-sig",
+                       cancel_token=None):
+    """
+    Импортирует клиентов из CSV (заголовки: ФИО/full_name, Телефон, Email, Адрес; разделитель определяется сам).
+    Отчет о каждой строке (вставлена, объединена, дубль, конфликт, ошибка) пишется в report_path,
+    по умолчанию рядом с файлом: <имя>_import_report.csv. Возвращает сводку (словарь) или строку ошибки.
+    cancel_token - прогресс по строкам и отмена (см. ClientImporter).
+    """
+    if report_path is None: report_path = os.path.splitext(path)[0] + "_import_report.csv"
+    try:
+        with open(path, newline="", encoding=encoding) as source, \
+             open(report_path, "w", newline="", encoding="utf-8-sig") as report_file:
+            writer = csv.writer(report_file, delimiter=";")
+            writer.writerow(REPORT_COLUMNS)
+            result = ClientImporter(writer, chunk_size, cancel_token).run(_read_csv_rows(source, delimiter))
+    except (OSError, UnicodeDecodeError, csv.Error) as e: return f"ImportFileError:{e}"
+    except ValueError as e: return f"ImportFileError:{e}"
+    if isinstance(result, dict): result["report_path"] = report_path
+    return result
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print("Использование: python client_import.py clients.csv [отчет.csv]")
+    else:
+        print(import_clients_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,157 @@
+"""
+Накопленные итоги по клиентам (таблицы client_stats и client_product_totals) для карточки клиента.
+Итоги меняются инкрементально в транзакциях order_crud: вклад заказа прибавляется при оформлении,
+вычитается при удалении, а при смене статуса вычитается до UPDATE и прибавляется после.
+Архивация заказов итогов не меняет: архивные заказы в них остаются.
+    python client_stats.py --rebuild      пересчитать итоги всех клиентов с нуля
+    python client_stats.py --client 12    итоги одного клиента
+"""
+import argparse
+import sqlite3
+from database import create_connection, attach_archive_database, archive_database_exists, is_archive_attached
+from money import from_kopecks
+
+CANCELLED_STATUS = 'Отменен' # Отмененный заказ не входит в выручку и в купленные товары
+CLOSED_STATUSES = ('Выполнен', 'Отменен') # Остальные статусы - открытые заказы (как order_crud.STOCK_RELEASED_STATUSES)
+TOP_PRODUCTS_LIMIT = 5
+
+def _apply_orders(conn, where, params, sign, products):
+    """
+    Прибавляет (sign=1) или вычитает (sign=-1) вклад заказов main.orders o, отобранных условием where,
+    в итоги их клиентов. Вклад считается по текущим строкам заказов.
+    Дату последнего заказа вычитание не трогает - ее пересчитывает refresh_last_order_dates.
+    """
+    params = dict(params or {}, sign=sign, cancelled=CANCELLED_STATUS, done=CLOSED_STATUSES[0])
+    conn.execute(f"""
+        INSERT INTO client_stats (client_id, order_count, cancelled_count, open_count, revenue, last_order_date)
+        SELECT o.client_id, :sign * COUNT(*), :sign * SUM(o.status = :cancelled), :sign * SUM(o.status NOT IN (:done, :cancelled)),
+               :sign * COALESCE(SUM(CASE WHEN o.status != :cancelled THEN o.total_amount END), 0), MAX(o.order_date)
+        FROM orders o WHERE {where} GROUP BY o.client_id
+        ON CONFLICT (client_id) DO UPDATE SET
+            order_count = order_count + excluded.order_count,
+            cancelled_count = cancelled_count + excluded.cancelled_count,
+            open_count = open_count + excluded.open_count,
+            revenue = revenue + excluded.revenue,
+            last_order_date = CASE WHEN :sign > 0 THEN MAX(COALESCE(last_order_date, ''), excluded.last_order_date) ELSE last_order_date END
+    """, params)
+    if not products: return
+    conn.execute(f"""
+        INSERT INTO client_product_totals (client_id, product_id, quantity, amount)
+        SELECT o.client_id, oi.product_id, :sign * SUM(oi.quantity), :sign * SUM(oi.quantity * oi.price_per_unit)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE ({where}) AND o.status != :cancelled GROUP BY o.client_id, oi.product_id
+        ON CONFLICT (client_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity, amount = amount + excluded.amount
+    """, params)
+    if sign < 0:
+        conn.execute(f"""
+            DELETE FROM client_product_totals WHERE quantity <= 0
+            AND client_id IN (SELECT o.client_id FROM orders o WHERE {where})""", params)
+
+def add_orders_to_stats(conn, where, params=None, products=True):
+    """Учитывает заказы (условие where по orders o, именованные параметры params) в открытой транзакции conn."""
+    _apply_orders(conn, where, params, 1, products)
+
+def remove_orders_from_stats(conn, where, params=None, products=True):
+    """
+    Вычитает вклад заказов из итогов; вызывается до удаления или изменения заказов в той же транзакции.
+    products=False - товары не пересчитываются (смена статуса, при которой заказ не отменяется и не восстанавливается).
+    """
+    _apply_orders(conn, where, params, -1, products)
+
+def refresh_last_order_dates(conn, client_ids):
+    """Пересчитывает дату последнего заказа клиентов после удаления заказов (из индекса idx_orders_client_date)."""
+    client_ids = [int(client_id) for client_id in set(client_ids)]
+    if not client_ids: return
+    archive_max = ("COALESCE((SELECT MAX(a.order_date) FROM archive.orders a WHERE a.client_id = client_stats.client_id), '')"
+                   if is_archive_attached(conn) else "''")
+    conn.execute(f"""
+        UPDATE client_stats SET last_order_date = NULLIF(MAX(
+            COALESCE((SELECT MAX(o.order_date) FROM orders o WHERE o.client_id = client_stats.client_id), ''), {archive_max}), '')
+        WHERE client_id IN ({', '.join('?' for _ in client_ids)})""", client_ids)
+
+def _rebuild(conn, client_ids=None):
+    """Пересчет итогов с нуля по заказам main и (если подключен) archive, в открытой транзакции conn."""
+    schemas = ("main", "archive") if is_archive_attached(conn) else ("main",)
+    client_filter, params = "", []
+    if client_ids is not None:
+        client_ids = [int(client_id) for client_id in set(client_ids)]
+        client_filter, params = f"client_id IN ({', '.join('?' for _ in client_ids)})", client_ids
+    where = f"WHERE {client_filter}" if client_filter else ""
+    orders = " UNION ALL ".join(f"SELECT client_id, order_date, status, total_amount FROM {schema}.orders {where}"
+                                for schema in schemas)
+    items = " UNION ALL ".join(f"""
+        SELECT o.client_id, oi.product_id, oi.quantity, oi.price_per_unit FROM {schema}.orders o
+        JOIN {schema}.order_items oi ON oi.order_id = o.id
+        WHERE o.status != ? {'AND o.' + client_filter if client_filter else ''}""" for schema in schemas)
+    conn.execute(f"DELETE FROM client_stats {where}", params)
+    conn.execute(f"DELETE FROM client_product_totals {where}", params)
+    conn.execute(f"""
+        INSERT INTO client_stats (client_id, order_count, cancelled_count, open_count, revenue, last_order_date)
+        SELECT client_id, COUNT(*), SUM(status = ?), SUM(status NOT IN (?, ?)),
+               COALESCE(SUM(CASE WHEN status != ? THEN total_amount END), 0), MAX(order_date)
+        FROM ({orders}) WHERE client_id IN (SELECT id FROM clients) GROUP BY client_id
+    """, (CANCELLED_STATUS, *CLOSED_STATUSES, CANCELLED_STATUS, *params * len(schemas)))
+    conn.execute(f"""
+        INSERT INTO client_product_totals (client_id, product_id, quantity, amount)
+        SELECT client_id, product_id, SUM(quantity), SUM(quantity * price_per_unit) FROM ({items})
+        WHERE client_id IN (SELECT id FROM clients) AND product_id IN (SELECT id FROM products)
+        GROUP BY client_id, product_id
+    """, [value for _ in schemas for value in (CANCELLED_STATUS, *params)])
+
+def rebuild_client_stats(client_ids=None, conn=None):
+    """
+    Пересчитывает итоги клиентов client_ids (None - всех) с нуля, включая архивные заказы.
+    С conn - в уже открытой транзакции вызывающего (архив должен быть подключен заранее: ATTACH нельзя внутри транзакции).
+    """
+    if conn is not None:
+        _rebuild(conn, client_ids)
+        return True
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        if archive_database_exists(): attach_archive_database(conn)
+        conn.execute("BEGIN TRANSACTION;")
+        _rebuild(conn, client_ids)
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorClientStats: {e}"
+    finally:
+        conn.close()
+
+def get_client_summary(client_id, top_products=TOP_PRODUCTS_LIMIT):
+    """
+    Итоги клиента за все время: {"order_count", "cancelled_count", "open_count", "revenue" (руб.),
+    "last_order_date" (None - заказов нет), "top_products": [{"product_id", "name", "article", "quantity", "amount"}]}.
+    Читаются готовые итоги, а не заказы клиента, поэтому время не зависит от их числа.
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        row = conn.execute("""
+            SELECT order_count, cancelled_count, open_count, revenue, last_order_date FROM client_stats WHERE client_id = ?
+        """, (client_id,)).fetchone() or (0, 0, 0, 0, None)
+        products = conn.execute("""
+            SELECT t.product_id, p.name, p.article_number, t.quantity, t.amount FROM client_product_totals t
+            JOIN products p ON p.id = t.product_id WHERE t.client_id = ? ORDER BY t.amount DESC LIMIT ?
+        """, (client_id, int(top_products))).fetchall()
+    except sqlite3.Error as e: return f"SQLiteErrorClientStats: {e}"
+    finally:
+        conn.close()
+    order_count, cancelled_count, open_count, revenue, last_order_date = row
+    return {"order_count": order_count, "cancelled_count": cancelled_count, "open_count": open_count,
+            "revenue": from_kopecks(revenue), "last_order_date": last_order_date,
+            "top_products": [{"product_id": product_id, "name": name, "article": article, "quantity": quantity, "amount": from_kopecks(amount)}
+                             for product_id, name, article, quantity, amount in products]}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Итоги по клиентам")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать итоги всех клиентов по заказам, включая архив")
+    parser.add_argument("--client", type=int, default=None, help="показать итоги клиента")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.rebuild: print(f"Пересчет итогов: {rebuild_client_stats()}")
+    if args.client is not None: print(get_client_summary(args.client))
@@ -0,0 +1,24 @@
+import re
+
+# Нормализованные телефон и email хранятся в clients.phone_norm / clients.email_norm (с индексами)
+# и служат ключами поиска дублей: '8 (900) 123-45-67' и '+7 900 1234567' - один и тот же номер.
+MIN_PHONE_DIGITS = 6
+PHONE_EXTENSION_RE = re.compile(r"(доб|ext|вн)\.?.*$", re.IGNORECASE)
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def normalize_phone(phone):
+    """
+    Телефон -> только цифры в международном виде без '+': '8 (900) 123-45-67' -> '79001234567'.
+    Добавочный номер ('доб. 12') отбрасывается. None, если цифр слишком мало для номера.
+    """
+    if not phone: return None
+    digits = re.sub(r"\D", "", PHONE_EXTENSION_RE.sub("", str(phone)))
+    if len(digits) == 11 and digits[0] == "8": digits = "7" + digits[1:] # Российский междугородний префикс
+    elif len(digits) == 10 and digits[0] == "9": digits = "7" + digits # Мобильный номер без кода страны
+    return digits if len(digits) >= MIN_PHONE_DIGITS else None
+
+def normalize_email(email):
+    """Email -> без пробелов по краям и в нижнем регистре. None, если это не похоже на адрес."""
+    if not email: return None
+    email = str(email).strip().lower()
+    return email if EMAIL_RE.match(email) else None
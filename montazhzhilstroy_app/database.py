@@ -1,79 +1,805 @@
 import sqlite3
 from sqlite3 import Error
 import os
+import re
+import threading
+import uuid
+from contacts import normalize_phone, normalize_email
+from app_logging import get_logger
+
+logger = get_logger("db")
 
 DATABASE_NAME = "data/montazhzhilstroy.db" 
+ARCHIVE_DATABASE_NAME = "data/montazhzhilstroy_archive.db" # Закрытые заказы прошлых периодов
+
+# Явные списки столбцов: архив и оперативная БД должны совпадать по структуре заказов
+ORDER_COLUMNS = "id, client_id, order_date, status, total_amount"
+ORDER_ITEM_COLUMNS = "id, order_id, product_id, quantity, price_per_unit"
+
+class PooledConnection(sqlite3.Connection):
+    """Соединение из пула: close() возвращает его в пул вместо закрытия файла БД."""
+    pool = None
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+class ConnectionPool:
+    """
+    Пул простаивающих соединений для многопоточного сервиса и GUI (см. api_server.py, main.py).
+    Не блокирует: если свободных соединений нет, открывается новое, а лишние при возврате закрываются.
+    Поэтому вложенные create_connection() внутри CRUD-функций не могут взаимно заблокироваться.
+    """
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        if conn is None:
+            conn = sqlite3.connect(DATABASE_NAME, factory=PooledConnection, check_same_thread=False)
+            conn.execute("PRAGMA foreign_keys = ON;")
+            conn.pool = self
+        return conn
+
+    def release(self, conn):
+        """Возвращает соединение в пул. False - пул полон или соединение испорчено, его нужно закрыть."""
+        try:
+            if conn.in_transaction: conn.rollback() # Незавершенная транзакция не должна достаться следующему
+            if is_archive_attached(conn):
+                conn.execute("DETACH DATABASE archive;") # Временные представления останутся и заработают после нового ATTACH
+        except sqlite3.ProgrammingError: # Соединение уже закрыто
+            return True
+        except Error:
+            conn.pool = None
+            return False
+        with self.lock:
+            if conn in self.idle: return True # Повторный close()
+            if len(self.idle) >= self.max_idle:
+                conn.pool = None
+                return False
+            self.idle.append(conn)
+        return True
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.pool = None
+            conn.close()
+
+_connection_pool = None
+
+def enable_connection_pool(max_idle=8):
+    """
+    Включает пул: create_connection() начинает выдавать соединения из пула, пригодные для любых потоков.
+    Заодно переводит БД в режим WAL, чтобы чтения не ждали записи.
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        os.makedirs(os.path.dirname(DATABASE_NAME), exist_ok=True)
+        _connection_pool = ConnectionPool(max_idle)
+        conn = _connection_pool.acquire()
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.close()
+    return _connection_pool
+
+def disable_connection_pool():
+    global _connection_pool
+    if _connection_pool is not None:
+        _connection_pool.close_all()
+        _connection_pool = None
 
-def create_connection():
-    """Создает соединение с базой данных SQLite."""
+def create_connection(attach_archive=False):
+    """
+    Создает соединение с базой данных SQLite (или берет его из пула, если он включен).
+    Если attach_archive=True, к соединению подключается архивная БД (схема archive)
+    и создаются временные представления all_orders / all_order_items.
+    """
     conn = None
     try:
-        os.makedirs(os.path.dirname(DATABASE_NAME), exist_ok=True)
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.execute("PRAGMA foreign_keys = ON;") 
+        if _connection_pool is not None:
+            conn = _connection_pool.acquire()
+        else:
+            os.makedirs(os.path.dirname(DATABASE_NAME), exist_ok=True)
+            conn = sqlite3.connect(DATABASE_NAME)
+            conn.execute("PRAGMA foreign_keys = ON;") 
+        if attach_archive:
+            attach_archive_database(conn)
     except Error as e:
-        print(f"Ошибка при подключении к БД: {e}")
+        logger.error(f"Ошибка при подключении к БД: {e}", extra={"operation": "connect"})
     return conn
 
+def archive_database_exists():
+    """Проверяет, создавалась ли архивная БД (чтобы не подключать пустой архив без нужды)."""
+    return os.path.exists(ARCHIVE_DATABASE_NAME)
+
+def attach_archive_database(conn):
+    """
+    Подключает архивную БД как схему 'archive' и создает в ней таблицы, если их нет.
+    Внешние ключи на clients/products между файлами не работают, поэтому
+    удаление клиентов и товаров дополнительно проверяет архив (см. *_crud.delete_*).
+    """
+    conn.execute("ATTACH DATABASE ? AS archive;", (ARCHIVE_DATABASE_NAME,))
+    migrate_database(conn, schema="archive")
+    if conn.execute("PRAGMA archive.user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.execute(f"PRAGMA archive.user_version = {SCHEMA_VERSION}")
+    conn.executescript(f"""
+    {SQL_CREATE_ARCHIVE_ORDERS_TABLE}
+    {SQL_CREATE_ARCHIVE_ORDER_ITEMS_TABLE}
+    {SQL_CREATE_ARCHIVE_INDEXES}
+    {SQL_CREATE_ALL_ORDERS_VIEWS}
+    """)
+
+def is_archive_attached(conn):
+    """Подключена ли к соединению схема archive (например, у снимка для отчетов, см. report_snapshot.py)."""
+    return any(row[1] == "archive" for row in conn.execute("PRAGMA database_list"))
+
 def create_table(conn, create_table_sql):
     """Создает таблицу по предоставленному SQL-запросу."""
     try:
         c = conn.cursor()
         c.execute(create_table_sql)
     except Error as e:
-        print(f"Ошибка при создании таблицы: {e}")
+        logger.error(f"Ошибка при создании таблицы: {e}", extra={"operation": "create_table"})
 
-def initialize_database():
-    """Инициализирует базу данных, создает таблицы, если они не существуют."""
-    sql_create_products_table = """
+# Денежные столбцы (price, total_amount, price_per_unit) хранятся в копейках (INTEGER), см. money.py
+SQL_CREATE_PRODUCTS_TABLE = """
     CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         article_number TEXT UNIQUE,
         category TEXT,
         description TEXT,
-        price REAL DEFAULT 0.0,
+        price INTEGER DEFAULT 0, -- В копейках
+        cost_price INTEGER DEFAULT 0, -- Закупочная цена в копейках (для расчета маржи)
         stock_quantity INTEGER DEFAULT 0 CHECK(stock_quantity >= 0), -- Остаток не может быть отрицательным
-        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        reorder_level INTEGER DEFAULT 0 CHECK(reorder_level >= 0), -- Минимальный остаток: ниже него создается оповещение
+        added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP, -- Синхронизация филиалов (sync.py): заполняются триггерами, см. _sync_trigger_sqls
+        sync_uuid TEXT
     );"""
-    sql_create_clients_table = """
+SQL_CREATE_CLIENTS_TABLE = """
     CREATE TABLE IF NOT EXISTS clients (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         full_name TEXT NOT NULL,
         phone_number TEXT,
         email TEXT UNIQUE,
         address TEXT,
-        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        phone_norm TEXT, -- Ключи поиска дублей, см. contacts.py; заполняются в client_crud и при импорте
+        email_norm TEXT,
+        updated_at TIMESTAMP, -- Синхронизация филиалов (sync.py): заполняются триггерами, см. _sync_trigger_sqls
+        sync_uuid TEXT
     );"""
-    sql_create_orders_table = """
+SQL_CREATE_ORDERS_TABLE = """
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         client_id INTEGER NOT NULL,
         order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         status TEXT DEFAULT 'Новый' CHECK(status IN ('Новый', 'В обработке', 'Комплектуется', 'Готов к выдаче', 'Выполнен', 'Отменен')),
-        total_amount REAL DEFAULT 0.0,
+        total_amount INTEGER DEFAULT 0, -- В копейках, считается в SQL как SUM по позициям
         FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE RESTRICT 
     );"""
-    sql_create_order_items_table = """
+SQL_CREATE_ORDER_ITEMS_TABLE = """
     CREATE TABLE IF NOT EXISTS order_items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         order_id INTEGER NOT NULL,
         product_id INTEGER NOT NULL,
         quantity INTEGER NOT NULL CHECK(quantity > 0),
-        price_per_unit REAL NOT NULL, -- Цена на момент заказа
+        price_per_unit INTEGER NOT NULL, -- Цена на момент заказа, в копейках
         FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
         FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE RESTRICT
     );"""
+SQL_CREATE_ARCHIVE_ORDERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS archive.orders (
+        id INTEGER PRIMARY KEY,
+        client_id INTEGER NOT NULL,
+        order_date TIMESTAMP,
+        status TEXT CHECK(status IN ('Новый', 'В обработке', 'Комплектуется', 'Готов к выдаче', 'Выполнен', 'Отменен')),
+        total_amount INTEGER DEFAULT 0
+    );"""
+SQL_CREATE_ARCHIVE_ORDER_ITEMS_TABLE = """
+    CREATE TABLE IF NOT EXISTS archive.order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity > 0),
+        price_per_unit INTEGER NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE
+    );"""
+
+SQL_CREATE_ARCHIVE_INDEXES = """
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_client_id ON orders (client_id);
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_order_items_order_id ON order_items (order_id);
+    CREATE INDEX IF NOT EXISTS archive.idx_archive_order_items_product_id ON order_items (product_id);"""
+SQL_CREATE_ALL_ORDERS_VIEWS = f"""
+    CREATE TEMP VIEW IF NOT EXISTS all_orders AS
+        SELECT {ORDER_COLUMNS} FROM main.orders
+        UNION ALL
+        SELECT {ORDER_COLUMNS} FROM archive.orders;
+    CREATE TEMP VIEW IF NOT EXISTS all_order_items AS
+        SELECT {ORDER_ITEM_COLUMNS} FROM main.order_items
+        UNION ALL
+        SELECT {ORDER_ITEM_COLUMNS} FROM archive.order_items;"""
+
+# Лента изменений для нескольких окон/процессов (см. change_feed.py):
+# триггеры увеличивают счетчик версии таблицы и пишут id измененной строки в журнал
+SQL_CREATE_CHANGE_COUNTERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS change_counters (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;"""
+SQL_CREATE_CHANGE_LOG_TABLE = """
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        operation TEXT NOT NULL CHECK(operation IN ('I', 'U', 'D'))
+    );"""
+# Таблица-источник -> (таблица в ленте, столбец с id строки). Позиции заказа меняют сам заказ.
+CHANGE_FEED_SOURCES = {
+    "products": ("products", "id"),
+    "clients": ("clients", "id"),
+    "orders": ("orders", "id"),
+    "order_items": ("orders", "order_id"),
+}
+CHANGE_FEED_TABLES = ("products", "clients", "orders")
+
+# Планирование запасов (см. inventory.py): ABC/XYZ-классы и точки заказа по каждому товару
+SQL_CREATE_INVENTORY_PLAN_TABLE = """
+    CREATE TABLE IF NOT EXISTS inventory_plan (
+        product_id INTEGER PRIMARY KEY,
+        revenue INTEGER NOT NULL DEFAULT 0, -- Выручка за окно анализа, в копейках
+        total_quantity INTEGER NOT NULL DEFAULT 0,
+        avg_daily_demand REAL NOT NULL DEFAULT 0,
+        demand_std REAL NOT NULL DEFAULT 0,
+        demand_cv REAL, -- NULL, если продаж в окне не было
+        abc_class TEXT CHECK(abc_class IN ('A', 'B', 'C')),
+        xyz_class TEXT CHECK(xyz_class IN ('X', 'Y', 'Z')),
+        reorder_point INTEGER NOT NULL DEFAULT 0,
+        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    );"""
+SQL_CREATE_INVENTORY_PLAN_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS inventory_plan_state (
+        key TEXT PRIMARY KEY,
+        value
+    ) WITHOUT ROWID;"""
+
+# Оповещения о низком остатке: триггеры на products пишут сюда при переходе остатка через reorder_level.
+# Название и артикул копируются, чтобы панель оповещений читала только эту таблицу.
+SQL_CREATE_STOCK_ALERTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS stock_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        product_name TEXT,
+        article_number TEXT,
+        stock_quantity INTEGER NOT NULL,
+        reorder_level INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        closed_at TIMESTAMP, -- NULL, пока оповещение открыто
+        close_reason TEXT CHECK(close_reason IN ('restocked', 'acknowledged')),
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    );"""
+SQL_CREATE_STOCK_ALERT_INDEXES = [
+    # Частичные индексы: поиск низкого остатка и открытых оповещений - поиск по индексу, а не скан таблицы
+    "CREATE INDEX IF NOT EXISTS idx_products_low_stock ON products (stock_quantity) WHERE stock_quantity <= reorder_level;",
+    "CREATE INDEX IF NOT EXISTS idx_stock_alerts_open ON stock_alerts (product_id) WHERE closed_at IS NULL;",
+]
+SQL_CREATE_STOCK_ALERT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_low_stock_insert AFTER INSERT ON products
+    WHEN NEW.stock_quantity <= NEW.reorder_level
+    BEGIN
+        INSERT INTO stock_alerts (product_id, product_name, article_number, stock_quantity, reorder_level)
+        VALUES (NEW.id, NEW.name, NEW.article_number, NEW.stock_quantity, NEW.reorder_level);
+    END;""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_low_stock_update AFTER UPDATE OF stock_quantity, reorder_level ON products
+    WHEN NEW.stock_quantity <= NEW.reorder_level
+     AND NOT EXISTS (SELECT 1 FROM stock_alerts WHERE product_id = NEW.id AND closed_at IS NULL)
+    BEGIN
+        INSERT INTO stock_alerts (product_id, product_name, article_number, stock_quantity, reorder_level)
+        VALUES (NEW.id, NEW.name, NEW.article_number, NEW.stock_quantity, NEW.reorder_level);
+    END;""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_low_stock_update_open AFTER UPDATE OF stock_quantity, reorder_level ON products
+    WHEN NEW.stock_quantity <= NEW.reorder_level
+    BEGIN
+        UPDATE stock_alerts SET stock_quantity = NEW.stock_quantity, reorder_level = NEW.reorder_level
+        WHERE product_id = NEW.id AND closed_at IS NULL;
+    END;""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_restocked AFTER UPDATE OF stock_quantity, reorder_level ON products
+    WHEN NEW.stock_quantity > NEW.reorder_level AND OLD.stock_quantity <= OLD.reorder_level
+    BEGIN
+        UPDATE stock_alerts SET closed_at = CURRENT_TIMESTAMP, close_reason = 'restocked'
+        WHERE product_id = NEW.id AND closed_at IS NULL;
+    END;""",
+]
+
+# История цен: каждое изменение products.price пишется триггером, в том числе при обычном редактировании.
+# Пакетная переоценка (repricing.py) дополнительно помечает свои строки batch_id.
+SQL_CREATE_PRICE_CHANGE_BATCHES_TABLE = """
+    CREATE TABLE IF NOT EXISTS price_change_batches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        description TEXT,
+        products_count INTEGER NOT NULL DEFAULT 0
+    );"""
+SQL_CREATE_PRICE_HISTORY_TABLE = """
+    CREATE TABLE IF NOT EXISTS price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        old_price INTEGER, -- NULL для первой цены нового товара
+        new_price INTEGER NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        batch_id INTEGER, -- NULL, если цену меняли вручную
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE,
+        FOREIGN KEY (batch_id) REFERENCES price_change_batches (id) ON DELETE SET NULL
+    );"""
+SQL_CREATE_PRICE_HISTORY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history (product_id, changed_at);",
+    "CREATE INDEX IF NOT EXISTS idx_price_history_batch ON price_history (batch_id) WHERE batch_id IS NOT NULL;",
+]
+SQL_CREATE_PRICE_HISTORY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_price_history_insert AFTER INSERT ON products
+    BEGIN
+        INSERT INTO price_history (product_id, old_price, new_price) VALUES (NEW.id, NULL, NEW.price);
+    END;""",
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_price_history_update AFTER UPDATE OF price ON products
+    WHEN OLD.price IS NOT NEW.price
+    BEGIN
+        INSERT INTO price_history (product_id, old_price, new_price) VALUES (NEW.id, OLD.price, NEW.price);
+    END;""",
+]
+
+# Вероятные дубли клиентов (client_dedup.py): client_id - кого оставить, duplicate_id - кого слить в него
+SQL_CREATE_CLIENT_DUPLICATES_TABLE = """
+    CREATE TABLE IF NOT EXISTS client_duplicate_candidates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER NOT NULL,
+        duplicate_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        reasons TEXT,
+        status TEXT NOT NULL DEFAULT 'new' CHECK(status IN ('new', 'dismissed')),
+        found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (client_id, duplicate_id),
+        FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE,
+        FOREIGN KEY (duplicate_id) REFERENCES clients (id) ON DELETE CASCADE
+    );"""
+
+# Вложения товаров (attachments.py). Содержимое лежит в отдельной таблице: списки и метаданные
+# не читают страницы BLOB, а сами данные пишутся и читаются блоками через blobopen
+SQL_CREATE_PRODUCT_ATTACHMENTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS product_attachments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        file_name TEXT NOT NULL,
+        mime_type TEXT,
+        size INTEGER NOT NULL,
+        sha256 TEXT,
+        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    );"""
+
+SQL_CREATE_PRODUCT_ATTACHMENT_DATA_TABLE = """
+    CREATE TABLE IF NOT EXISTS product_attachment_data (
+        attachment_id INTEGER PRIMARY KEY,
+        data BLOB NOT NULL,
+        FOREIGN KEY (attachment_id) REFERENCES product_attachments (id) ON DELETE CASCADE
+    );"""
+
+# Черновики заказов (order_draft.py): автосохранение незавершенного заказа, чтобы он пережил перезапуск
+SQL_CREATE_ORDER_DRAFTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS order_drafts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE SET NULL
+    );"""
+
+SQL_CREATE_ORDER_DRAFT_ITEMS_TABLE = """
+    CREATE TABLE IF NOT EXISTS order_draft_items (
+        draft_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        product_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity > 0),
+        price_per_unit INTEGER NOT NULL, -- Копейки, цена на момент добавления в черновик
+        position INTEGER NOT NULL,
+        PRIMARY KEY (draft_id, product_id),
+        FOREIGN KEY (draft_id) REFERENCES order_drafts (id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    ) WITHOUT ROWID;"""
+
+# Мягкие резервы остатков под открытые черновики заказов (reservations.py): holder - ключ черновика,
+# резерв действует до expires_at (UTC, как CURRENT_TIMESTAMP) и продлевается, пока черновик редактируют
+SQL_CREATE_STOCK_RESERVATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        holder TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK(quantity > 0),
+        expires_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (holder, product_id),
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    ) WITHOUT ROWID;"""
+# Доступный остаток = остаток - действующие резервы: сумма читается только из индекса
+SQL_CREATE_STOCK_RESERVATIONS_INDEX = "CREATE INDEX IF NOT EXISTS idx_stock_reservations_product ON stock_reservations (product_id, expires_at, quantity);"
+
+# Накопленные итоги по клиентам для карточки клиента (client_stats.py): обновляются в тех же транзакциях,
+# что и заказы (order_crud), и включают архивные заказы. revenue - сумма неотмененных заказов, в копейках.
+SQL_CREATE_CLIENT_STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS client_stats (
+        client_id INTEGER PRIMARY KEY,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        cancelled_count INTEGER NOT NULL DEFAULT 0,
+        open_count INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0,
+        last_order_date TIMESTAMP,
+        FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
+    );"""
+# Куплено клиентом по товарам (без отмененных заказов): для списка основных товаров клиента
+SQL_CREATE_CLIENT_PRODUCT_TOTALS_TABLE = """
+    CREATE TABLE IF NOT EXISTS client_product_totals (
+        client_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        amount INTEGER NOT NULL DEFAULT 0, -- В копейках
+        PRIMARY KEY (client_id, product_id),
+        FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE,
+        FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE
+    ) WITHOUT ROWID;"""
+
+# Синхронизация справочников между филиалами (см. sync.py). Строка определяется sync_uuid (id у филиалов свои),
+# updated_at меняется триггером при изменении синхронизируемых столбцов, удаление оставляет надгробие.
+# Остаток и минимальный остаток у каждого филиала свои (свой склад) и не синхронизируются.
+SYNC_TABLES = {
+    "products": ("name", "article_number", "category", "description", "price", "cost_price", "added_date"),
+    "clients": ("full_name", "phone_number", "email", "address", "registration_date", "phone_norm", "email_norm"),
+}
+SYNC_CREATED_COLUMNS = {"products": "added_date", "clients": "registration_date"}
+SYNC_TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')" # UTC с миллисекундами, сравнимо с CURRENT_TIMESTAMP как строка
+SYNC_UUID_NAMESPACE = uuid.UUID("6f1c2a4e-3b7d-5e8f-9a0b-1c2d3e4f5a6b")
+SQL_CREATE_SYNC_TOMBSTONES_TABLE = """
+    CREATE TABLE IF NOT EXISTS sync_tombstones (
+        table_name TEXT NOT NULL,
+        sync_uuid TEXT NOT NULL,
+        deleted_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (table_name, sync_uuid)
+    ) WITHOUT ROWID;"""
+SQL_CREATE_SYNC_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY, -- site_id, export:<филиал>, import:<site_id>
+        value TEXT
+    ) WITHOUT ROWID;"""
+
+def _sync_trigger_sqls():
+    for table, columns in SYNC_TABLES.items():
+        yield f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_sync_uuid ON {table} (sync_uuid);"
+        yield f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table} (updated_at);"
+        # Импорт (sync.py) передает updated_at и sync_uuid удаленной стороны - тогда триггеры их не трогают
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_sync_insert AFTER INSERT ON {table}
+    WHEN NEW.updated_at IS NULL OR NEW.sync_uuid IS NULL
+    BEGIN
+        UPDATE {table} SET updated_at = COALESCE(NEW.updated_at, {SYNC_TIMESTAMP_SQL}),
+                           sync_uuid = COALESCE(NEW.sync_uuid, lower(hex(randomblob(16))))
+        WHERE id = NEW.id;
+    END;"""
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_sync_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+    WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE {table} SET updated_at = {SYNC_TIMESTAMP_SQL} WHERE id = NEW.id;
+    END;"""
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_sync_delete AFTER DELETE ON {table}
+    WHEN OLD.sync_uuid IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO sync_tombstones (table_name, sync_uuid, deleted_at) VALUES ('{table}', OLD.sync_uuid, {SYNC_TIMESTAMP_SQL});
+    END;"""
+
+# Журнал аудита (см. audit.py): триггеры пишут в audit_log только изменившиеся столбцы в компактном JSON:
+# вставка - {"столбец": значение}, изменение - {"столбец": [было, стало]}, удаление - полная строка до удаления.
+# Таблица -> аудируемые столбцы. Не аудируются служебные updated_at/sync_uuid/*_norm и производные
+# stock_quantity/total_amount: они меняются с каждым заказом и восстанавливаются по позициям заказов.
+AUDIT_TABLES = {
+    "products": ("name", "article_number", "category", "description", "price", "cost_price", "reorder_level", "added_date"),
+    "clients": ("full_name", "phone_number", "email", "address", "registration_date"),
+    "orders": ("client_id", "order_date", "status"),
+}
+# Позиции после оформления не меняются, поэтому заказ пишется в журнал одной записью вместе со списком позиций
+# {"items": [{"id", ...}]}: при оформлении - когда add_order пересчитывает итог по уже вставленным позициям,
+# при удалении - до каскадного удаления позиций. Запись на каждую позицию стоила больше 10% скорости оформления.
+AUDIT_ORDER_ITEM_COLUMNS = ("product_id", "quantity", "price_per_unit")
+# Прежние триггеры аудита заказов и позиций: удаляются при инициализации существующей БД
+OBSOLETE_AUDIT_TRIGGERS = ("trg_orders_audit_insert", "trg_orders_audit_delete",
+                           "trg_order_items_audit_insert", "trg_order_items_audit_update", "trg_order_items_audit_delete")
+# Заказы, удаление которых не пишется в журнал: архивация (archive.py) переносит их в архивную БД, а не удаляет.
+# Заполняется и очищается внутри транзакции архивации, другим соединениям всегда видна пустой.
+SQL_CREATE_AUDIT_SUPPRESSED_ORDERS_TABLE = """
+    CREATE TABLE IF NOT EXISTS audit_suppressed_orders (
+        order_id INTEGER PRIMARY KEY
+    );"""
+AUDIT_TIMESTAMP_SQL = "CAST(strftime('%s', 'now') AS INTEGER)" # Unix-время в секундах: 4-6 байт вместо строки даты
+SQL_CREATE_AUDIT_LOG_TABLE = """
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY, -- Растет вместе с ts: очистка удаляет записи с начала
+        ts INTEGER NOT NULL,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        operation TEXT NOT NULL CHECK(operation IN ('I', 'U', 'D')),
+        changes TEXT NOT NULL
+    );"""
+SQL_CREATE_AUDIT_LOG_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_audit_log_entity ON audit_log (table_name, row_id, ts);",
+]
+# Журнал только дополняется; удаление разрешено только очистке по сроку хранения (audit.prune_audit_log)
+SQL_CREATE_AUDIT_LOG_GUARD_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_audit_log_append_only BEFORE UPDATE ON audit_log
+    BEGIN
+        SELECT RAISE(ABORT, 'audit_log is append-only');
+    END;"""
+
+def _audit_row_image(ref, columns):
+    return "json_object(" + ", ".join(f"'{column}', {ref}.{column}" for column in columns) + ")"
+
+def _audit_order_image(ref):
+    """Заказ со всеми позициями: позиции еще (или уже) в order_items, у триггера удаления - BEFORE DELETE."""
+    items = "json_object('id', id, " + ", ".join(f"'{column}', {column}" for column in AUDIT_ORDER_ITEM_COLUMNS) + ")"
+    columns = ", ".join(f"'{column}', {ref}.{column}" for column in AUDIT_TABLES["orders"])
+    return f"json_object({columns}, 'items', (SELECT json_group_array({items}) FROM order_items WHERE order_id = {ref}.id))"
+
+def _audit_trigger_sqls():
+    for table, columns in AUDIT_TABLES.items():
+        changed = " UNION ALL ".join(f"SELECT '{column}' AS name, OLD.{column} AS old_value, NEW.{column} AS new_value" for column in columns)
+        changes = f"(SELECT json_group_object(name, json_array(old_value, new_value)) FROM ({changed}) WHERE old_value IS NOT new_value)"
+        insert_sql = f"INSERT INTO audit_log (ts, table_name, row_id, operation, changes) VALUES ({AUDIT_TIMESTAMP_SQL}, '{table}'"
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_audit_update AFTER UPDATE OF {', '.join(columns)} ON {table}
+    WHEN {' OR '.join(f"OLD.{column} IS NOT NEW.{column}" for column in columns)}
+    BEGIN
+        {insert_sql}, NEW.id, 'U', {changes});
+    END;"""
+        if table == "orders":
+            # total_amount пересчитывается только в add_order, после вставки всех позиций (order_crud.update_order_total)
+            yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_audit_placed AFTER UPDATE OF total_amount ON orders
+    BEGIN
+        {insert_sql}, NEW.id, 'I', {_audit_order_image("NEW")});
+    END;"""
+            yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_audit_removed BEFORE DELETE ON orders
+    WHEN NOT EXISTS (SELECT 1 FROM audit_suppressed_orders WHERE order_id = OLD.id)
+    BEGIN
+        {insert_sql}, OLD.id, 'D', {_audit_order_image("OLD")});
+    END;"""
+            continue
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_audit_insert AFTER INSERT ON {table}
+    BEGIN
+        {insert_sql}, NEW.id, 'I', {_audit_row_image("NEW", columns)});
+    END;"""
+        yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_audit_delete AFTER DELETE ON {table}
+    BEGIN
+        {insert_sql}, OLD.id, 'D', {_audit_row_image("OLD", columns)});
+    END;"""
+
+def _change_feed_trigger_sqls():
+    for source_table, (feed_table, id_column) in CHANGE_FEED_SOURCES.items():
+        for operation, row_ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            yield f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{source_table}_feed_{operation.lower()} AFTER {operation} ON {source_table}
+    BEGIN
+        INSERT INTO change_log (table_name, row_id, operation) VALUES ('{feed_table}', {row_ref}.{id_column}, '{operation[0]}');
+        UPDATE change_counters SET version = version + 1 WHERE table_name = '{feed_table}';
+    END;"""
+    # Удаленная позиция меняет и спрос на товар (inventory.py): позиции удаленного заказа уже не найти по его id
+    yield """
+    CREATE TRIGGER IF NOT EXISTS trg_order_items_feed_products_delete AFTER DELETE ON order_items
+    BEGIN
+        INSERT INTO change_log (table_name, row_id, operation) VALUES ('products', OLD.product_id, 'U');
+        UPDATE change_counters SET version = version + 1 WHERE table_name = 'products';
+    END;"""
+
+def _table_exists(conn, table, schema="main"):
+    row = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+def _column_exists(conn, table, column, schema="main"):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA {schema}.table_info({table})"))
+
+def _rebuild_table(conn, schema, table, create_sql, columns, select_columns):
+    """
+    Пересоздает таблицу по новому DDL (SQLite не умеет менять тип столбца через ALTER).
+    select_columns - выражения над старой таблицей для столбцов columns новой таблицы;
+    остальные столбцы нового DDL получают значения по умолчанию.
+    Счетчик AUTOINCREMENT сохраняется, чтобы id удаленных записей не переиспользовались.
+    """
+    tmp_table = f"{table}_migrating"
+    new_table_sql = re.sub(r"CREATE TABLE IF NOT EXISTS (\w+\.)?\w+", f"CREATE TABLE {schema}.{tmp_table}", create_sql, count=1)
+    seq_row = None
+    if _table_exists(conn, "sqlite_sequence", schema):
+        seq_row = conn.execute(f"SELECT seq FROM {schema}.sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    conn.execute(new_table_sql)
+    conn.execute(f"INSERT INTO {schema}.{tmp_table} ({columns}) SELECT {select_columns} FROM {schema}.{table}")
+    conn.execute(f"DROP TABLE {schema}.{table}")
+    conn.execute(f"ALTER TABLE {schema}.{tmp_table} RENAME TO {table}")
+    if seq_row is not None:
+        conn.execute(f"UPDATE {schema}.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq_row[0], table))
+
+def _migration_money_to_kopecks(conn, schema):
+    """Версия 1: REAL-рубли -> INTEGER-копейки в products, orders, order_items."""
+    to_kopecks_sql = "CAST(ROUND({} * 100) AS INTEGER)"
+    if schema == "main":
+        if _table_exists(conn, "products", schema):
+            _rebuild_table(conn, schema, "products", SQL_CREATE_PRODUCTS_TABLE,
+                           "id, name, article_number, category, description, price, stock_quantity, added_date",
+                           "id, name, article_number, category, description, "
+                           f"{to_kopecks_sql.format('price')}, stock_quantity, added_date")
+        orders_sql, order_items_sql = SQL_CREATE_ORDERS_TABLE, SQL_CREATE_ORDER_ITEMS_TABLE
+    else:
+        orders_sql, order_items_sql = SQL_CREATE_ARCHIVE_ORDERS_TABLE, SQL_CREATE_ARCHIVE_ORDER_ITEMS_TABLE
+    if _table_exists(conn, "orders", schema):
+        _rebuild_table(conn, schema, "orders", orders_sql, "id, client_id, order_date, status, total_amount",
+                       f"id, client_id, order_date, status, {to_kopecks_sql.format('total_amount')}")
+    if _table_exists(conn, "order_items", schema):
+        _rebuild_table(conn, schema, "order_items", order_items_sql, "id, order_id, product_id, quantity, price_per_unit",
+                       f"id, order_id, product_id, quantity, {to_kopecks_sql.format('price_per_unit')}")
+
+def _migration_product_cost_price(conn, schema):
+    """Версия 2: закупочная цена товара (в копейках) для расчета маржи."""
+    if schema == "main" and not _column_exists(conn, "products", "cost_price", schema):
+        conn.execute("ALTER TABLE products ADD COLUMN cost_price INTEGER DEFAULT 0")
+
+def _migration_product_reorder_level(conn, schema):
+    """Версия 3: минимальный остаток товара для оповещений о низком остатке."""
+    if schema == "main" and not _column_exists(conn, "products", "reorder_level", schema):
+        conn.execute("ALTER TABLE products ADD COLUMN reorder_level INTEGER DEFAULT 0 CHECK(reorder_level >= 0)")
+
+def _migration_client_contact_keys(conn, schema):
+    """Версия 4: нормализованные телефон и email клиента (ключи поиска дублей), заполняются по текущим данным."""
+    if schema != "main" or not _table_exists(conn, "clients", schema): return
+    for column in ("phone_norm", "email_norm"):
+        if not _column_exists(conn, "clients", column, schema):
+            conn.execute(f"ALTER TABLE clients ADD COLUMN {column} TEXT")
+    rows = conn.execute("SELECT id, phone_number, email FROM clients").fetchall()
+    conn.executemany("UPDATE clients SET phone_norm = ?, email_norm = ? WHERE id = ?",
+                     [(normalize_phone(phone), normalize_email(email), client_id) for client_id, phone, email in rows])
+
+def _migration_sync_tracking(conn, schema):
+    """
+    Версия 5: updated_at и sync_uuid у товаров и клиентов. sync_uuid существующих строк выводится из
+    (таблица, id, дата создания): копии одной БД, мигрированные в разных филиалах, получают одинаковые uuid.
+    """
+    if schema != "main": return
+    for table, created_column in SYNC_CREATED_COLUMNS.items():
+        if not _table_exists(conn, table, schema): continue
+        for column in ("updated_at", "sync_uuid"):
+            if not _column_exists(conn, table, column, schema):
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {'TEXT' if column == 'sync_uuid' else 'TIMESTAMP'}")
+        rows = conn.execute(f"SELECT id, {created_column} FROM {table} WHERE sync_uuid IS NULL").fetchall()
+        conn.executemany(f"UPDATE {table} SET sync_uuid = ?, updated_at = COALESCE(updated_at, {created_column}, {SYNC_TIMESTAMP_SQL}) WHERE id = ?",
+                         [(uuid.uuid5(SYNC_UUID_NAMESPACE, f"{table}:{row_id}:{created}").hex, row_id) for row_id, created in rows])
+
+# Миграции по порядку: MIGRATIONS[i] переводит схему с версии i на i + 1 (PRAGMA user_version)
+MIGRATIONS = [
+    _migration_money_to_kopecks,
+    _migration_product_cost_price,
+    _migration_product_reorder_level,
+    _migration_client_contact_keys,
+    _migration_sync_tracking,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate_database(conn, schema="main"):
+    """
+    Применяет недостающие миграции к существующей БД (схема main или archive).
+    Пустая БД не мигрируется: таблицы сразу создаются по актуальному DDL.
+    """
+    version = conn.execute(f"PRAGMA {schema}.user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION or not _table_exists(conn, "orders", schema):
+        return
+    conn.execute("PRAGMA foreign_keys = OFF;") # Пересоздание таблиц требует отключенных внешних ключей
+    try:
+        conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+        for migration in MIGRATIONS[version:]:
+            migration(conn, schema)
+        violations = conn.execute(f"PRAGMA {schema}.foreign_key_check").fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"Нарушения внешних ключей после миграции: {violations[:5]}")
+        conn.execute(f"PRAGMA {schema}.user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON;")
+
+def initialize_database():
+    """Инициализирует базу данных: применяет миграции и создает таблицы, если они не существуют."""
+    # Без индексов каждая проверка внешнего ключа и каскадное удаление сканируют order_items целиком
+    sql_create_indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id);",
+        "CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id);",
+        # Заказы клиента по дате с итогами прямо из индекса (пересчет итогов клиента, последняя дата заказа);
+        # заменяет прежний индекс только по client_id, он же служит проверке внешнего ключа при удалении клиента
+        "CREATE INDEX IF NOT EXISTS idx_orders_client_date ON orders (client_id, order_date, status, total_amount);",
+        "DROP INDEX IF EXISTS idx_orders_client_id;",
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_date ON orders (status, order_date);", # Для архиватора
+        # Поиск дублей клиентов при добавлении и импорте (client_import.py)
+        "CREATE INDEX IF NOT EXISTS idx_clients_phone_norm ON clients (phone_norm) WHERE phone_norm IS NOT NULL;",
+        "CREATE INDEX IF NOT EXISTS idx_clients_email_norm ON clients (email_norm) WHERE email_norm IS NOT NULL;",
+    ]
     
     conn = create_connection()
     if conn is not None:
-        create_table(conn, sql_create_products_table)
-        create_table(conn, sql_create_clients_table)
-        create_table(conn, sql_create_orders_table)
-        create_table(conn, sql_create_order_items_table)
+        try:
+            migrate_database(conn)
+        except Error as e:
+            logger.error(f"Ошибка при миграции базы данных: {e}", extra={"operation": "migrate"})
+            conn.close()
+            return
+        create_table(conn, SQL_CREATE_PRODUCTS_TABLE)
+        create_table(conn, SQL_CREATE_CLIENTS_TABLE)
+        create_table(conn, SQL_CREATE_ORDERS_TABLE)
+        create_table(conn, SQL_CREATE_ORDER_ITEMS_TABLE)
+        for sql_index in sql_create_indexes:
+            create_table(conn, sql_index)
+        create_table(conn, SQL_CREATE_INVENTORY_PLAN_TABLE)
+        create_table(conn, SQL_CREATE_STOCK_ALERTS_TABLE)
+        for sql_statement in SQL_CREATE_STOCK_ALERT_INDEXES + SQL_CREATE_STOCK_ALERT_TRIGGERS:
+            create_table(conn, sql_statement)
+        create_table(conn, SQL_CREATE_INVENTORY_PLAN_STATE_TABLE)
+        create_table(conn, SQL_CREATE_CLIENT_DUPLICATES_TABLE)
+        create_table(conn, "CREATE INDEX IF NOT EXISTS idx_client_duplicates_duplicate ON client_duplicate_candidates (duplicate_id);")
+        create_table(conn, SQL_CREATE_PRODUCT_ATTACHMENTS_TABLE)
+        create_table(conn, SQL_CREATE_PRODUCT_ATTACHMENT_DATA_TABLE)
+        create_table(conn, "CREATE INDEX IF NOT EXISTS idx_product_attachments_product ON product_attachments (product_id);")
+        create_table(conn, SQL_CREATE_ORDER_DRAFTS_TABLE)
+        create_table(conn, SQL_CREATE_ORDER_DRAFT_ITEMS_TABLE)
+        create_table(conn, "CREATE INDEX IF NOT EXISTS idx_order_draft_items_product ON order_draft_items (product_id);")
+        create_table(conn, SQL_CREATE_STOCK_RESERVATIONS_TABLE)
+        create_table(conn, SQL_CREATE_STOCK_RESERVATIONS_INDEX)
+        client_stats_missing = not _table_exists(conn, "client_stats")
+        create_table(conn, SQL_CREATE_CLIENT_STATS_TABLE)
+        create_table(conn, SQL_CREATE_CLIENT_PRODUCT_TOTALS_TABLE)
+        create_table(conn, SQL_CREATE_SYNC_TOMBSTONES_TABLE)
+        create_table(conn, "CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted ON sync_tombstones (deleted_at);")
+        create_table(conn, SQL_CREATE_SYNC_STATE_TABLE)
+        for sql_statement in _sync_trigger_sqls():
+            create_table(conn, sql_statement)
+        create_table(conn, SQL_CREATE_AUDIT_LOG_TABLE)
+        create_table(conn, SQL_CREATE_AUDIT_SUPPRESSED_ORDERS_TABLE)
+        for trigger_name in OBSOLETE_AUDIT_TRIGGERS:
+            create_table(conn, f"DROP TRIGGER IF EXISTS {trigger_name};")
+        for sql_statement in SQL_CREATE_AUDIT_LOG_INDEXES + [SQL_CREATE_AUDIT_LOG_GUARD_TRIGGER] + list(_audit_trigger_sqls()):
+            create_table(conn, sql_statement)
+        create_table(conn, SQL_CREATE_PRICE_CHANGE_BATCHES_TABLE)
+        create_table(conn, SQL_CREATE_PRICE_HISTORY_TABLE)
+        for sql_statement in SQL_CREATE_PRICE_HISTORY_INDEXES + SQL_CREATE_PRICE_HISTORY_TRIGGERS:
+            create_table(conn, sql_statement)
+        create_table(conn, SQL_CREATE_CHANGE_COUNTERS_TABLE)
+        create_table(conn, SQL_CREATE_CHANGE_LOG_TABLE)
+        for sql_trigger in _change_feed_trigger_sqls():
+            create_table(conn, sql_trigger)
+        conn.executemany("INSERT OR IGNORE INTO change_counters (table_name) VALUES (?)", [(t,) for t in CHANGE_FEED_TABLES])
+        conn.commit()
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.close()
+        if client_stats_missing: # Итоги клиентов появились в существующей БД - заполняем их по уже оформленным заказам
+            from client_stats import rebuild_client_stats
+            result = rebuild_client_stats()
+            if result is not True: logger.error(f"Не удалось заполнить итоги клиентов: {result}", extra={"operation": "initialize_database"})
     else:
-        print("Ошибка! Не удалось создать соединение с базой данных.")
+        logger.error("Не удалось создать соединение с базой данных.", extra={"operation": "initialize_database"})
 
 if __name__ == '__main__':
     initialize_database()
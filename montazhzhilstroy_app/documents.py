@@ -0,0 +1,273 @@
+"""
+Счета и листы сборки по заказам: HTML (всегда) или PDF (если установлен reportlab).
+Пакетная генерация за период: детали заказов читаются одним проходом (order_crud.iter_orders_details),
+документы рендерятся в пуле процессов и записываются в файлы по мере готовности.
+Пример: python documents.py --from 2024-05-01 --to 2024-05-31 --out docs/2024-05 --workers 4
+        python documents.py --from 2024-05-01 --to 2024-05-31 --out /tmp/docs --benchmark
+"""
+import argparse
+import html
+import io
+import multiprocessing
+import os
+import time
+from datetime import datetime
+from database import create_connection, attach_archive_database, archive_database_exists, is_archive_attached
+from order_crud import iter_orders_details
+from cancellation import CANCELLED
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas as pdf_canvas
+except ImportError: # PDF необязателен: без reportlab доступен только HTML
+    pdf_canvas = None
+
+COMPANY_NAME = "ООО «МонтажЖилСтрой»"
+DOCUMENT_KINDS = ("invoice", "picking_list")
+DOCUMENT_TITLES = {"invoice": "Счет", "picking_list": "Лист сборки"}
+OUTPUT_FORMATS = ("html", "pdf")
+DEFAULT_CHUNK_SIZE = 16 # Заказов в одной передаче процессу-исполнителю
+# Шрифт с кириллицей для PDF: встроенные шрифты reportlab русские буквы не содержат
+PDF_FONT_NAME = "DocumentFont"
+PDF_FONT_PATHS = ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "C:/Windows/Fonts/arial.ttf", "/Library/Fonts/Arial.ttf")
+
+HTML_STYLE = """
+body { font-family: Arial, sans-serif; font-size: 12px; margin: 24px; }
+h1 { font-size: 18px; margin-bottom: 4px; }
+table { border-collapse: collapse; width: 100%; margin-top: 12px; }
+th, td { border: 1px solid #999; padding: 4px 6px; }
+th { background: #eee; }
+td.num { text-align: right; white-space: nowrap; }
+.total { text-align: right; font-weight: bold; margin-top: 8px; }
+"""
+
+def _format_date(value):
+    try: return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y')
+    except (TypeError, ValueError): return value or ""
+
+def _invoice_rows(order):
+    return [(str(i), item["product_article"] or "", item["product_name"], str(item["quantity"]),
+             f"{item['price_per_unit']:.2f}", f"{item['quantity'] * item['price_per_unit']:.2f}")
+            for i, item in enumerate(order["items"], 1)]
+
+def _picking_rows(order):
+    # В листе сборки позиции по артикулу: так кладовщику удобнее обходить склад
+    items = sorted(order["items"], key=lambda item: (item["product_article"] or "", item["product_name"]))
+    return [(str(i), item["product_article"] or "", item["product_name"], str(item["quantity"]), "")
+            for i, item in enumerate(items, 1)]
+
+DOCUMENT_COLUMNS = {
+    "invoice": (("№", False), ("Артикул", False), ("Товар", False), ("Кол-во", True), ("Цена, руб.", True), ("Сумма, руб.", True)),
+    "picking_list": (("№", False), ("Артикул", False), ("Товар", False), ("Кол-во", True), ("Собрано", False)),
+}
+DOCUMENT_ROWS = {"invoice": _invoice_rows, "picking_list": _picking_rows}
+
+def _document_header(kind, order):
+    lines = [f"Заказ № {order['id']} от {_format_date(order['order_date'])}", f"Клиент: {order['client_full_name']}"]
+    if order.get("client_phone_number"): lines.append(f"Телефон: {order['client_phone_number']}")
+    if order.get("client_address"): lines.append(f"Адрес: {order['client_address']}")
+    if kind == "picking_list": lines.append(f"Статус: {order['status']}")
+    return f"{DOCUMENT_TITLES[kind]} № {order['id']}", lines
+
+def render_html(kind, order):
+    """Документ kind по словарю из get_order_details_by_id / iter_orders_details -> HTML-строка."""
+    title, header_lines = _document_header(kind, order)
+    esc = html.escape
+    parts = [f"<!DOCTYPE html><html lang=\"ru\"><head><meta charset=\"utf-8\"><title>{esc(title)}</title>",
+             f"<style>{HTML_STYLE}</style></head><body>",
+             f"<div>{esc(COMPANY_NAME)}</div><h1>{esc(title)}</h1>"]
+    parts += [f"<div>{esc(line)}</div>" for line in header_lines]
+    columns = DOCUMENT_COLUMNS[kind]
+    parts.append("<table><tr>" + "".join(f"<th>{esc(name)}</th>" for name, _ in columns) + "</tr>")
+    for row in DOCUMENT_ROWS[kind](order):
+        parts.append("<tr>" + "".join(f"<td class=\"num\">{esc(value)}</td>" if numeric else f"<td>{esc(value)}</td>"
+                                      for value, (_, numeric) in zip(row, columns)) + "</tr>")
+    parts.append("</table>")
+    if kind == "invoice": parts.append(f"<div class=\"total\">Итого: {order['total_amount']:.2f} руб.</div>")
+    else: parts.append(f"<div class=\"total\">Позиций: {len(order['items'])}, единиц: {sum(item['quantity'] for item in order['items'])}</div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+def _pdf_font():
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames(): return PDF_FONT_NAME
+    path = next((path for path in PDF_FONT_PATHS if os.path.exists(path)), None)
+    if path is None: raise OSError("Не найден шрифт с кириллицей для PDF (см. PDF_FONT_PATHS)")
+    pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, path))
+    return PDF_FONT_NAME
+
+def render_pdf(kind, order):
+    """Документ kind -> байты PDF (нужен reportlab)."""
+    font = _pdf_font()
+    buffer = io.BytesIO()
+    pdf = pdf_canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    columns = DOCUMENT_COLUMNS[kind]
+    column_x = {"invoice": (40, 65, 140, 390, 450, 555), "picking_list": (40, 65, 140, 470, 490)}[kind]
+    title, header_lines = _document_header(kind, order)
+
+    def draw_row(y, values, font_size=9):
+        pdf.setFont(font, font_size)
+        for value, x, (_, numeric) in zip(values, column_x, columns):
+            if numeric: pdf.drawRightString(x, y, value)
+            else: pdf.drawString(x, y, value[:60])
+
+    pdf.setFont(font, 9); pdf.drawString(40, height - 40, COMPANY_NAME)
+    pdf.setFont(font, 14); pdf.drawString(40, height - 62, title)
+    y = height - 82
+    pdf.setFont(font, 10)
+    for line in header_lines:
+        pdf.drawString(40, y, line); y -= 14
+    y -= 8
+    draw_row(y, [name for name, _ in columns]); y -= 14
+    for row in DOCUMENT_ROWS[kind](order):
+        if y < 60:
+            pdf.showPage(); y = height - 40
+        draw_row(y, row); y -= 13
+    pdf.setFont(font, 10)
+    if kind == "invoice": pdf.drawRightString(column_x[-1], y - 10, f"Итого: {order['total_amount']:.2f} руб.")
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+def document_file_name(kind, order, output_format):
+    return f"{kind}_{order['id']:06d}.{output_format}"
+
+def write_order_document(kind, order, output_dir, output_format="html"):
+    """Рендерит документ заказа в файл каталога output_dir. Возвращает (путь, размер в байтах)."""
+    data = render_html(kind, order).encode("utf-8") if output_format == "html" else render_pdf(kind, order)
+    path = os.path.join(output_dir, document_file_name(kind, order, output_format))
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, len(data)
+
+def render_order_documents(task):
+    """
+    Рендерит и записывает документы одного заказа; выполняется в процессе пула.
+    task - (заказ, виды документов, формат, каталог). Возвращает (id заказа, файлов, байт).
+    """
+    order, kinds, output_format, output_dir = task
+    written = sum(write_order_document(kind, order, output_dir, output_format)[1] for kind in kinds)
+    return order["id"], len(kinds), written
+
+def select_order_ids(date_from=None, date_to=None, statuses=None, include_archived=True, conn=None):
+    """
+    id заказов за период (даты 'ГГГГ-ММ-ДД' включительно) с необязательным фильтром статусов.
+    conn - например, снимок для отчетов (report_snapshot.py); архив берется из него, если он подключен.
+    """
+    close_conn_locally = conn is None
+    if close_conn_locally:
+        conn = create_connection()
+        if conn is None: return []
+    try:
+        conditions, params = ["1 = 1"], []
+        if date_from: conditions.append("order_date >= ?"); params.append(date_from)
+        if date_to: conditions.append("order_date < date(?, '+1 day')"); params.append(date_to)
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})"); params += list(statuses)
+        schemas = ["main"]
+        if include_archived and not close_conn_locally:
+            if is_archive_attached(conn): schemas.append("archive")
+        elif include_archived and archive_database_exists():
+            attach_archive_database(conn); schemas.append("archive")
+        where = " AND ".join(conditions)
+        sql = " UNION ALL ".join(f"SELECT id FROM {schema}.orders WHERE {where}" for schema in schemas)
+        return [row[0] for row in conn.execute(f"{sql} ORDER BY 1", params * len(schemas))]
+    finally:
+        if close_conn_locally: conn.close()
+
+def generate_documents(order_ids, output_dir, kinds=DOCUMENT_KINDS, output_format="html", workers=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, include_archived=True, progress=None, conn=None, cancel_token=None):
+    """
+    Генерирует документы kinds для заказов order_ids в output_dir.
+    workers - число процессов (None - по числу ядер, 1 - без пула, в текущем процессе).
+    conn - откуда читать заказы (например, снимок для отчетов); по умолчанию рабочая БД.
+    cancel_token - прогресс (заказов из len(order_ids)) и отмена: пул останавливается, возвращается "Cancelled";
+    уже записанные документы остаются (каждый файл записан целиком).
+    progress(готово заказов) вызывается по мере записи. Возвращает сводку или строку ошибки.
+    """
+    kinds = tuple(kinds)
+    unknown = [kind for kind in kinds if kind not in DOCUMENT_KINDS]
+    if unknown or not kinds: return f"InvalidDocumentError:неизвестный вид документа {', '.join(unknown)}"
+    if output_format not in OUTPUT_FORMATS: return f"InvalidDocumentError:неизвестный формат {output_format}"
+    if output_format == "pdf":
+        if pdf_canvas is None: return "PdfUnavailableError"
+        try: _pdf_font()
+        except OSError as e: return f"DocumentFileError:{e}"
+    try: os.makedirs(output_dir, exist_ok=True)
+    except OSError as e: return f"DocumentFileError:{e}"
+    workers = workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    orders = files = size = 0
+    total = len(order_ids) if hasattr(order_ids, "__len__") else None
+    def done_order():
+        if progress: progress(orders)
+        if cancel_token is not None:
+            cancel_token.report(orders, total)
+            return cancel_token.cancelled
+        return False
+    tasks = ((order, kinds, output_format, output_dir) for order in iter_orders_details(order_ids, include_archived, conn=conn))
+    try:
+        if workers == 1:
+            results = map(render_order_documents, tasks)
+            for _, order_files, order_bytes in results:
+                orders += 1; files += order_files; size += order_bytes
+                if done_order(): return CANCELLED
+        else:
+            # spawn, а не fork: процесс GUI держит Tk и фоновый поток логирования, копировать их в дочерние нельзя
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                # imap_unordered: заказы читаются из БД, пока пул рендерит уже прочитанные, а итоги приходят по готовности
+                for _, order_files, order_bytes in pool.imap_unordered(render_order_documents, tasks, chunksize=chunk_size):
+                    orders += 1; files += order_files; size += order_bytes
+                    if done_order(): return CANCELLED # Выход из with завершает процессы пула
+    except OSError as e: return f"DocumentFileError:{e}"
+    elapsed = time.perf_counter() - started
+    return {"orders": orders, "files": files, "bytes": size, "workers": workers, "elapsed_s": round(elapsed, 3),
+            "orders_per_second": round(orders / elapsed, 1) if elapsed else orders, "output_dir": output_dir}
+
+def benchmark_document_generation(order_ids, output_dir, worker_counts=None, output_format="html", kinds=DOCUMENT_KINDS):
+    """
+    Замер масштабирования: одни и те же заказы с разным числом процессов.
+    Возвращает строки {"workers", "elapsed_s", "orders_per_second", "speedup", "efficiency"} или строку ошибки.
+    """
+    if worker_counts is None:
+        cores = os.cpu_count() or 1
+        worker_counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)) | {1})
+    rows, baseline = [], None
+    for workers in worker_counts:
+        result = generate_documents(order_ids, os.path.join(output_dir, f"workers_{workers}"), kinds, output_format, workers)
+        if not isinstance(result, dict): return result
+        if baseline is None: baseline = result["elapsed_s"] or 1e-9
+        speedup = baseline / (result["elapsed_s"] or 1e-9)
+        rows.append({"workers": workers, "orders": result["orders"], "elapsed_s": result["elapsed_s"],
+                     "orders_per_second": result["orders_per_second"], "speedup": round(speedup, 2),
+                     "efficiency": round(speedup / workers, 2)})
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пакетная генерация счетов и листов сборки")
+    parser.add_argument("--from", dest="date_from", help="начало периода, ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="date_to", help="конец периода включительно, ГГГГ-ММ-ДД")
+    parser.add_argument("--status", action="append", help="только заказы с этим статусом (можно несколько раз)")
+    parser.add_argument("--kind", action="append", choices=DOCUMENT_KINDS, help="вид документа (по умолчанию оба)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="html")
+    parser.add_argument("--out", required=True, help="каталог для документов")
+    parser.add_argument("--workers", type=int, default=None, help="процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--benchmark", action="store_true", help="замерить скорость при 1, 2, 4, ... процессах")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    ids = select_order_ids(args.date_from, args.date_to, args.status)
+    kinds = tuple(args.kind or DOCUMENT_KINDS)
+    if args.benchmark:
+        report = benchmark_document_generation(ids, args.out, output_format=args.format, kinds=kinds)
+        if isinstance(report, str): print(report)
+        else:
+            print(f"{'процессов':>9} {'заказов':>8} {'время, с':>9} {'заказов/с':>10} {'ускорение':>10} {'эффективность':>14}")
+            for row in report:
+                print(f"{row['workers']:>9} {row['orders']:>8} {row['elapsed_s']:>9} {row['orders_per_second']:>10} {row['speedup']:>10} {row['efficiency']:>14}")
+    else:
+        print(generate_documents(ids, args.out, kinds, args.format, args.workers))
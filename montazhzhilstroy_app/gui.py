@@ -1,14 +1,38 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, simpledialog, filedialog
 import product_crud as pc 
 import client_crud as cc 
 import order_crud as oc 
-import logging
-from datetime import datetime
-
-logging.basicConfig(filename='app_errors.log', level=logging.ERROR,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    encoding='utf-8')
+import archive as ar
+import change_feed as cf
+import inventory as inv
+import stock_alerts as sa
+import repricing as rp
+import client_import as ci
+import client_dedup as cd
+import attachments as att
+import audit
+from article_index import ArticleIndex, normalize_article
+import order_draft as od
+import reservations as res
+import client_stats as cs
+import documents as docs
+from report_snapshot import ReportSnapshot
+from cancellation import CancelToken, CANCELLED
+from app_logging import get_logger
+import os
+import tempfile
+import threading
+import webbrowser
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+CHANGE_POLL_INTERVAL_MS = 2000 # Как часто окно проверяет изменения, сделанные другими операторами
+CHANGE_LOG_PRUNE_EVERY_POLLS = 150
+DRAFT_AUTOSAVE_DELAY_MS = 500 # Черновик заказа пишется в БД не чаще, чем раз в полсекунды
+SCAN_FLUSH_DELAY_MS = 80 # Сканы, пришедшие за это время, применяются к заказу одной пачкой
+PROGRESS_POLL_INTERVAL_MS = 100 # Как часто окно прогресса опрашивает фоновую операцию
+ORDERS_LOAD_DIALOG_DELAY_MS = 400 # Окно загрузки списка заказов с архивом появляется, только если загрузка затянулась
 
 class MainApp:
     def __init__(self, root):
@@ -16,7 +40,7 @@ class MainApp:
         self.root.title("ООО «МонтажЖилСтрой» - Система управления")
         self.root.geometry("1200x800") 
         self.root.configure(bg="#F0F0F0") 
-        self.logger = logging.getLogger("MainAppGUI")
+        self.logger = get_logger("gui")
 
         self.BG_COLOR = "#F0F0F0"
         self.FRAME_BG_COLOR = "#FFFFFF" 
@@ -91,6 +115,76 @@ class MainApp:
         
         self.notebook.pack(expand=True, fill='both', padx=5, pady=5)
 
+        self.change_watcher = cf.ChangeWatcher()
+        self.change_feed_active = self.change_watcher.start() is True
+        if not self.change_feed_active:
+            self.logger.error("Change feed is unavailable, lists will be fully reloaded after each action")
+        self.change_polls_count = 0
+        if self.change_feed_active: self.root.after(CHANGE_POLL_INTERVAL_MS, self._poll_changes_gui)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close_gui)
+
+    def on_close_gui(self):
+        self.save_order_draft_gui()
+        res.release_reservations(self.order_draft.holder)
+        self.change_watcher.close()
+        self.root.destroy()
+
+    def _poll_changes_gui(self):
+        self.refresh_changes_gui()
+        self.change_polls_count += 1
+        if self.change_polls_count % CHANGE_LOG_PRUNE_EVERY_POLLS == 0:
+            cf.prune_change_log()
+            audit.prune_audit_log()
+            res.prune_expired_reservations()
+        self.root.after(CHANGE_POLL_INTERVAL_MS, self._poll_changes_gui)
+
+    def refresh_changes_gui(self):
+        """Обновляет только те вкладки и строки, которые изменились в БД (в том числе другими окнами)."""
+        changes = self.change_watcher.poll() if self.change_feed_active else dict.fromkeys(cf.CHANGE_FEED_TABLES)
+        if not changes: return
+        if "products" in changes:
+            self._refresh_tree_rows(self.p_tree, changes["products"], pc.get_products_by_ids, self._p_row_values,
+                                    lambda: self.load_p_gui(clear_form=False), sort_column=1)
+            if self.sel_p_id and not self.p_tree.exists(str(self.sel_p_id)): self.clr_p_flds_gui()
+            self.populate_product_combobox()
+            self.article_index.refresh(changes["products"])
+            self.load_alerts_gui() # Оповещения создаются триггерами только при изменении товаров
+        if "clients" in changes:
+            self._refresh_tree_rows(self.cl_tree, changes["clients"], cc.get_clients_by_ids, self._cl_row_values,
+                                    lambda: self.load_cl_gui(clear_form=False), sort_column=1)
+            if self.sel_cl_id and not self.cl_tree.exists(str(self.sel_cl_id)): self.clr_cl_flds_gui()
+            self.populate_client_combobox()
+            self.load_orders_gui() # В списке заказов отображаются имена клиентов
+        elif "orders" in changes:
+            if self.show_archived_orders_var.get(): self.load_orders_gui()
+            else:
+                self._refresh_tree_rows(self.orders_tree, changes["orders"], oc.get_orders_by_ids, self._order_row_values,
+                                        self.load_orders_gui)
+                if self.sel_order_id and not self.orders_tree.exists(str(self.sel_order_id)):
+                    self.sel_order_id = None
+                    self.update_order_action_buttons_state()
+        if "orders" in changes and self.sel_cl_id: self.show_client_summary_gui() # Итоги клиента меняются вместе с его заказами
+
+    def _refresh_tree_rows(self, tree, row_ids, fetch_rows, row_values, full_reload, sort_column=None):
+        """Точечно обновляет, добавляет и удаляет строки дерева (iid = id записи). row_ids=None - полная перезагрузка."""
+        if row_ids is None:
+            full_reload(); return
+        fresh_rows = {str(row["id"]): row_values(row) for row in fetch_rows(row_ids)}
+        for row_id in map(str, row_ids):
+            if row_id in fresh_rows:
+                if tree.exists(row_id): tree.item(row_id, values=fresh_rows[row_id])
+                else: tree.insert("", self._tree_insert_index(tree, fresh_rows[row_id], sort_column), iid=row_id, values=fresh_rows[row_id])
+            elif tree.exists(row_id):
+                tree.delete(row_id)
+        self._apply_treeview_row_tags(tree)
+
+    def _tree_insert_index(self, tree, values, sort_column):
+        if sort_column is None: return 0 # Новые заказы - в начало списка
+        key = str(values[sort_column])
+        for idx, item_id in enumerate(tree.get_children()):
+            if str(tree.item(item_id, "values")[sort_column]) > key: return idx
+        return "end"
+
     def _handle_crud_result(self, result, operation_description, entity_name=""):
         title_prefix = "Операция"
         if "товар" in operation_description: title_prefix = "Товар"
@@ -108,6 +202,9 @@ class MainApp:
             messagebox.showinfo(f"Успех ({title_prefix})", success_message)
             return True
         
+        if result == CANCELLED:
+            messagebox.showinfo(f"Отмена ({title_prefix})", "Операция отменена."); return False
+
         error_title = f"Ошибка {operation_description}"
         user_message = ""
         log_message = f"Error during {operation_description} for '{entity_name}': {result}"
@@ -121,6 +218,14 @@ class MainApp:
         elif result == "HasOrderItemsError": user_message = f"Нельзя удалить товар '{entity_name}', он используется в заказах."
         elif result == "StockCannotBeNegative": user_message = "Остаток товара не может быть отрицательным."
         elif result == "InvalidStatusError": user_message = f"Выбран неверный статус для заказа."
+        elif result == "ReorderLevelCannotBeNegative": user_message = "Минимальный остаток не может быть отрицательным."
+        elif result == "InvalidPriceError": user_message = "Цена должна быть числом (например, 1250.50)."
+        elif isinstance(result, str) and result.startswith("InvalidRepricingError"):
+            user_message = f"Некорректные параметры переоценки: {result.split(':',1)[1]}"
+        elif result == "SameClientError": user_message = "Нельзя объединить клиента с самим собой."
+        elif result == "AttachmentTooLargeError": user_message = f"Файл больше {att.MAX_ATTACHMENT_BYTES // (1024 * 1024)} МБ."
+        elif isinstance(result, str) and result.startswith("AttachmentFileError"):
+            user_message = f"Ошибка работы с файлом: {result.split(':',1)[1]}"
         elif result == "OrderCreationError": user_message = "Не удалось создать запись о заказе в базе данных."
         elif isinstance(result, str) and result.startswith("InsufficientStockError"):
             product_name_involved = result.split(":",1)[1] if ":" in result else "некоторых товаров"
@@ -133,13 +238,76 @@ class MainApp:
             technical_details = parts[1] if len(parts) > 1 else "Нет деталей"
             user_message = f"Произошла внутренняя ошибка базы данных ({error_type}). Обратитесь к администратору."
             log_message = f"{error_type} during {operation_description} for '{entity_name}': {technical_details}"
-            self.logger.error(log_message)
+            self.logger.error(log_message, extra={"operation": operation_description, "entity_id": entity_name, "result": result})
         else:
             user_message = f"Произошла неизвестная ошибка: {result}"
-            self.logger.error(log_message)
+            self.logger.error(log_message, extra={"operation": operation_description, "entity_id": entity_name, "result": result})
         messagebox.showerror(error_title, user_message)
         return False
     
+    def run_cancellable_gui(self, title, operation, on_done, show_delay_ms=0):
+        """
+        Выполняет operation(cancel_token) в фоновом потоке с окном прогресса и кнопкой отмены.
+        on_done(result) вызывается в потоке Tk; при отмене result == CANCELLED. Возвращает токен отмены.
+        show_delay_ms - окно показывается, только если операция идет дольше (короткие загрузки не мигают).
+        """
+        state = {"progress": None, "finished": False, "result": None}
+        token = CancelToken(progress=lambda done, total: state.update(progress=(done, total)))
+        started = datetime.now()
+        widgets = {}
+
+        def work():
+            try: state["result"] = operation(token)
+            except Exception as e: # Ошибка фонового потока не должна оставить окно висеть
+                self.logger.exception(f"Background operation '{title}' failed")
+                state["result"] = f"BackgroundError:{type(e).__name__}: {e}"
+            state["finished"] = True
+
+        def cancel():
+            token.cancel()
+            if widgets:
+                widgets["label"].config(text="Отмена...")
+                widgets["cancel"].config(state="disabled")
+
+        def show_window():
+            win = tk.Toplevel(self.root)
+            win.title(title)
+            win.configure(bg=self.BG_COLOR)
+            win.transient(self.root)
+            win.resizable(False, False)
+            label = ttk.Label(win, text="Выполняется...", style="BG.TLabel")
+            label.pack(padx=20, pady=(15,5))
+            bar = ttk.Progressbar(win, mode="indeterminate", length=320)
+            bar.pack(padx=20, pady=5)
+            bar.start(15)
+            btns = ttk.Frame(win)
+            btns.pack(pady=10)
+            cancel_button = ttk.Button(btns, text="Отмена", command=cancel, style="Warning.TButton")
+            cancel_button.pack(side="left")
+            win.protocol("WM_DELETE_WINDOW", cancel)
+            widgets.update(window=win, label=label, bar=bar, cancel=cancel_button)
+
+        def poll():
+            if state["finished"]:
+                if widgets: widgets["window"].destroy()
+                on_done(state["result"]); return
+            if not widgets and (datetime.now() - started).total_seconds() * 1000 >= show_delay_ms: show_window()
+            if widgets and state["progress"] and not token.cancelled:
+                done, total = state["progress"]
+                bar = widgets["bar"]
+                if total:
+                    if str(bar.cget("mode")) != "determinate":
+                        bar.stop(); bar.config(mode="determinate", maximum=total)
+                    bar.config(value=min(done, total))
+                    widgets["label"].config(text=f"{done} из {total}")
+                else: widgets["label"].config(text=f"Обработано: {done}")
+            self.root.after(PROGRESS_POLL_INTERVAL_MS, poll)
+
+        if show_delay_ms <= 0: show_window()
+        threading.Thread(target=work, name=f"op-{title}", daemon=True).start()
+        self.root.after(PROGRESS_POLL_INTERVAL_MS, poll)
+        return token
+
     def _apply_treeview_row_tags(self, tree):
         for i, item_id in enumerate(tree.get_children()):
             tag = "evenrow" if i % 2 == 0 else "oddrow"
@@ -150,9 +318,11 @@ class MainApp:
         form_f.pack(padx=10, pady=10, fill="x")
         btn_f = ttk.Frame(parent_tab, padding=(0, 10))
         btn_f.pack(padx=10, pady=(0,10), fill="x")
+        alerts_f = ttk.LabelFrame(parent_tab, text="Оповещения о низком остатке")
+        alerts_f.pack(side="bottom", padx=10, pady=(0,10), fill="x")
         tree_f = ttk.LabelFrame(parent_tab, text="Список товаров")
         tree_f.pack(padx=10, pady=(0,10), fill="both", expand=True)
-        lbls = ["Название:", "Артикул:", "Категория:", "Описание:", "Цена:", "Кол-во на складе:"]
+        lbls = ["Название:", "Артикул:", "Категория:", "Описание:", "Цена:", "Закупочная цена:", "Кол-во на складе:", "Мин. остаток:"]
         self.p_entries = {}
         for i, lt in enumerate(lbls):
             ttk.Label(form_f, text=lt).grid(row=i, column=0, padx=5, pady=8, sticky="w")
@@ -166,12 +336,16 @@ class MainApp:
                 self.p_entries[lt.replace(":", "")] = ttk.Entry(form_f, width=50)
                 self.p_entries[lt.replace(":", "")].grid(row=i, column=1, padx=5, pady=8, sticky="ew")
         form_f.columnconfigure(1, weight=1)
+        self.create_product_attachments_ui(form_f, len(lbls))
         btn_configs = [
             ("Добавить товар", self.add_p_gui, "Accent.TButton"),
             ("Обновить товар", self.upd_p_gui, "TButton"),
             ("Удалить товар", self.del_p_gui, "Warning.TButton"),
             ("Очистить поля", self.clr_p_flds_gui, "TButton"),
-            ("Обновить список", self.load_p_gui, "TButton")
+            ("Обновить список", self.load_p_gui, "TButton"),
+            ("История", lambda: self.entity_history_gui("products", self.sel_p_id, "товара"), "TButton"),
+            ("К заказу", self.view_reorder_list_gui, "TButton"),
+            ("Переоценка...", self.repricing_gui, "TButton")
         ]
         for text, cmd, style_name in btn_configs:
             ttk.Button(btn_f, text=text, command=cmd, style=style_name).pack(side="left", padx=(0,10))
@@ -192,14 +366,149 @@ class MainApp:
         self.p_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
         self.load_p_gui()
 
-    def load_p_gui(self):
+        self.alerts_tree = ttk.Treeview(alerts_f, columns=("ID", "Article", "Product", "Stock", "Level", "Created"), show="headings", height=4)
+        a_hds = [("ID",0,"w",""),("Article",120,"w","Артикул"),("Product",300,"w","Товар"),("Stock",90,"center","Остаток"),
+                 ("Level",110,"center","Мин. остаток"),("Created",150,"w","С")]
+        for c,w,a,title in a_hds:
+            self.alerts_tree.heading(c, text=title)
+            self.alerts_tree.column(c, width=w, anchor=a, stretch=tk.YES if c=="Product" else tk.NO)
+        self.alerts_tree.column("ID", stretch=tk.NO, width=0, minwidth=0)
+        self.alerts_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        self.alerts_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+        ttk.Button(alerts_f, text="Принять", command=self.acknowledge_alert_gui, style="TButton").pack(side="right", padx=(10,0), anchor="n")
+        self.alerts_tree.pack(fill="x", expand=True, padx=(0,5), pady=(0,5))
+        self.load_alerts_gui()
+
+    def create_product_attachments_ui(self, form_f, rowspan):
+        attach_f = ttk.LabelFrame(form_f, text="Вложения")
+        attach_f.grid(row=0, column=2, rowspan=rowspan, padx=5, pady=8, sticky="nsew")
+        self.p_thumb_label = ttk.Label(attach_f, text="Нет изображения", anchor="center", width=24)
+        self.p_thumb_label.pack(padx=5, pady=5, ipady=10)
+        self.p_attach_list = tk.Listbox(attach_f, height=6, width=36, font=self.ENTRY_FONT, activestyle="none", exportselection=False,
+                                        background=self.FRAME_BG_COLOR, fg=self.TEXT_COLOR, relief=tk.FLAT, highlightthickness=1,
+                                        highlightbackground=self.BORDER_COLOR)
+        self.p_attach_list.pack(fill="both", expand=True, padx=5)
+        self.p_attach_list.bind("<<ListboxSelect>>", lambda ev: self.show_attachment_thumbnail_gui())
+        a_btns = ttk.Frame(attach_f)
+        a_btns.pack(fill="x", padx=5, pady=5)
+        ttk.Button(a_btns, text="Добавить файл...", command=self.add_attachment_gui, style="TButton").pack(side="left", padx=(0,5))
+        ttk.Button(a_btns, text="Сохранить как...", command=self.export_attachment_gui, style="TButton").pack(side="left", padx=(0,5))
+        ttk.Button(a_btns, text="Удалить", command=self.del_attachment_gui, style="Warning.TButton").pack(side="left")
+        self.p_attachments = []
+        self.p_thumb_image = None # Ссылка на PhotoImage, иначе картинку соберет сборщик мусора
+        self.p_attach_token = 0
+        self.p_thumb_token = 0
+
+    def clear_attachments_gui(self):
+        self.p_attach_token += 1 # Отложенная загрузка для прежнего товара будет отброшена
+        self.p_thumb_token += 1
+        self.p_attachments = []
+        self.p_attach_list.delete(0, tk.END)
+        self.p_thumb_label.configure(image="", text="Нет изображения"); self.p_thumb_image = None
+
+    def schedule_attachments_load_gui(self):
+        # Вложения и миниатюры грузятся только для выбранного товара и после отрисовки формы,
+        # чтобы быстрый переход по списку товаров не ждал чтения файлов
+        self.clear_attachments_gui()
+        token, product_id = self.p_attach_token, self.sel_p_id
+        self.root.after_idle(lambda: self.load_attachments_gui(product_id, token))
+
+    def load_attachments_gui(self, product_id, token):
+        if token != self.p_attach_token or product_id != self.sel_p_id: return
+        self.p_attachments = att.get_product_attachments(product_id)
+        for a in self.p_attachments:
+            self.p_attach_list.insert(tk.END, f"{a['file_name']} ({max(1, round(a['size'] / 1024))} КБ)")
+        first_image = next((i for i, a in enumerate(self.p_attachments) if a["is_image"]), None)
+        if first_image is not None:
+            self.p_attach_list.selection_set(first_image)
+            self.show_attachment_thumbnail_gui()
+
+    def _selected_attachment(self):
+        selected = self.p_attach_list.curselection()
+        return self.p_attachments[selected[0]] if selected and selected[0] < len(self.p_attachments) else None
+
+    def show_attachment_thumbnail_gui(self):
+        self.p_thumb_token += 1 # Миниатюра, которая еще строится для прежнего выбора, будет отброшена
+        a = self._selected_attachment()
+        thumb_path = att.get_cached_thumbnail(a) if a else None
+        if thumb_path is None and a is not None and a["is_image"]:
+            # Миниатюры еще нет: картинка (до MAX_ATTACHMENT_BYTES) читается и уменьшается в фоновом потоке, окно не замирает
+            token, state = self.p_thumb_token, {}
+            def work():
+                try: state["path"] = att.get_attachment_thumbnail(a)
+                except Exception: # Ошибка фонового потока не должна оставить "Загрузка..." навсегда
+                    self.logger.exception(f"Thumbnail for attachment {a['id']} failed")
+                    state["path"] = None
+            def poll():
+                if token != self.p_thumb_token: return
+                if "path" not in state: self.root.after(PROGRESS_POLL_INTERVAL_MS, poll); return
+                self._set_attachment_thumbnail_gui(a, state["path"])
+            self.p_thumb_label.configure(image="", text="Загрузка..."); self.p_thumb_image = None
+            threading.Thread(target=work, name="thumbnail", daemon=True).start()
+            self.root.after(PROGRESS_POLL_INTERVAL_MS, poll)
+            return
+        self._set_attachment_thumbnail_gui(a, thumb_path)
+
+    def _set_attachment_thumbnail_gui(self, a, thumb_path):
+        if thumb_path is None:
+            text = "Нет изображения" if a is None or a["is_image"] else a["mime_type"] or "Файл"
+            self.p_thumb_label.configure(image="", text=text); self.p_thumb_image = None; return
+        try: self.p_thumb_image = tk.PhotoImage(file=thumb_path)
+        except tk.TclError: self.p_thumb_label.configure(image="", text="Нет изображения"); self.p_thumb_image = None; return
+        self.p_thumb_label.configure(image=self.p_thumb_image, text="")
+
+    def add_attachment_gui(self):
+        if not self.sel_p_id: messagebox.showwarning("Внимание (Товар)", "Выберите товар для добавления вложения."); return
+        path = filedialog.askopenfilename(parent=self.root, title="Добавить вложение к товару",
+                                          filetypes=[("Изображения", "*.png *.jpg *.jpeg *.gif *.bmp *.webp"), ("Все файлы", "*.*")])
+        if not path: return
+        self.root.config(cursor="watch"); self.root.update_idletasks()
+        try: res = att.add_product_attachment(self.sel_p_id, path)
+        finally: self.root.config(cursor="")
+        if isinstance(res, int): self.schedule_attachments_load_gui()
+        else: self._handle_crud_result(res, "добавления вложения к товару", path)
+
+    def export_attachment_gui(self):
+        a = self._selected_attachment()
+        if a is None: messagebox.showwarning("Внимание (Товар)", "Выберите вложение для сохранения."); return
+        path = filedialog.asksaveasfilename(parent=self.root, title="Сохранить вложение", initialfile=a["file_name"])
+        if not path: return
+        res = att.export_product_attachment(a["id"], path)
+        if res is not True: self._handle_crud_result(res, "сохранения вложения товара", a["file_name"])
+
+    def del_attachment_gui(self):
+        a = self._selected_attachment()
+        if a is None: messagebox.showwarning("Внимание (Товар)", "Выберите вложение для удаления."); return
+        if messagebox.askyesno("Подтверждение (Товар)", f"Удалить вложение '{a['file_name']}'?"):
+            res = att.delete_product_attachment(a["id"])
+            if res is True: self.schedule_attachments_load_gui()
+            else: self._handle_crud_result(res, "удаления вложения товара", a["file_name"])
+
+    def load_alerts_gui(self):
+        for i in self.alerts_tree.get_children(): self.alerts_tree.delete(i)
+        for idx, a in enumerate(sa.get_open_stock_alerts()):
+            tag = "evenrow" if idx % 2 == 0 else "oddrow"
+            self.alerts_tree.insert("", "end", iid=str(a["id"]), values=(a["id"], a["article_number"] or "", a["product_name"] or "",
+                                                                         a["stock_quantity"], a["reorder_level"], a["created_at"]), tags=(tag,))
+
+    def acknowledge_alert_gui(self):
+        selected = self.alerts_tree.focus()
+        if not selected: messagebox.showwarning("Внимание (Товар)", "Выберите оповещение."); return
+        result = sa.acknowledge_stock_alert(int(selected))
+        if result is True: self.load_alerts_gui()
+        else: self._handle_crud_result(result, "закрытия оповещения по товару", self.alerts_tree.item(selected, "values")[2])
+
+    def _p_row_values(self, p):
+        return (p["id"], p["name"], p["article_number"], p.get("category") or "", f"{p['price']:.2f}", p["stock_quantity"])
+
+    def load_p_gui(self, clear_form=True):
         for i in self.p_tree.get_children(): self.p_tree.delete(i)
         products = pc.get_all_products()
         if isinstance(products, list):
             for idx, p in enumerate(products): 
                 tag = "evenrow" if idx % 2 == 0 else "oddrow"
-                self.p_tree.insert("", "end", values=(p["id"], p["name"], p["article_number"], p.get("category",""), f"{p['price']:.2f}", p["stock_quantity"]), tags=(tag,))
-        self.clr_p_flds_gui()
+                self.p_tree.insert("", "end", iid=str(p["id"]), values=self._p_row_values(p), tags=(tag,))
+        if clear_form: self.clr_p_flds_gui()
 
     def get_p_form_data(self):
         d = {};
@@ -210,51 +519,279 @@ class MainApp:
             d["description"]=self.p_entries["Описание"].get("1.0",tk.END).strip()
             pr_s, st_s = self.p_entries["Цена"].get().strip(), self.p_entries["Кол-во на складе"].get().strip()
             if not d["name"] or not d["article_number"]: messagebox.showerror("Ошибка валидации (Товар)", "Поля 'Название' и 'Артикул' обязательны."); return None
-            d["price"]=float(pr_s) if pr_s else 0.0; d["stock_quantity"]=int(st_s) if st_s else 0
-            if d["price"]<0 : messagebox.showerror("Ошибка валидации (Товар)", "Цена не может быть отрицательной."); return None
+            d["price"]=Decimal(pr_s.replace(",", ".")) if pr_s else Decimal("0.00"); d["stock_quantity"]=int(st_s) if st_s else 0
+            cost_s = self.p_entries["Закупочная цена"].get().strip()
+            d["cost_price"]=Decimal(cost_s.replace(",", ".")) if cost_s else Decimal("0.00")
+            level_s = self.p_entries["Мин. остаток"].get().strip()
+            d["reorder_level"]=int(level_s) if level_s else 0
+            if d["reorder_level"]<0 : messagebox.showerror("Ошибка валидации (Товар)", "Мин. остаток не может быть отрицательным."); return None
+            if d["price"]<0 or d["cost_price"]<0 : messagebox.showerror("Ошибка валидации (Товар)", "Цена не может быть отрицательной."); return None
             if d["stock_quantity"]<0 : messagebox.showerror("Ошибка валидации (Товар)", "Кол-во на складе не может быть отрицательным."); return None
             return d
-        except ValueError: messagebox.showerror("Ошибка валидации (Товар)", "'Цена' и 'Кол-во на складе' должны быть числами."); return None
+        except (ValueError, InvalidOperation): messagebox.showerror("Ошибка валидации (Товар)", "'Цена', 'Закупочная цена', 'Кол-во на складе' и 'Мин. остаток' должны быть числами."); return None
 
     def add_p_gui(self):
         d = self.get_p_form_data()
         if d:
-            res = pc.add_product(d["name"],d["article_number"],d["category"],d["description"],d["price"],d["stock_quantity"])
+            res = pc.add_product(d["name"],d["article_number"],d["category"],d["description"],d["price"],d["stock_quantity"],d["cost_price"],d["reorder_level"])
             entity_id_for_error = d["article_number"] if res == "IntegrityErrorArticle" else d["name"]
-            if self._handle_crud_result(res, "добавления товара", entity_id_for_error): self.load_p_gui()
+            if self._handle_crud_result(res, "добавления товара", entity_id_for_error): self.clr_p_flds_gui(); self.refresh_changes_gui()
     
     def on_p_sel_gui(self, ev):
         sel_i = self.p_tree.focus()
         if sel_i:
             self.sel_p_id = self.p_tree.item(sel_i, "values")[0]; p_det = pc.get_product_by_id(self.sel_p_id)
             if p_det:
-                for k,v_key in {"Название":"name", "Артикул":"article_number", "Категория":"category", "Цена":"price", "Кол-во на складе":"stock_quantity"}.items():
+                for k,v_key in {"Название":"name", "Артикул":"article_number", "Категория":"category", "Цена":"price", "Закупочная цена":"cost_price", "Кол-во на складе":"stock_quantity", "Мин. остаток":"reorder_level"}.items():
                     entry_widget = self.p_entries[k]
                     entry_widget.delete(0,tk.END)
                     entry_widget.insert(0, str(p_det.get(v_key,"") if p_det.get(v_key) is not None else ""))
                 self.p_entries["Описание"].delete("1.0",tk.END); self.p_entries["Описание"].insert("1.0", p_det.get("description","") or "")
+                self.schedule_attachments_load_gui()
         else: self.clr_p_flds_gui()
 
     def upd_p_gui(self):
         if not self.sel_p_id: messagebox.showwarning("Внимание (Товар)", "Выберите товар для обновления."); return
         d = self.get_p_form_data()
         if d:
-            res = pc.update_product(self.sel_p_id,d["name"],d["article_number"],d["category"],d["description"],d["price"],d["stock_quantity"])
+            res = pc.update_product(self.sel_p_id,d["name"],d["article_number"],d["category"],d["description"],d["price"],d["stock_quantity"],d["cost_price"],d["reorder_level"])
             entity_id_for_error = d["article_number"] if res == "IntegrityErrorArticle" else d["name"]
-            if self._handle_crud_result(res, f"обновления товара '{d['name']}'", entity_id_for_error): self.load_p_gui()
+            if self._handle_crud_result(res, f"обновления товара '{d['name']}'", entity_id_for_error): self.clr_p_flds_gui(); self.refresh_changes_gui()
 
     def del_p_gui(self):
         if not self.sel_p_id: messagebox.showwarning("Внимание (Товар)", "Выберите товар для удаления."); return
         p_info = pc.get_product_by_id(self.sel_p_id); p_name = p_info['name'] if p_info else f"ID {self.sel_p_id}"
         if messagebox.askyesno("Подтверждение (Товар)", f"Удалить товар '{p_name}'?"):
             res = pc.delete_product(self.sel_p_id)
-            if self._handle_crud_result(res, f"удаления товара", p_name): self.load_p_gui()
+            if self._handle_crud_result(res, f"удаления товара", p_name): self.clr_p_flds_gui(); self.refresh_changes_gui()
     
+    def entity_history_gui(self, table, row_id, entity_title):
+        """Журнал аудита одной сущности: по строке на каждое изменившееся поле (было и стало)."""
+        if not row_id: messagebox.showwarning("Внимание", f"Выберите запись для просмотра истории {entity_title}."); return
+        history = audit.get_entity_history(table, row_id)
+        if isinstance(history, str): self._handle_crud_result(history, f"чтения истории {entity_title}", f"ID {row_id}"); return
+
+        history_window = tk.Toplevel(self.root)
+        history_window.title(f"История {entity_title} ID {row_id}")
+        history_window.geometry("900x450")
+        history_window.configure(bg=self.BG_COLOR)
+        history_window.transient(self.root)
+        tree_frame = ttk.Frame(history_window, padding=10)
+        tree_frame.pack(fill="both", expand=True)
+        cols = ("When", "Operation", "Field", "Old", "New")
+        tree = ttk.Treeview(tree_frame, columns=cols, show="headings")
+        for c, title, w, a in [("When", "Когда", 150, "w"), ("Operation", "Действие", 170, "w"), ("Field", "Поле", 140, "w"),
+                               ("Old", "Было", 200, "w"), ("New", "Стало", 200, "w")]:
+            tree.heading(c, text=title)
+            tree.column(c, width=w, anchor=a, stretch=tk.YES if c in ("Old", "New") else tk.NO)
+        scr_y = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scr_y.set)
+        scr_y.pack(side="right", fill="y"); tree.pack(fill="both", expand=True)
+        tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+
+        for idx, entry in enumerate(history):
+            operation = audit.AUDIT_OPERATIONS[entry["operation"]]
+            if entry["table"] == "order_items": operation = f"{operation} позиции {entry['changes']['id']}"
+            tag = "evenrow" if idx % 2 == 0 else "oddrow" # Поля одной записи журнала - одним цветом
+            for column, old_value, new_value in audit.describe_changes(entry):
+                tree.insert("", "end", values=(entry["changed_at"], operation, audit.AUDIT_COLUMN_TITLES.get(column, column),
+                                               audit.format_audit_value(column, old_value), audit.format_audit_value(column, new_value)), tags=(tag,))
+        if not history: tree.insert("", "end", values=("", "Изменений не записано", "", "", ""))
+
+        btns = ttk.Frame(history_window)
+        btns.pack(pady=10)
+        ttk.Button(btns, text="Закрыть", command=history_window.destroy, style="Accent.TButton").pack(side="left")
+
+    def view_reorder_list_gui(self):
+        def on_done(result):
+            if isinstance(result, dict): self.show_reorder_list_gui()
+            else: self._handle_crud_result(result, "расчета плана запасов", "товары")
+        self.run_cancellable_gui("Расчет плана запасов", lambda token: inv.refresh_inventory_plan(cancel_token=token), on_done)
+
+    def show_reorder_list_gui(self):
+        reorder_window = tk.Toplevel(self.root)
+        reorder_window.title("Товары к заказу")
+        reorder_window.geometry("900x500")
+        reorder_window.configure(bg=self.BG_COLOR)
+        reorder_window.transient(self.root)
+
+        ttk.Label(reorder_window, text="Товары, достигшие точки заказа", style="Header.TLabel").pack(pady=(10,5))
+        list_frame = ttk.LabelFrame(reorder_window, text=f"Срок поставки {inv.DEFAULT_LEAD_TIME_DAYS} дн., спрос за {inv.DEFAULT_WINDOW_DAYS} дн.")
+        list_frame.pack(padx=10, pady=5, fill="both", expand=True)
+
+        reorder_tree = ttk.Treeview(list_frame, columns=("Article", "Product", "Stock", "ROP", "Class", "Demand", "Suggested"), show="headings")
+        r_hds = [("Article",120,"w","Артикул"),("Product",260,"w","Товар"),("Stock",80,"center","Остаток"),("ROP",100,"center","Точка заказа"),
+                 ("Class",70,"center","ABC/XYZ"),("Demand",110,"e","Спрос в день"),("Suggested",110,"center","Заказать")]
+        for c,w,a,title in r_hds:
+            reorder_tree.heading(c, text=title)
+            reorder_tree.column(c, width=w, anchor=a, minwidth=w, stretch=tk.YES if c=="Product" else tk.NO)
+        reorder_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        reorder_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+
+        def load_reorder_rows():
+            for i in reorder_tree.get_children(): reorder_tree.delete(i)
+            for idx, r in enumerate(inv.get_reorder_list()):
+                tag = "evenrow" if idx % 2 == 0 else "oddrow"
+                reorder_tree.insert("", "end", values=(r['article_number'], r['name'], r['stock_quantity'], r['reorder_point'],
+                                                       f"{r['abc_class']}{r['xyz_class']}", f"{r['avg_daily_demand']:.2f}", r['suggested_quantity']), tags=(tag,))
+
+        def full_recompute():
+            def on_done(result):
+                if not reorder_window.winfo_exists(): return
+                if isinstance(result, dict): load_reorder_rows()
+                else: self._handle_crud_result(result, "расчета плана запасов", "товары")
+            self.run_cancellable_gui("Полный пересчет плана запасов", lambda token: inv.refresh_inventory_plan(full=True, cancel_token=token), on_done)
+
+        r_scr_y = ttk.Scrollbar(list_frame, orient="vertical", command=reorder_tree.yview)
+        reorder_tree.configure(yscrollcommand=r_scr_y.set)
+        r_scr_y.pack(side="right", fill="y")
+        reorder_tree.pack(fill="both", expand=True, padx=(0,5), pady=(0,5))
+        load_reorder_rows()
+
+        btns = ttk.Frame(reorder_window)
+        btns.pack(pady=10)
+        def apply_levels():
+            result = inv.apply_reorder_points_as_levels()
+            if isinstance(result, int):
+                messagebox.showinfo("Успех (Товар)", f"Мин. остаток обновлен у товаров: {result}.", parent=reorder_window)
+                self.refresh_changes_gui()
+            else: self._handle_crud_result(result, "обновления минимальных остатков товаров", "товары")
+
+        ttk.Button(btns, text="Пересчитать полностью", command=full_recompute, style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Точки заказа -> мин. остаток", command=apply_levels, style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Закрыть", command=reorder_window.destroy, style="Accent.TButton").pack(side="left")
+
+    def _parse_repricing_rules(self, text):
+        """Строки вида 'до 1000: 10' и 'выше: 5' -> [(граница в руб. или None, процент), ...]."""
+        rules = []
+        for line in text.replace(";", "\n").splitlines():
+            if not line.strip(): continue
+            if ":" not in line: raise ValueError(f"Нет ':' в правиле '{line.strip()}'")
+            bound, percent = (part.strip() for part in line.split(":", 1))
+            bound = bound.lower().replace("до", "").strip()
+            rules.append((None if bound in ("выше", "*", "") else bound, percent))
+        return rules
+
+    def repricing_gui(self):
+        repricing_window = tk.Toplevel(self.root)
+        repricing_window.title("Переоценка товаров")
+        repricing_window.geometry("950x650")
+        repricing_window.configure(bg=self.BG_COLOR)
+        repricing_window.transient(self.root)
+
+        top_f = ttk.Frame(repricing_window)
+        top_f.pack(padx=10, pady=(10,5), fill="x")
+        filter_f = ttk.LabelFrame(top_f, text="Какие товары")
+        filter_f.pack(side="left", fill="both", expand=True, padx=(0,5))
+        change_f = ttk.LabelFrame(top_f, text="Как изменить цену")
+        change_f.pack(side="left", fill="both", expand=True, padx=(5,0))
+
+        ttk.Label(filter_f, text="Категория:").grid(row=0, column=0, padx=5, pady=4, sticky="w")
+        category_cb = ttk.Combobox(filter_f, values=[""] + pc.get_product_categories(), state="readonly", width=24)
+        category_cb.grid(row=0, column=1, columnspan=3, padx=5, pady=4, sticky="ew")
+        ttk.Label(filter_f, text="Артикул начинается с:").grid(row=1, column=0, padx=5, pady=4, sticky="w")
+        prefix_e = ttk.Entry(filter_f, width=24)
+        prefix_e.grid(row=1, column=1, columnspan=3, padx=5, pady=4, sticky="ew")
+        ttk.Label(filter_f, text="Цена от / до:").grid(row=2, column=0, padx=5, pady=4, sticky="w")
+        price_min_e, price_max_e = ttk.Entry(filter_f, width=10), ttk.Entry(filter_f, width=10)
+        price_min_e.grid(row=2, column=1, padx=5, pady=4, sticky="w")
+        price_max_e.grid(row=2, column=2, padx=5, pady=4, sticky="w")
+        ttk.Label(filter_f, text="Артикулы поставщика\n(по одному в строке):").grid(row=3, column=0, padx=5, pady=4, sticky="nw")
+        articles_text = tk.Text(filter_f, height=4, width=24, relief="solid", borderwidth=1, font=self.ENTRY_FONT)
+        articles_text.grid(row=3, column=1, columnspan=3, padx=5, pady=4, sticky="ew")
+        filter_f.columnconfigure(3, weight=1)
+
+        mode_var = tk.StringVar(value="percent")
+        for i, (mode, title) in enumerate((("percent", "На процент"), ("absolute", "На сумму, руб."), ("rules", "По ступеням цены"))):
+            ttk.Radiobutton(change_f, text=title, variable=mode_var, value=mode).grid(row=i, column=0, padx=5, pady=2, sticky="w")
+        ttk.Label(change_f, text="Значение:").grid(row=0, column=1, padx=5, pady=2, sticky="e")
+        value_e = ttk.Entry(change_f, width=12)
+        value_e.grid(row=0, column=2, padx=5, pady=2, sticky="w")
+        ttk.Label(change_f, text="Ступени (%):").grid(row=3, column=0, padx=5, pady=2, sticky="nw")
+        rules_text = tk.Text(change_f, height=3, width=24, relief="solid", borderwidth=1, font=self.ENTRY_FONT)
+        rules_text.insert("1.0", "до 1000: 10\nдо 5000: 7\nвыше: 5")
+        rules_text.grid(row=3, column=1, columnspan=2, padx=5, pady=2, sticky="ew")
+        ttk.Label(change_f, text="Округлять до, руб.:").grid(row=4, column=0, padx=5, pady=2, sticky="w")
+        round_cb = ttk.Combobox(change_f, values=["0.01", "1", "10", "100"], state="readonly", width=8)
+        round_cb.set("0.01")
+        round_cb.grid(row=4, column=1, padx=5, pady=2, sticky="w")
+        ttk.Label(change_f, text="Основание:").grid(row=5, column=0, padx=5, pady=2, sticky="w")
+        description_e = ttk.Entry(change_f, width=24)
+        description_e.grid(row=5, column=1, columnspan=2, padx=5, pady=2, sticky="ew")
+        change_f.columnconfigure(2, weight=1)
+
+        preview_f = ttk.LabelFrame(repricing_window, text="Предпросмотр")
+        preview_f.pack(padx=10, pady=5, fill="both", expand=True)
+        summary_label = ttk.Label(preview_f, text="Нажмите 'Предпросмотр', чтобы увидеть изменения.")
+        summary_label.pack(anchor="w", padx=5, pady=(0,5))
+        preview_tree = ttk.Treeview(preview_f, columns=("Article", "Product", "Category", "Old", "New"), show="headings")
+        for c,w,a,title in [("Article",120,"w","Артикул"),("Product",300,"w","Товар"),("Category",150,"w","Категория"),
+                            ("Old",110,"e","Цена сейчас"),("New",110,"e","Новая цена")]:
+            preview_tree.heading(c, text=title)
+            preview_tree.column(c, width=w, anchor=a, minwidth=w, stretch=tk.YES if c=="Product" else tk.NO)
+        preview_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        preview_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+        pr_scr_y = ttk.Scrollbar(preview_f, orient="vertical", command=preview_tree.yview)
+        preview_tree.configure(yscrollcommand=pr_scr_y.set)
+        pr_scr_y.pack(side="right", fill="y")
+        preview_tree.pack(fill="both", expand=True, padx=(0,5), pady=(0,5))
+
+        def collect():
+            """Фильтры и описание изменения из полей диалога; None, если что-то заполнено неверно."""
+            articles = articles_text.get("1.0", tk.END).replace(",", "\n").split()
+            filters = {"category": category_cb.get() or None, "article_prefix": prefix_e.get().strip() or None,
+                       "price_min": price_min_e.get().strip() or None, "price_max": price_max_e.get().strip() or None}
+            if articles: filters["article_numbers"] = articles
+            change = {"mode": mode_var.get(), "value": value_e.get().strip(), "round_to": round_cb.get()}
+            if change["mode"] == "rules":
+                try: change["rules"] = self._parse_repricing_rules(rules_text.get("1.0", tk.END))
+                except ValueError as e:
+                    messagebox.showerror("Ошибка валидации (Товар)", str(e), parent=repricing_window); return None
+            elif not change["value"]:
+                messagebox.showwarning("Внимание (Товар)", "Укажите значение изменения цены.", parent=repricing_window); return None
+            return filters, change
+
+        def preview():
+            params = collect()
+            if params is None: return None
+            result = rp.preview_repricing(*params)
+            if not isinstance(result, dict):
+                self._handle_crud_result(result, "переоценки товаров", "товары"); return None
+            for i in preview_tree.get_children(): preview_tree.delete(i)
+            for idx, r in enumerate(result["rows"]):
+                tag = "evenrow" if idx % 2 == 0 else "oddrow"
+                preview_tree.insert("", "end", values=(r["article_number"], r["name"], r["category"] or "",
+                                                       f"{r['old_price']:.2f}", f"{r['new_price']:.2f}"), tags=(tag,))
+            shown = f" (показаны первые {len(result['rows'])})" if len(result["rows"]) < result["count"] else ""
+            summary_label.config(text=f"Изменится цен: {result['count']}{shown}. Сумма цен: {result['old_total']:.2f} -> {result['new_total']:.2f} руб.")
+            return result
+
+        def apply():
+            preview_result = preview()
+            if preview_result is None: return
+            if preview_result["count"] == 0:
+                messagebox.showinfo("Информация", "Нет товаров, цена которых изменится.", parent=repricing_window); return
+            if not messagebox.askyesno("Подтверждение", f"Изменить цены у {preview_result['count']} товаров?", parent=repricing_window): return
+            result = rp.apply_repricing(*collect(), description=description_e.get().strip() or None)
+            if isinstance(result, int):
+                messagebox.showinfo("Успех (Товар)", f"Цены изменены у товаров: {result}.", parent=repricing_window)
+                self.refresh_changes_gui()
+                preview()
+            else: self._handle_crud_result(result, "переоценки товаров", "товары")
+
+        btns = ttk.Frame(repricing_window)
+        btns.pack(pady=10)
+        ttk.Button(btns, text="Предпросмотр", command=preview, style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Применить", command=apply, style="Accent.TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Закрыть", command=repricing_window.destroy, style="TButton").pack(side="left")
+
     def clr_p_flds_gui(self):
         for k_entry, widget in self.p_entries.items():
             if isinstance(widget, tk.Text): widget.delete("1.0", tk.END)
             elif isinstance(widget, ttk.Entry): widget.delete(0, tk.END)
         self.sel_p_id = None
+        self.clear_attachments_gui()
         if self.p_tree.selection(): self.p_tree.selection_remove(self.p_tree.selection()[0])
 
     def create_clients_ui(self, parent_tab):
@@ -278,12 +815,16 @@ class MainApp:
                 self.cl_entries[lt.replace(":", "")] = ttk.Entry(form_f, width=50)
                 self.cl_entries[lt.replace(":", "")].grid(row=i, column=1, padx=5, pady=8, sticky="ew")
         form_f.columnconfigure(1, weight=1)
+        self.create_client_summary_ui(form_f)
         cl_btn_configs = [
             ("Добавить клиента", self.add_cl_gui, "Accent.TButton"),
             ("Обновить клиента", self.upd_cl_gui, "TButton"),
             ("Удалить клиента", self.del_cl_gui, "Warning.TButton"),
             ("Очистить поля", self.clr_cl_flds_gui, "TButton"),
-            ("Обновить список", self.load_cl_gui, "TButton")
+            ("Обновить список", self.load_cl_gui, "TButton"),
+            ("История", lambda: self.entity_history_gui("clients", self.sel_cl_id, "клиента"), "TButton"),
+            ("Импорт...", self.import_clients_gui, "TButton"),
+            ("Дубли...", self.client_duplicates_gui, "TButton")
         ]
         for text, cmd, style_name in cl_btn_configs:
             ttk.Button(btn_f, text=text, command=cmd, style=style_name).pack(side="left", padx=(0,10))
@@ -303,14 +844,50 @@ class MainApp:
         self.cl_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
         self.load_cl_gui()
 
-    def load_cl_gui(self):
+    def create_client_summary_ui(self, form_f):
+        """Сводка по выбранному клиенту справа от полей: итоги за все время из client_stats (без чтения его заказов)."""
+        summary_f = ttk.LabelFrame(form_f, text="Сводка по клиенту")
+        summary_f.grid(row=0, column=2, rowspan=4, padx=(15,5), pady=5, sticky="nsew")
+        self.cl_summary_labels = {}
+        for i, (key, title) in enumerate([("revenue", "Выручка:"), ("orders", "Заказов:"), ("open", "Открытых:"), ("last", "Последний заказ:")]):
+            ttk.Label(summary_f, text=title, font=self.LABEL_FONT + ("bold",)).grid(row=i, column=0, sticky="w", padx=5, pady=2)
+            self.cl_summary_labels[key] = ttk.Label(summary_f, text="-")
+            self.cl_summary_labels[key].grid(row=i, column=1, sticky="w", padx=5, pady=2)
+        self.cl_top_tree = ttk.Treeview(summary_f, columns=("Product", "Qty", "Amount"), show="headings", height=cs.TOP_PRODUCTS_LIMIT)
+        for c,w,a,title in [("Product",200,"w","Основные товары"),("Qty",60,"center","Кол-во"),("Amount",100,"e","Сумма")]:
+            self.cl_top_tree.heading(c, text=title); self.cl_top_tree.column(c, width=w, anchor=a, minwidth=w, stretch=tk.YES if c=="Product" else tk.NO)
+        self.cl_top_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        self.cl_top_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+        self.cl_top_tree.grid(row=4, column=0, columnspan=2, sticky="nsew", padx=5, pady=(5,5))
+        summary_f.columnconfigure(1, weight=1)
+
+    def show_client_summary_gui(self):
+        self.cl_top_tree.delete(*self.cl_top_tree.get_children())
+        summary = cs.get_client_summary(self.sel_cl_id) if self.sel_cl_id else None
+        if summary is None or isinstance(summary, str):
+            if isinstance(summary, str): self.logger.error(f"Client summary failed: {summary}", extra={"operation": "get_client_summary", "entity_id": self.sel_cl_id, "result": summary})
+            for label in self.cl_summary_labels.values(): label.config(text="-")
+            return
+        last_order = datetime.strptime(summary["last_order_date"], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M') if summary["last_order_date"] else "нет заказов"
+        self.cl_summary_labels["revenue"].config(text=f"{summary['revenue']:.2f} руб.")
+        self.cl_summary_labels["orders"].config(text=f"{summary['order_count']} (отменено: {summary['cancelled_count']})")
+        self.cl_summary_labels["open"].config(text=str(summary["open_count"]))
+        self.cl_summary_labels["last"].config(text=last_order)
+        for idx, product in enumerate(summary["top_products"]):
+            self.cl_top_tree.insert("", "end", values=(f"{product['name']} ({product['article']})", product["quantity"], f"{product['amount']:.2f}"),
+                                    tags=("evenrow" if idx % 2 == 0 else "oddrow",))
+
+    def _cl_row_values(self, c):
+        return (c["id"], c["full_name"], c.get("phone_number") or "", c["email"] or "", c.get("address") or "")
+
+    def load_cl_gui(self, clear_form=True):
         for i in self.cl_tree.get_children(): self.cl_tree.delete(i)
         clients = cc.get_all_clients()
         if isinstance(clients, list):
             for idx, c in enumerate(clients): 
                 tag = "evenrow" if idx % 2 == 0 else "oddrow"
-                self.cl_tree.insert("","end",values=(c["id"],c["full_name"],c.get("phone_number",""),c["email"],c.get("address","")), tags=(tag,))
-        self.clr_cl_flds_gui()
+                self.cl_tree.insert("", "end", iid=str(c["id"]), values=self._cl_row_values(c), tags=(tag,))
+        if clear_form: self.clr_cl_flds_gui()
 
     def get_cl_form_data(self):
         d = {}
@@ -328,7 +905,7 @@ class MainApp:
         if d:
             res = cc.add_client(d["full_name"],d["phone_number"],d["email"],d["address"])
             entity_id_for_error = d["email"] if res == "EmailExistsError" else d["full_name"]
-            if self._handle_crud_result(res, "добавления клиента", entity_id_for_error): self.load_cl_gui()
+            if self._handle_crud_result(res, "добавления клиента", entity_id_for_error): self.clr_cl_flds_gui(); self.refresh_changes_gui()
     
     def on_cl_sel_gui(self, ev):
         sel_i = self.cl_tree.focus()
@@ -340,6 +917,7 @@ class MainApp:
                     entry_widget.delete(0,tk.END)
                     entry_widget.insert(0, c_det.get(v_key,"") or "") 
                 self.cl_entries["Адрес"].delete("1.0",tk.END); self.cl_entries["Адрес"].insert("1.0", c_det.get("address","") or "")
+            self.show_client_summary_gui()
         else: self.clr_cl_flds_gui()
 
     def upd_cl_gui(self):
@@ -348,20 +926,119 @@ class MainApp:
         if d:
             res = cc.update_client(self.sel_cl_id,d["full_name"],d["phone_number"],d["email"],d["address"])
             entity_id_for_error = d["email"] if res == "EmailExistsError" else d["full_name"]
-            if self._handle_crud_result(res, f"обновления клиента '{d['full_name']}'", entity_id_for_error): self.load_cl_gui()
+            if self._handle_crud_result(res, f"обновления клиента '{d['full_name']}'", entity_id_for_error): self.clr_cl_flds_gui(); self.refresh_changes_gui()
 
     def del_cl_gui(self):
         if not self.sel_cl_id: messagebox.showwarning("Внимание (Клиент)", "Выберите клиента для удаления."); return
         cl_info = cc.get_client_by_id(self.sel_cl_id); cl_name = cl_info['full_name'] if cl_info else f"ID {self.sel_cl_id}"
         if messagebox.askyesno("Подтверждение (Клиент)", f"Удалить клиента '{cl_name}'?"):
             res = cc.delete_client(self.sel_cl_id)
-            if self._handle_crud_result(res, f"удаления клиента", cl_name): self.load_cl_gui()
+            if self._handle_crud_result(res, f"удаления клиента", cl_name): self.clr_cl_flds_gui(); self.refresh_changes_gui()
+
+    def import_clients_gui(self):
+        path = filedialog.askopenfilename(parent=self.root, title="Импорт клиентов из CSV",
+                                          filetypes=[("CSV", "*.csv"), ("Все файлы", "*.*")])
+        if not path: return
+        self.run_cancellable_gui("Импорт клиентов", lambda token: ci.import_clients_csv(path, cancel_token=token),
+                                 lambda result: self.show_client_import_result_gui(result, path))
+
+    def show_client_import_result_gui(self, result, path):
+        if not isinstance(result, dict):
+            if result.startswith("ImportFileError"):
+                messagebox.showerror("Ошибка импорта клиентов", f"Не удалось прочитать файл: {result.split(':',1)[1]}"); return
+            self._handle_crud_result(result, "импорта клиентов", path); return
+        # При отмене сохраняются только пачки, записанные до нее: сводка показывает, сколько успели
+        messagebox.showinfo("Импорт отменен (Клиент)" if result["cancelled"] else "Успех (Клиент)",
+                            ("Импорт отменен, остаток файла не обработан.\n" if result["cancelled"] else "") +
+                            f"Обработано строк: {result['rows']} ({result['rows_per_second']} строк/с).\n"
+                            f"Добавлено: {result['inserted']}, дополнено: {result['merged']}, без изменений: {result['unchanged']}.\n"
+                            f"Повторы в файле: {result['duplicate_in_file']}, конфликты: {result['conflict']}, ошибки: {result['invalid']}.\n\n"
+                            f"Отчет: {result['report_path']}")
+        self.refresh_changes_gui()
+
+    def client_duplicates_gui(self):
+        dup_window = tk.Toplevel(self.root)
+        dup_window.title("Возможные дубли клиентов")
+        dup_window.geometry("1100x550")
+        dup_window.configure(bg=self.BG_COLOR)
+        dup_window.transient(self.root)
+
+        ttk.Label(dup_window, text="Возможные дубли клиентов", style="Header.TLabel").pack(pady=(10,5))
+        summary_label = ttk.Label(dup_window, text="")
+        summary_label.pack(anchor="w", padx=10)
+        list_frame = ttk.LabelFrame(dup_window, text="Пары на проверку (слева - кого оставить)")
+        list_frame.pack(padx=10, pady=5, fill="both", expand=True)
+        dup_tree = ttk.Treeview(list_frame, columns=("Score", "Name", "Phone", "Email", "DupName", "DupPhone", "DupEmail", "Reasons"), show="headings")
+        for c,w,a,title in [("Score",70,"center","Оценка"),("Name",180,"w","Клиент"),("Phone",120,"w","Телефон"),("Email",150,"w","Email"),
+                            ("DupName",180,"w","Дубль"),("DupPhone",120,"w","Телефон"),("DupEmail",150,"w","Email"),("Reasons",200,"w","Совпадения")]:
+            dup_tree.heading(c, text=title)
+            dup_tree.column(c, width=w, anchor=a, minwidth=50, stretch=tk.YES if c=="Reasons" else tk.NO)
+        dup_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        dup_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+        d_scr_y = ttk.Scrollbar(list_frame, orient="vertical", command=dup_tree.yview)
+        dup_tree.configure(yscrollcommand=d_scr_y.set)
+        d_scr_y.pack(side="right", fill="y")
+        dup_tree.pack(fill="both", expand=True, padx=(0,5), pady=(0,5))
+        pairs = {}
+
+        def load_candidates():
+            for i in dup_tree.get_children(): dup_tree.delete(i)
+            pairs.clear()
+            for idx, d in enumerate(cd.get_duplicate_candidates()):
+                pairs[str(d["id"])] = d
+                a, b = d["client"], d["duplicate"]
+                tag = "evenrow" if idx % 2 == 0 else "oddrow"
+                dup_tree.insert("", "end", iid=str(d["id"]), values=(f"{d['score']:.2f}", a["full_name"], a["phone_number"] or "", a["email"] or "",
+                                                                      b["full_name"], b["phone_number"] or "", b["email"] or "", d["reasons"]), tags=(tag,))
+
+        def search():
+            dup_window.config(cursor="watch"); dup_window.update_idletasks()
+            try: result = cd.find_duplicate_clients()
+            finally: dup_window.config(cursor="")
+            if not isinstance(result, dict): self._handle_crud_result(result, "поиска дублей клиентов", "клиенты"); return
+            summary_label.config(text=f"Клиентов: {result['clients']}, сравнено пар: {result['pairs_compared']}, "
+                                      f"найдено: {result['candidates']} за {result['elapsed_s']} с.")
+            load_candidates()
+
+        def selected_pair():
+            selected = dup_tree.focus()
+            if not selected: messagebox.showwarning("Внимание (Клиент)", "Выберите пару клиентов.", parent=dup_window); return None
+            return pairs[selected]
+
+        def merge(keep_left):
+            pair = selected_pair()
+            if pair is None: return
+            keep, duplicate = (pair["client"], pair["duplicate"]) if keep_left else (pair["duplicate"], pair["client"])
+            if not messagebox.askyesno("Подтверждение", f"Оставить клиента '{keep['full_name']}' (ID {keep['id']}) и перенести в него заказы "
+                                                        f"клиента '{duplicate['full_name']}' (ID {duplicate['id']})?\nДубль будет удален.", parent=dup_window): return
+            result = cd.merge_clients(keep["id"], duplicate["id"])
+            if result is True:
+                load_candidates()
+                self.refresh_changes_gui()
+            else: self._handle_crud_result(result, "объединения клиентов", duplicate["full_name"])
+
+        def dismiss():
+            pair = selected_pair()
+            if pair is None: return
+            result = cd.dismiss_duplicate_candidate(pair["id"])
+            if result is True: load_candidates()
+            else: self._handle_crud_result(result, "отметки пары клиентов", pair["duplicate"]["full_name"])
+
+        btns = ttk.Frame(dup_window)
+        btns.pack(pady=10)
+        ttk.Button(btns, text="Найти дубли", command=search, style="Accent.TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Объединить (оставить левого)", command=lambda: merge(True), style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Объединить (оставить правого)", command=lambda: merge(False), style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Не дубль", command=dismiss, style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Закрыть", command=dup_window.destroy, style="TButton").pack(side="left")
+        load_candidates()
 
     def clr_cl_flds_gui(self):
         for k_entry, widget in self.cl_entries.items():
             if isinstance(widget, tk.Text): widget.delete("1.0", tk.END)
             elif isinstance(widget, ttk.Entry): widget.delete(0, tk.END)
         self.sel_cl_id = None
+        self.show_client_summary_gui()
         if self.cl_tree.selection(): self.cl_tree.selection_remove(self.cl_tree.selection()[0])
 
     def create_orders_ui(self, parent_tab):
@@ -372,6 +1049,7 @@ class MainApp:
         ttk.Label(new_order_frame, text="Клиент:").grid(row=0, column=0, padx=5, pady=8, sticky="w")
         self.order_client_combobox = ttk.Combobox(new_order_frame, state="readonly", width=45)
         self.order_client_combobox.grid(row=0, column=1, columnspan=3, padx=5, pady=8, sticky="ew")
+        self.order_client_combobox.bind("<<ComboboxSelected>>", self.on_order_client_selected_gui)
         self.populate_client_combobox()
 
         add_item_subframe = ttk.Frame(new_order_frame, style="Content.TFrame") 
@@ -398,6 +1076,19 @@ class MainApp:
         ttk.Button(add_item_subframe, text="Добавить в заказ", command=self.add_item_to_current_order_gui, style="TButton").grid(row=0, column=5, padx=(10,5), pady=5, sticky="e")
         add_item_subframe.columnconfigure(5, weight=0) 
 
+        # Режим сканера: сканер штрихкодов вводит артикул и Enter, товар ищется в индексе в памяти
+        self.article_index = ArticleIndex()
+        self.article_index.load()
+        self.pending_scans = {}
+        self.scan_flush_job = None
+        self.scan_mode_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(add_item_subframe, text="Режим сканера", variable=self.scan_mode_var, command=self.toggle_scan_mode_gui).grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.scan_var = tk.StringVar()
+        self.scan_entry = ttk.Entry(add_item_subframe, textvariable=self.scan_var, width=35)
+        self.scan_entry.bind("<Return>", self.on_scan_gui)
+        self.scan_entry.bind("<KP_Enter>", self.on_scan_gui)
+        self.scan_status_label = ttk.Label(add_item_subframe, text="Отсканируйте товар")
+
         current_items_frame = ttk.LabelFrame(new_order_frame, text="Позиции текущего заказа")
         current_items_frame.grid(row=2, column=0, columnspan=4, padx=5, pady=10, sticky="nsew")
         new_order_frame.grid_rowconfigure(2, weight=1)
@@ -413,8 +1104,10 @@ class MainApp:
         coi_scr_y = ttk.Scrollbar(current_items_frame, orient="vertical", command=self.current_order_items_tree.yview)
         self.current_order_items_tree.configure(yscrollcommand=coi_scr_y.set)
         coi_scr_y.pack(side="right", fill="y"); self.current_order_items_tree.pack(fill="both", expand=True, pady=(0,5))
-        self.current_order_items_tree.bind("<Double-1>", self.remove_item_from_current_order_gui)
-        self.current_order_items_data = []
+        self.current_order_items_tree.bind("<Double-1>", self.on_current_item_double_click_gui)
+        self.current_order_items_tree.bind("<Delete>", self.remove_item_from_current_order_gui)
+        self.order_draft = od.OrderDraft()
+        self.draft_save_job = None
         
         self.current_order_items_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
         self.current_order_items_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
@@ -426,6 +1119,7 @@ class MainApp:
         self.current_order_total_label = ttk.Label(total_and_buttons_frame, text="Итого по заказу: 0.00 руб.", style="Total.TLabel")
         self.current_order_total_label.grid(row=0, column=0, padx=0, pady=5, sticky="w")
         
+        ttk.Button(total_and_buttons_frame, text="Черновики...", command=self.order_drafts_gui, style="TButton").grid(row=0, column=1, padx=(0,10), pady=5, sticky="e")
         ttk.Button(total_and_buttons_frame, text="Очистить", command=self.clear_current_order_gui, style="TButton").grid(row=0, column=2, padx=(0,10), pady=5, sticky="e")
         ttk.Button(total_and_buttons_frame, text="Оформить заказ", command=self.create_order_gui, style="Accent.TButton").grid(row=0, column=3, padx=0, pady=5, sticky="e")
 
@@ -446,8 +1140,13 @@ class MainApp:
         self.delete_order_button.pack(side="left", padx=(0,10))
         self.view_order_details_button = ttk.Button(orders_list_actions_frame, text="Детали заказа", command=self.view_order_details_gui, style="TButton", state="disabled")
         self.view_order_details_button.pack(side="right", padx=0)
+        ttk.Button(orders_list_actions_frame, text="В архив...", command=self.archive_orders_gui, style="TButton").pack(side="right", padx=(0,10))
+        ttk.Button(orders_list_actions_frame, text="Документы...", command=self.generate_documents_gui, style="TButton").pack(side="right", padx=(0,10))
+        self.show_archived_orders_var = tk.BooleanVar(value=False)
+        self.orders_load_token = None
+        ttk.Checkbutton(orders_list_actions_frame, text="Показывать архив", variable=self.show_archived_orders_var, command=self.load_orders_gui).pack(side="right", padx=(0,10))
 
-        self.orders_tree = ttk.Treeview(orders_list_frame, columns=("ID", "Client", "Date", "Status", "Total"), show="headings")
+        self.orders_tree = ttk.Treeview(orders_list_frame, columns=("ID", "Client", "Date", "Status", "Total"), show="headings", selectmode="extended")
         o_hds = [("ID",70,"center"),("Client",280,"w"),("Date",170,"w"),("Status",150,"w"),("Total",120,"e")]
         for c,w,a in o_hds: 
             self.orders_tree.heading(c, text=c.replace("Client","Клиент").replace("Date","Дата").replace("Status","Статус").replace("Total","Сумма"))
@@ -465,6 +1164,7 @@ class MainApp:
         self.orders_tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
         self.orders_tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
         self.load_orders_gui()
+        self.root.after_idle(self.offer_draft_resume_gui)
         
     def populate_client_combobox(self):
         clients = cc.get_all_clients()
@@ -473,20 +1173,104 @@ class MainApp:
         self.clients_data_for_combobox = clients
 
     def populate_product_combobox(self):
+        prev_idx = self.order_product_combobox.current()
+        prev_product_id = self.products_data_for_combobox[prev_idx]['id'] if prev_idx >= 0 and prev_idx < len(getattr(self, "products_data_for_combobox", [])) else None
         products = pc.get_all_products()
-        product_display_list = [f"{p['name']} (Арт: {p['article_number']}, Ост: {p['stock_quantity']})" for p in products if p['stock_quantity'] > 0]
+        # Товары без остатка не скрываем, а помечаем: оператор должен видеть, что позиция закончилась
+        product_display_list = [f"{p['name']} (Арт: {p['article_number']}, " + (f"Ост: {p['stock_quantity']})" if p['stock_quantity'] > 0 else "нет в наличии)")
+                                for p in products]
         self.order_product_combobox['values'] = product_display_list
-        self.products_data_for_combobox = [p for p in products if p['stock_quantity'] > 0]
+        self.products_data_for_combobox = products
+        # Остаток в подписи мог измениться - восстанавливаем выбор по id товара
+        new_idx = next((i for i, p in enumerate(self.products_data_for_combobox) if p['id'] == prev_product_id), -1)
+        if new_idx >= 0: self.order_product_combobox.current(new_idx)
+        elif prev_product_id is not None: self.order_product_combobox.set('')
         self.on_order_product_selected() 
 
     def on_order_product_selected(self, event=None):
         selected_index = self.order_product_combobox.current()
         if selected_index >= 0 and self.products_data_for_combobox and selected_index < len(self.products_data_for_combobox):
             product = self.products_data_for_combobox[selected_index]
-            self.order_product_price_label.config(text=f"Цена: {product['price']:.2f} (Ост: {product['stock_quantity']})")
+            available = res.get_available_quantities([product['id']], self.order_draft.holder)
+            available_text = f", своб.: {available[product['id']]}" if isinstance(available, dict) and product['id'] in available else ""
+            self.order_product_price_label.config(text=f"Цена: {product['price']:.2f} (Ост: {product['stock_quantity']}{available_text})")
         else:
             self.order_product_price_label.config(text="Цена: 0.00 (Ост: 0)")
 
+    def toggle_scan_mode_gui(self):
+        if self.scan_mode_var.get():
+            self.scan_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+            self.scan_status_label.grid(row=1, column=2, columnspan=4, padx=(10,0), pady=5, sticky="w")
+            self.scan_entry.focus_set()
+        else:
+            self.flush_scans_gui()
+            self.scan_entry.grid_remove(); self.scan_status_label.grid_remove()
+
+    def on_scan_gui(self, event=None):
+        # Обработчик только копит коды: при 20+ сканах в секунду дерево и итог пересчитываются
+        # не на каждый скан, а раз в SCAN_FLUSH_DELAY_MS; повторы одного артикула складываются
+        code = normalize_article(self.scan_var.get())
+        self.scan_var.set("")
+        if code:
+            self.pending_scans[code] = self.pending_scans.get(code, 0) + 1
+            if self.scan_flush_job is None: self.scan_flush_job = self.root.after(SCAN_FLUSH_DELAY_MS, self.flush_scans_gui)
+        return "break"
+
+    def flush_scans_gui(self):
+        if self.scan_flush_job is not None: self.root.after_cancel(self.scan_flush_job)
+        self.scan_flush_job = None
+        pending, self.pending_scans = self.pending_scans, {}
+        if not pending: return
+        problems, last_added = [], None
+        for code, count in pending.items():
+            product = self.article_index.lookup(code)
+            if product is None: problems.append(f"Артикул '{code}' не найден."); continue
+            warning = self._add_current_order_line(product, count)
+            if warning: problems.append(warning)
+            else: last_added = (product, count)
+        if last_added:
+            self.update_current_order_total()
+            self.current_order_items_tree.see(str(last_added[0]['id']))
+        if problems:
+            self.root.bell()
+            self.scan_status_label.config(text=problems[-1], foreground=self.WARNING_COLOR)
+        else:
+            self.scan_status_label.config(text=f"{last_added[0]['name']}: +{last_added[1]}", foreground=self.TEXT_COLOR)
+
+    def _reserve_draft_line(self, product_id, product_name, quantity):
+        """Резервирует quantity шт. товара под черновик (0 - снять резерв). Возвращает текст предупреждения или None."""
+        result = res.reserve_stock(self.order_draft.holder, product_id, quantity)
+        if result is True: return None
+        if isinstance(result, str) and result.startswith("StockReservedError"):
+            return f"Свободно только {result.split(':',1)[1]} шт. товара '{product_name}' (остальное на складе или в резерве других заказов)."
+        if result == "NotFound": return f"Товар '{product_name}' не найден."
+        self.logger.error(f"Stock reservation failed: {result}", extra={"operation": "reserve_stock", "entity_id": product_id, "result": result})
+        return f"Не удалось зарезервировать товар '{product_name}'."
+
+    def _add_current_order_line(self, product, quantity):
+        """Добавляет товар в черновик заказа или увеличивает количество в его строке. Возвращает текст предупреждения или None."""
+        line = self.order_draft.get(product['id'])
+        # Резерв, а не сравнение с остатком из списка: другой оператор мог уже занять последние единицы
+        warning = self._reserve_draft_line(product['id'], product['name'], quantity + (line['quantity'] if line else 0))
+        if warning: return warning
+        self.order_draft.add(product, quantity)
+        self._show_draft_line(product['id'])
+        return None
+
+    def _show_draft_line(self, product_id):
+        """Синхронизирует одну строку дерева с черновиком. iid строки = id товара, поэтому перебор дерева не нужен."""
+        row_id, line = str(product_id), self.order_draft.get(product_id)
+        tree = self.current_order_items_tree
+        if line is None:
+            if tree.exists(row_id):
+                tree.delete(row_id); self._apply_treeview_row_tags(tree)
+            return
+        values = (line['product_id'], line['product_name'], line['quantity'], f"{line['price_per_unit']:.2f}", f"{self.order_draft.subtotal(product_id):.2f}")
+        if tree.exists(row_id): tree.item(row_id, values=values)
+        else:
+            tag = "evenrow" if len(tree.get_children()) % 2 == 0 else "oddrow"
+            tree.insert("", "end", iid=row_id, values=values, tags=(tag,))
+
     def add_item_to_current_order_gui(self):
         client_idx = self.order_client_combobox.current()
         product_idx = self.order_product_combobox.current()
@@ -503,46 +1287,8 @@ class MainApp:
              messagebox.showerror("Ошибка", "Выбранный товар не найден в списке доступных.")
              return
         selected_product = self.products_data_for_combobox[product_idx]
-        
-        if quantity > selected_product['stock_quantity']:
-            messagebox.showwarning("Недостаточно товара", f"На складе только {selected_product['stock_quantity']} шт. товара '{selected_product['name']}'.")
-            return
-
-        existing_item_tree_id = None
-        existing_item_data_index = -1
-
-        for i, item_data in enumerate(self.current_order_items_data):
-            if item_data['product_id'] == selected_product['id']:
-                existing_item_data_index = i
-                for child_id in self.current_order_items_tree.get_children():
-                    tree_item_values = self.current_order_items_tree.item(child_id, "values")
-                    if tree_item_values and str(tree_item_values[0]) == str(selected_product['id']):
-                        existing_item_tree_id = child_id
-                        break
-                break
-        
-        if existing_item_data_index != -1: 
-            item_data = self.current_order_items_data[existing_item_data_index]
-            new_quantity = item_data['quantity'] + quantity
-            if new_quantity > selected_product['stock_quantity']:
-                 messagebox.showwarning("Недостаточно товара", f"С учетом уже добавленного, на складе только {selected_product['stock_quantity']} шт. товара '{selected_product['name']}'.")
-                 return
-            item_data['quantity'] = new_quantity
-            if existing_item_tree_id:
-                subtotal = new_quantity * item_data['price_per_unit']
-                self.current_order_items_tree.item(existing_item_tree_id, values=(selected_product['id'], selected_product['name'], new_quantity, f"{item_data['price_per_unit']:.2f}", f"{subtotal:.2f}"))
-        else: 
-            item_data = {
-                'product_id': selected_product['id'],
-                'product_name': selected_product['name'],
-                'quantity': quantity,
-                'price_per_unit': selected_product['price']
-            }
-            self.current_order_items_data.append(item_data)
-            subtotal = quantity * selected_product['price']
-            tag_idx = len(self.current_order_items_tree.get_children())
-            tag = "evenrow" if tag_idx % 2 == 0 else "oddrow"
-            self.current_order_items_tree.insert("", "end", values=(selected_product['id'], selected_product['name'], quantity, f"{selected_product['price']:.2f}", f"{subtotal:.2f}"), tags=(tag,))
+        warning = self._add_current_order_line(selected_product, quantity)
+        if warning: messagebox.showwarning("Недостаточно товара", warning); return
 
         self.update_current_order_total()
         self.order_product_combobox.set('')
@@ -552,45 +1298,171 @@ class MainApp:
     def remove_item_from_current_order_gui(self, event=None):
         selected_tree_item = self.current_order_items_tree.focus()
         if not selected_tree_item: return
-        
-        item_values = self.current_order_items_tree.item(selected_tree_item, "values")
-        if not item_values: 
-            messagebox.showerror("Ошибка", "Не удалось получить данные выбранного товара.")
-            return
-        product_id_to_remove = item_values[0] 
-
-        item_index_to_remove = -1
-        for i, item_data in enumerate(self.current_order_items_data):
-            if str(item_data['product_id']) == str(product_id_to_remove):
-                item_index_to_remove = i
-                break
-        
-        if item_index_to_remove != -1:
-            del self.current_order_items_data[item_index_to_remove]
-            self.current_order_items_tree.delete(selected_tree_item)
+        line = self.order_draft.get(selected_tree_item)
+        if line and self.order_draft.remove(selected_tree_item):
+            self._reserve_draft_line(line['product_id'], line['product_name'], 0)
+            self._show_draft_line(selected_tree_item)
             self.update_current_order_total()
-            self._apply_treeview_row_tags(self.current_order_items_tree)
         else:
             messagebox.showerror("Ошибка", "Не удалось найти товар для удаления.")
 
+    def on_current_item_double_click_gui(self, event):
+        tree = self.current_order_items_tree
+        row_id = tree.identify_row(event.y)
+        if not row_id: return
+        tree.focus(row_id)
+        if tree.identify_column(event.x) == f"#{tree['columns'].index('Qty') + 1}": self.edit_current_item_quantity_gui(row_id)
+        else: self.remove_item_from_current_order_gui()
+
+    def edit_current_item_quantity_gui(self, row_id):
+        """Редактирование количества прямо в ячейке: Enter или уход фокуса - сохранить, Esc - отмена, 0 - удалить строку."""
+        tree, line = self.current_order_items_tree, self.order_draft.get(row_id)
+        bbox = tree.bbox(row_id, "Qty")
+        if line is None or not bbox: return
+        x, y, width, height = bbox
+        quantity_var = tk.StringVar(value=str(line['quantity']))
+        editor = ttk.Entry(tree, textvariable=quantity_var, justify="center", font=self.ENTRY_FONT)
+        editor.place(x=x, y=y, width=width, height=height)
+        editor.focus_set(); editor.select_range(0, tk.END)
+
+        def commit(event=None):
+            if not editor.winfo_exists(): return
+            text = quantity_var.get().strip()
+            editor.destroy()
+            try: quantity = int(text)
+            except ValueError: messagebox.showwarning("Внимание", "Количество должно быть числом."); return
+            warning = self._reserve_draft_line(line['product_id'], line['product_name'], max(quantity, 0))
+            if warning: messagebox.showwarning("Недостаточно товара", warning); return
+            self.order_draft.set_quantity(row_id, quantity)
+            self._show_draft_line(row_id)
+            self.update_current_order_total()
+
+        editor.bind("<Return>", commit)
+        editor.bind("<KP_Enter>", commit)
+        editor.bind("<FocusOut>", commit)
+        editor.bind("<Escape>", lambda ev: editor.destroy())
+
     def update_current_order_total(self):
-        total = sum(item['quantity'] * item['price_per_unit'] for item in self.current_order_items_data)
-        self.current_order_total_label.config(text=f"Итого по заказу: {total:.2f} руб.")
+        # Итог поддерживается черновиком при каждом изменении - здесь только вывод и отложенное автосохранение
+        self.current_order_total_label.config(text=f"Итого по заказу: {self.order_draft.total:.2f} руб.")
+        if self.order_draft.is_dirty and self.draft_save_job is None:
+            self.draft_save_job = self.root.after(DRAFT_AUTOSAVE_DELAY_MS, self.save_order_draft_gui)
+
+    def save_order_draft_gui(self):
+        if self.draft_save_job is not None: self.root.after_cancel(self.draft_save_job)
+        self.draft_save_job = None
+        result = self.order_draft.save()
+        if result is not True: self.logger.error(f"Order draft autosave failed: {result}") # Без окна: автосохранение не должно мешать вводу
+        if len(self.order_draft): res.renew_reservations(self.order_draft.holder) # Черновик редактируют - резервы продлеваются
+
+    def on_order_client_selected_gui(self, event=None):
+        client_idx = self.order_client_combobox.current()
+        if 0 <= client_idx < len(self.clients_data_for_combobox):
+            self.order_draft.set_client(self.clients_data_for_combobox[client_idx]['id'])
+            self.update_current_order_total()
 
     def clear_current_order_gui(self):
+        self.pending_scans = {}
         self.order_client_combobox.set('')
         self.order_product_combobox.set('')
         self.order_product_price_label.config(text="Цена: 0.00 (Ост: 0)")
         self.order_quantity_var.set("1")
         for i in self.current_order_items_tree.get_children():
             self.current_order_items_tree.delete(i)
-        self.current_order_items_data = []
+        if self.draft_save_job is not None: self.root.after_cancel(self.draft_save_job)
+        self.draft_save_job = None
+        discard_result = self.order_draft.discard()
+        if discard_result is not True: self.logger.error(f"Order draft discard failed: {discard_result}")
+        res.release_reservations(self.order_draft.holder)
+        self.order_draft = od.OrderDraft()
+        self.update_current_order_total()
+
+    def show_order_draft_gui(self, draft):
+        """Показывает загруженный черновик в форме нового заказа."""
+        self.order_draft = draft
+        tree = self.current_order_items_tree
+        for i in tree.get_children(): tree.delete(i)
+        for line in draft.items(): self._show_draft_line(line['product_id'])
+        client_idx = next((i for i, c in enumerate(self.clients_data_for_combobox) if c['id'] == draft.client_id), -1)
+        if client_idx >= 0: self.order_client_combobox.current(client_idx)
+        else: self.order_client_combobox.set('')
         self.update_current_order_total()
 
+    def resume_order_draft_gui(self, draft_id):
+        if self.order_draft.draft_id == draft_id: return
+        draft = od.load_order_draft(draft_id)
+        if not isinstance(draft, od.OrderDraft):
+            self._handle_crud_result(draft, "загрузки черновика заказа", f"черновик {draft_id}"); return
+        self.save_order_draft_gui() # Текущий черновик не теряется, а остается в списке
+        res.release_reservations(self.order_draft.holder) # Резерв держит только черновик, открытый в форме
+        self.show_order_draft_gui(draft)
+        warnings = [warning for line in draft.items() if (warning := self._reserve_draft_line(line['product_id'], line['product_name'], line['quantity']))]
+        if warnings: messagebox.showwarning("Недостаточно товара", "Черновик открыт, но часть товара уже занята:\n" + "\n".join(warnings))
+
+    def offer_draft_resume_gui(self):
+        drafts = od.get_order_drafts()
+        if not drafts or len(self.order_draft): return
+        d = drafts[0]
+        client_text = f" для клиента {d['client_name']}" if d['client_name'] else ""
+        if messagebox.askyesno("Черновик заказа", f"Найден незавершенный заказ{client_text} от {d['updated_at']}: "
+                                                f"{d['lines_count']} поз. на {d['total']:.2f} руб.\nПродолжить его оформление?"):
+            self.resume_order_draft_gui(d['id'])
+
+    def order_drafts_gui(self):
+        self.save_order_draft_gui()
+        drafts_window = tk.Toplevel(self.root)
+        drafts_window.title("Черновики заказов")
+        drafts_window.geometry("750x400")
+        drafts_window.configure(bg=self.BG_COLOR)
+        drafts_window.transient(self.root)
+        tree_frame = ttk.Frame(drafts_window, padding=10)
+        tree_frame.pack(fill="both", expand=True)
+        cols = ("ID", "Client", "Lines", "Total", "Updated")
+        tree = ttk.Treeview(tree_frame, columns=cols, show="headings")
+        for c, title, w, a in [("ID", "ID", 60, "center"), ("Client", "Клиент", 260, "w"), ("Lines", "Позиций", 80, "center"),
+                               ("Total", "Сумма", 120, "e"), ("Updated", "Изменен", 160, "w")]:
+            tree.heading(c, text=title)
+            tree.column(c, width=w, anchor=a, stretch=tk.YES if c == "Client" else tk.NO)
+        scr_y = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scr_y.set)
+        scr_y.pack(side="right", fill="y"); tree.pack(fill="both", expand=True)
+        tree.tag_configure("oddrow", background=self.FRAME_BG_COLOR)
+        tree.tag_configure("evenrow", background=self.ROW_ALT_COLOR)
+
+        def load():
+            for i in tree.get_children(): tree.delete(i)
+            for idx, d in enumerate(od.get_order_drafts()):
+                tree.insert("", "end", iid=str(d['id']), values=(d['id'], d['client_name'] or "", d['lines_count'], f"{d['total']:.2f}", d['updated_at']),
+                            tags=("evenrow" if idx % 2 == 0 else "oddrow",))
+
+        def resume():
+            selected = tree.focus()
+            if not selected: messagebox.showwarning("Внимание", "Выберите черновик.", parent=drafts_window); return
+            self.resume_order_draft_gui(int(selected))
+            drafts_window.destroy()
+
+        def delete():
+            selected = tree.focus()
+            if not selected: messagebox.showwarning("Внимание", "Выберите черновик.", parent=drafts_window); return
+            if not messagebox.askyesno("Подтверждение", f"Удалить черновик {selected}?", parent=drafts_window): return
+            if int(selected) == self.order_draft.draft_id: self.clear_current_order_gui()
+            else:
+                result = od.delete_order_draft(int(selected))
+                if result is not True: self._handle_crud_result(result, "удаления черновика заказа", f"черновик {selected}")
+            load()
+
+        load()
+        tree.bind("<Double-1>", lambda ev: resume())
+        btns = ttk.Frame(drafts_window)
+        btns.pack(pady=10)
+        ttk.Button(btns, text="Продолжить", command=resume, style="Accent.TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Удалить", command=delete, style="Warning.TButton").pack(side="left", padx=(0,10))
+        ttk.Button(btns, text="Закрыть", command=drafts_window.destroy, style="TButton").pack(side="left")
+
     def create_order_gui(self):
         client_idx = self.order_client_combobox.current()
         if client_idx < 0: messagebox.showwarning("Внимание", "Пожалуйста, выберите клиента."); return
-        if not self.current_order_items_data: messagebox.showwarning("Внимание", "Добавьте хотя бы один товар в заказ."); return
+        if not len(self.order_draft): messagebox.showwarning("Внимание", "Добавьте хотя бы один товар в заказ."); return
 
         if not self.clients_data_for_combobox or client_idx >= len(self.clients_data_for_combobox):
             messagebox.showerror("Ошибка", "Выбранный клиент не найден.")
@@ -598,22 +1470,38 @@ class MainApp:
         selected_client_data = self.clients_data_for_combobox[client_idx]
         client_id = selected_client_data['id']
         
-        result = oc.add_order(client_id, self.current_order_items_data)
+        result = oc.add_order(client_id, self.order_draft.items(), reservation_holder=self.order_draft.holder)
         
         if self._handle_crud_result(result, "создания заказа", f"для клиента {selected_client_data['full_name']}"):
-            self.load_orders_gui()
             self.clear_current_order_gui()
-            self.populate_product_combobox() 
-            self.load_p_gui()
+            self.refresh_changes_gui()
+
+    def _order_row_values(self, o):
+        order_date_formatted = datetime.strptime(o["order_date"], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')
+        return (o["id"], o["client_name"], order_date_formatted, o["status"], f"{o['total_amount']:.2f}")
 
     def load_orders_gui(self):
+        if self.orders_load_token is not None: self.orders_load_token.cancel() # Новая загрузка заменяет незавершенную
+        self.orders_load_token = None
+        if not self.show_archived_orders_var.get():
+            self.show_orders_gui(oc.get_all_orders_with_details()); return
+        # С архивом список может грузиться долго: в фоне, с возможностью отмены
+        def on_done(orders):
+            if token is not self.orders_load_token: return # Загрузку уже заменила более новая
+            self.orders_load_token = None
+            if orders == CANCELLED:
+                self.show_archived_orders_var.set(False); self.load_orders_gui(); return
+            self.show_orders_gui(orders)
+        token = self.run_cancellable_gui("Загрузка заказов с архивом", lambda token: oc.get_all_orders_with_details(include_archived=True, cancel_token=token),
+                                         on_done, show_delay_ms=ORDERS_LOAD_DIALOG_DELAY_MS)
+        self.orders_load_token = token
+
+    def show_orders_gui(self, orders):
         for i in self.orders_tree.get_children(): self.orders_tree.delete(i)
-        orders = oc.get_all_orders_with_details()
         if isinstance(orders, list):
             for idx, o in enumerate(orders):
-                order_date_formatted = datetime.strptime(o["order_date"], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')
                 tag = "evenrow" if idx % 2 == 0 else "oddrow"
-                self.orders_tree.insert("", "end", values=(o["id"], o["client_name"], order_date_formatted, o["status"], f"{o['total_amount']:.2f}"), tags=(tag,))
+                self.orders_tree.insert("", "end", iid=str(o["id"]), values=self._order_row_values(o), tags=(tag,))
         self.sel_order_id = None
         self.update_order_action_buttons_state()
 
@@ -639,11 +1527,31 @@ class MainApp:
         if not self.sel_order_id:
              self.order_status_combobox.set('')
 
+    def _selected_order_ids(self):
+        """id всех выделенных заказов (выделение нескольких - Ctrl/Shift+щелчок)."""
+        return [int(iid) for iid in self.orders_tree.selection()]
+
+    def _show_bulk_order_result(self, result, action, action_error):
+        """Итог пакетной операции: сколько заказов обработано и какие пропущены."""
+        if isinstance(result, str): self._handle_crud_result(result, action_error, "выбранные заказы"); return
+        failed = [order_id for order_id, outcome in result.items() if outcome is not True]
+        message = f"{action}: {len(result) - len(failed)}."
+        if failed: message += f"\nНе найдены (возможно, в архиве): {', '.join(map(str, failed[:20]))}{' ...' if len(failed) > 20 else ''}"
+        messagebox.showinfo("Успех (Заказ)", message)
+        self.refresh_changes_gui()
+
     def update_order_status_gui(self):
         if not self.sel_order_id: messagebox.showwarning("Внимание", "Выберите заказ для изменения статуса."); return
         new_status = self.order_status_combobox.get()
         if not new_status: messagebox.showwarning("Внимание", "Выберите новый статус заказа."); return
 
+        selected_ids = self._selected_order_ids()
+        if len(selected_ids) > 1:
+            if not messagebox.askyesno("Подтверждение", f"Установить статус '{new_status}' для выбранных заказов ({len(selected_ids)})?"): return
+            self._show_bulk_order_result(oc.bulk_update_order_status(selected_ids, new_status),
+                                         "Статус изменен у заказов", "изменения статуса заказов")
+            return
+
         selected_item_focus = self.orders_tree.focus()
         if not selected_item_focus: return 
         selected_item_values = self.orders_tree.item(selected_item_focus, "values")
@@ -655,12 +1563,15 @@ class MainApp:
 
         result = oc.update_order_status(self.sel_order_id, new_status)
         if self._handle_crud_result(result, f"изменения статуса заказа ID {self.sel_order_id}", f"заказ ID {self.sel_order_id}"):
-            self.load_orders_gui()
-            self.populate_product_combobox()
-            self.load_p_gui()
+            self.refresh_changes_gui()
 
     def delete_order_gui(self):
         if not self.sel_order_id: messagebox.showwarning("Внимание", "Выберите заказ для удаления."); return
+        selected_ids = self._selected_order_ids()
+        if len(selected_ids) > 1:
+            if messagebox.askyesno("Подтверждение", f"Удалить выбранные заказы ({len(selected_ids)})? \nТовары будут возвращены на склад для заказов, которые не были 'Выполнен' или 'Отменен'."):
+                self._show_bulk_order_result(oc.bulk_delete_orders(selected_ids), "Удалено заказов", "удаления заказов")
+            return
         order_details_for_name = oc.get_order_details_by_id(self.sel_order_id)
         order_name_for_msg = f"ID {self.sel_order_id}"
         if order_details_for_name:
@@ -669,22 +1580,33 @@ class MainApp:
         if messagebox.askyesno("Подтверждение", f"Удалить заказ {order_name_for_msg}? \nТовары будут возвращены на склад, если заказ не был 'Выполнен'."):
             result = oc.delete_order(self.sel_order_id)
             if self._handle_crud_result(result, "удаления заказа", order_name_for_msg):
-                self.load_orders_gui()
-                self.populate_product_combobox()
-                self.load_p_gui()
+                self.refresh_changes_gui()
+
+    def archive_orders_gui(self):
+        days = simpledialog.askinteger("Архивация заказов", "Перенести в архив выполненные и отмененные заказы старше (дней):",
+                                       parent=self.root, initialvalue=ar.DEFAULT_ARCHIVE_AGE_DAYS, minvalue=0)
+        if days is None: return
+        result = ar.archive_closed_orders(older_than_days=days)
+        if isinstance(result, int):
+            messagebox.showinfo("Успех (Заказ)", f"Перенесено в архив заказов: {result}.")
+            self.refresh_changes_gui()
+        else:
+            self._handle_crud_result(result, "архивации заказов", f"старше {days} дн.")
 
     def view_order_details_gui(self):
         if not self.sel_order_id: messagebox.showwarning("Внимание", "Выберите заказ для просмотра деталей."); return
-        details = oc.get_order_details_by_id(self.sel_order_id)
+        details = oc.get_order_header(self.sel_order_id) # Без позиций: они читаются страницами по мере прокрутки
         if not details: self._handle_crud_result("NotFound", "просмотра деталей заказа", f"ID {self.sel_order_id}"); return
+        order_id, archived = details['id'], details['is_archived']
 
         details_window = tk.Toplevel(self.root)
         details_window.title(f"Детали заказа ID {self.sel_order_id}")
-        details_window.geometry("750x550")
+        details_window.geometry("750x600")
         details_window.configure(bg=self.BG_COLOR) 
         details_window.transient(self.root); details_window.grab_set()
 
-        ttk.Label(details_window, text=f"Детали заказа ID {self.sel_order_id}", style="Header.TLabel").pack(pady=(10,5))
+        header_text = f"Детали заказа ID {self.sel_order_id}" + (" (архив)" if archived else "")
+        ttk.Label(details_window, text=header_text, style="Header.TLabel").pack(pady=(10,5))
 
         info_frame = ttk.LabelFrame(details_window, text="Общая информация")
         info_frame.pack(padx=10, pady=5, fill="x")
@@ -696,6 +1618,7 @@ class MainApp:
             ("Телефон клиента:", details.get('client_phone_number', '-')),
             ("Дата заказа:", datetime.strptime(details["order_date"], '%Y-%m-%d %H:%M:%S').strftime('%d.%m.%Y %H:%M')),
             ("Статус:", details['status']),
+            ("Позиций / единиц:", f"{details['lines']} / {details['quantity']}"),
             ("Общая сумма:", f"{details['total_amount']:.2f} руб.")
         ]
         for i, (label_text, value_text) in enumerate(info_labels_data):
@@ -706,23 +1629,163 @@ class MainApp:
         items_frame = ttk.LabelFrame(details_window, text="Позиции заказа")
         items_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
+        search_frame = ttk.Frame(items_frame, style="Content.TFrame")
+        search_frame.pack(fill="x", pady=(0,5))
+        search_var = tk.StringVar()
+        ttk.Label(search_frame, text="Поиск (товар или артикул):").pack(side="left", padx=(0,5))
+        search_entry = ttk.Entry(search_frame, textvariable=search_var, width=30, font=self.ENTRY_FONT)
+        search_entry.pack(side="left", padx=(0,5))
+        found_label = ttk.Label(search_frame, text="")
+        found_label.pack(side="left", padx=(10,0))
+
+        # Виртуальный список: в дереве только видимые строки, полоса прокрутки отражает все позиции.
+        # Позиции читаются блоками по ORDER_LINES_PAGE и кешируются, пока не изменились сортировка или поиск.
         items_tree = ttk.Treeview(items_frame, columns=("Article", "Product", "Qty", "Price", "Subtotal"), show="headings")
-        it_hds = [("Article",120,"w"),("Product",280,"w"),("Qty",80,"center"),("Price",100,"e"),("Subtotal",100,"e")]
-        for c,w,a in it_hds: 
-            items_tree.heading(c, text=c.replace("Article","Артикул").replace("Product","Товар").replace("Qty","Кол-во").replace("Price","Цена").replace("Subtotal","Сумма"))
+        it_hds = [("Article",120,"w","article","Артикул"),("Product",280,"w","product","Товар"),("Qty",80,"center","quantity","Кол-во"),
+                  ("Price",100,"e","price","Цена"),("Subtotal",100,"e","subtotal","Сумма")]
+        for c,w,a,_,title in it_hds: 
             items_tree.column(c,width=w,anchor=a,minwidth=w, stretch=tk.YES if c=="Product" else tk.NO)
         
         items_tree.tag_configure("oddrow_detail", background=self.FRAME_BG_COLOR) 
         items_tree.tag_configure("evenrow_detail", background=self.ROW_ALT_COLOR)
+        view = {"offset": 0, "visible": 1, "total": details['lines'], "sort_by": "position", "descending": False, "search": "", "blocks": {}}
+
+        def line_at(index):
+            block_no = index // oc.ORDER_LINES_PAGE
+            if block_no not in view["blocks"]:
+                block = oc.get_order_lines(order_id, block_no * oc.ORDER_LINES_PAGE, oc.ORDER_LINES_PAGE, view["sort_by"],
+                                           view["descending"], view["search"], archived)
+                if isinstance(block, str): self.logger.error(f"Order lines page failed: {block}"); block = []
+                view["blocks"][block_no] = block
+            block = view["blocks"][block_no]
+            offset_in_block = index % oc.ORDER_LINES_PAGE
+            return block[offset_in_block] if offset_in_block < len(block) else None
+
+        def render():
+            view["offset"] = max(0, min(view["offset"], view["total"] - view["visible"]))
+            items_tree.delete(*items_tree.get_children())
+            for index in range(view["offset"], min(view["offset"] + view["visible"], view["total"])):
+                item = line_at(index)
+                if item is None: break
+                tag = "evenrow_detail" if index % 2 == 0 else "oddrow_detail"
+                items_tree.insert("", "end", values=(item['product_article'], item['product_name'], item['quantity'], f"{item['price_per_unit']:.2f}",
+                                                     f"{(item['quantity'] * item['price_per_unit']):.2f}"), tags=(tag,))
+            if view["total"]: it_scr_y.set(view["offset"] / view["total"], min(1.0, (view["offset"] + view["visible"]) / view["total"]))
+            else: it_scr_y.set(0.0, 1.0)
+
+        def scroll_to(offset):
+            offset = max(0, min(int(offset), view["total"] - view["visible"]))
+            if offset != view["offset"] or not items_tree.get_children(): view["offset"] = offset; render()
+
+        def on_scrollbar(command, value, unit=None):
+            if command == "moveto": scroll_to(float(value) * view["total"])
+            elif unit == "pages": scroll_to(view["offset"] + int(value) * view["visible"])
+            else: scroll_to(view["offset"] + int(value))
+
+        def on_wheel(event):
+            step = -3 if (getattr(event, "num", None) == 4 or event.delta > 0) else 3
+            scroll_to(view["offset"] + step)
+            return "break"
+
+        def on_resize(event=None):
+            row_height = ttk.Style().lookup("Treeview", "rowheight") or 28
+            visible = max(1, (items_tree.winfo_height() - 30) // int(row_height)) # За вычетом строки заголовков
+            if visible != view["visible"]: view["visible"] = visible; render()
+
+        def reload(reset_offset=True):
+            view["blocks"] = {}
+            if reset_offset: view["offset"] = 0
+            render()
+
+        def sort_by(key):
+            view["descending"] = not view["descending"] if view["sort_by"] == key else False
+            view["sort_by"] = key
+            show_headings(); reload()
+
+        def show_headings():
+            for c,_,_,key,title in it_hds:
+                arrow = (" ▼" if view["descending"] else " ▲") if view["sort_by"] == key else ""
+                items_tree.heading(c, text=title + arrow, command=lambda key=key: sort_by(key))
+
+        def search(event=None):
+            view["search"] = search_var.get().strip()
+            if view["search"]:
+                summary = oc.get_order_lines_summary(order_id, view["search"], archived)
+                if isinstance(summary, str): self._handle_crud_result(summary, "поиска позиций заказа", f"ID {order_id}"); return
+                view["total"] = summary["lines"]
+                found_label.config(text=f"Найдено: {summary['lines']} поз., {summary['quantity']} ед. на {summary['amount']:.2f} руб.")
+            else:
+                view["total"] = details['lines']; found_label.config(text="")
+            reload()
 
-        for idx, item in enumerate(details['items']):
-            tag = "evenrow_detail" if idx % 2 == 0 else "oddrow_detail"
-            items_tree.insert("", "end", values=(item['product_article'], item['product_name'], item['quantity'], f"{item['price_per_unit']:.2f}", f"{(item['quantity'] * item['price_per_unit']):.2f}"), tags=(tag,))
-        
-        it_scr_y = ttk.Scrollbar(items_frame, orient="vertical", command=items_tree.yview)
+        it_scr_y = ttk.Scrollbar(items_frame, orient="vertical", command=on_scrollbar)
         it_scr_x = ttk.Scrollbar(items_frame, orient="horizontal", command=items_tree.xview)
-        items_tree.configure(yscrollcommand=it_scr_y.set, xscrollcommand=it_scr_x.set)
+        items_tree.configure(xscrollcommand=it_scr_x.set)
         it_scr_y.pack(side="right",fill="y"); it_scr_x.pack(side="bottom", fill="x")
         items_tree.pack(fill="both",expand=True, padx=(0,5), pady=(0,5))
+        show_headings()
+        items_tree.bind("<Configure>", on_resize)
+        items_tree.bind("<MouseWheel>", on_wheel)
+        items_tree.bind("<Button-4>", on_wheel); items_tree.bind("<Button-5>", on_wheel)
+        items_tree.bind("<Prior>", lambda ev: scroll_to(view["offset"] - view["visible"]))
+        items_tree.bind("<Next>", lambda ev: scroll_to(view["offset"] + view["visible"]))
+        search_entry.bind("<Return>", search)
+        ttk.Button(search_frame, text="Найти", command=search, style="TButton").pack(side="left")
         
-        ttk.Button(details_window, text="Закрыть", command=details_window.destroy, style="Accent.TButton").pack(pady=15)
+        def open_document(kind):
+            full_details = oc.get_order_details_by_id(order_id) # Документу нужны все позиции - читаются только по запросу
+            if not full_details: self._handle_crud_result("NotFound", "формирования документа по заказу", f"ID {order_id}"); return
+            self.open_order_document_gui(kind, full_details)
+
+        details_btns = ttk.Frame(details_window)
+        details_btns.pack(pady=15)
+        ttk.Button(details_btns, text="Счет", command=lambda: open_document("invoice"), style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(details_btns, text="Лист сборки", command=lambda: open_document("picking_list"), style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(details_btns, text="История", command=lambda: self.entity_history_gui("orders", order_id, "заказа"), style="TButton").pack(side="left", padx=(0,10))
+        ttk.Button(details_btns, text="Закрыть", command=details_window.destroy, style="Accent.TButton").pack(side="left")
+
+    def open_order_document_gui(self, kind, details):
+        """Документ одного заказа открывается в браузере, откуда его можно распечатать."""
+        try: path, _ = docs.write_order_document(kind, details, tempfile.gettempdir())
+        except OSError as e: messagebox.showerror("Ошибка печати", f"Не удалось сохранить документ: {e}"); return
+        webbrowser.open("file://" + os.path.abspath(path))
+
+    def generate_documents_gui(self):
+        order_ids = self._selected_order_ids()
+        snapshot = None # Месяц заказов читается из снимка: оформление заказов в это время не ждет блокировок
+        if len(order_ids) > 1: scope = f"выбранных заказов: {len(order_ids)}"
+        else:
+            month = simpledialog.askstring("Документы по заказам", "Счета и листы сборки по всем заказам месяца (ГГГГ-ММ):",
+                                           initialvalue=datetime.now().strftime("%Y-%m"), parent=self.root)
+            if not month: return
+            try: first_day = datetime.strptime(month.strip(), "%Y-%m")
+            except ValueError: messagebox.showwarning("Внимание", "Укажите месяц в виде ГГГГ-ММ, например 2024-05."); return
+            next_month = first_day.replace(year=first_day.year + first_day.month // 12, month=first_day.month % 12 + 1)
+            last_day = next_month - timedelta(days=1)
+            snapshot = ReportSnapshot(date_from=first_day.strftime("%Y-%m-%d"), date_to=next_month.strftime("%Y-%m-%d"), include_archived=True)
+            scope = f"заказов за {month.strip()}"
+        output_dir = filedialog.askdirectory(parent=self.root, title="Каталог для документов")
+        if not output_dir: return
+
+        def generate(token):
+            # Снимок и документы - в фоновом потоке: окно остается отзывчивым, отмена прерывает и то и другое
+            ids = order_ids
+            try:
+                if snapshot is not None:
+                    refreshed = snapshot.refresh(cancel_token=token)
+                    if refreshed is not True: return refreshed
+                    ids = docs.select_order_ids(first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"), conn=snapshot.conn)
+                if not ids: return None
+                return docs.generate_documents(ids, output_dir, conn=snapshot.conn if snapshot else None, cancel_token=token)
+            finally:
+                if snapshot is not None: snapshot.close()
+
+        def on_done(result):
+            if result is None: messagebox.showinfo("Документы по заказам", "Нет заказов для документов."); return
+            if not isinstance(result, dict):
+                if result.startswith("DocumentFileError"):
+                    messagebox.showerror("Ошибка документов", f"Не удалось записать документы: {result.split(':',1)[1]}"); return
+                self._handle_crud_result(result, "формирования документов по заказам", output_dir); return
+            messagebox.showinfo("Документы по заказам", f"Обработано {scope}.\nЗаказов: {result['orders']}, файлов: {result['files']} "
+                                                       f"за {result['elapsed_s']} с ({result['orders_per_second']} заказов/с, процессов: {result['workers']}).\n\n{result['output_dir']}")
+        self.run_cancellable_gui("Документы по заказам", generate, on_done)
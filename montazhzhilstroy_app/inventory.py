@@ -0,0 +1,239 @@
+import math
+import sqlite3
+from database import create_connection
+from cancellation import CANCELLED, OperationCancelled, watch, is_interrupted
+
+try:
+    import numpy as np
+except ImportError: # Без NumPy расчет идет на чистом Python (медленнее, результат тот же)
+    np = None
+
+DEFAULT_WINDOW_DAYS = 90 # Окно анализа спроса
+DEFAULT_LEAD_TIME_DAYS = 7 # Срок поставки
+DEFAULT_SERVICE_LEVEL_Z = 1.65 # ~95% вероятность не уйти в ноль за срок поставки
+ABC_THRESHOLDS = (0.80, 0.95) # Доли накопленной выручки для классов A и B
+XYZ_THRESHOLDS = (0.5, 1.0) # Коэффициенты вариации дневного спроса для классов X и Y
+INVENTORY_STAGES = 3 # Этапов пересчета для индикатора прогресса
+
+def _read_state(conn):
+    return dict(conn.execute("SELECT key, value FROM inventory_plan_state").fetchall())
+
+def _daily_demand_rows(conn, window_days, only_affected=False):
+    """
+    Спрос по товарам и дням за окно: (product_id, количество, выручка в копейках).
+    С NumPy строки читаются без GROUP BY и сворачиваются векторно: сортировка миллиона строк
+    во временном B-дереве SQLite заметно медленнее. Без NumPy группирует сам SQLite.
+    """
+    where = "o.status <> 'Отменен' AND o.order_date >= datetime('now', ?)"
+    if only_affected: where += " AND oi.product_id IN (SELECT id FROM temp.inventory_affected)"
+    params = (f"-{int(window_days)} days",)
+    if np is None:
+        return conn.execute(f"""
+            SELECT oi.product_id, SUM(oi.quantity), SUM(oi.quantity * oi.price_per_unit)
+            FROM order_items oi JOIN orders o ON o.id = oi.order_id
+            WHERE {where}
+            GROUP BY oi.product_id, CAST(julianday(o.order_date) AS INTEGER)
+        """, params).fetchall()
+    cur = conn.execute(f"""
+        SELECT oi.product_id, CAST(julianday(o.order_date) AS INTEGER), oi.quantity, oi.quantity * oi.price_per_unit
+        FROM order_items oi JOIN orders o ON o.id = oi.order_id
+        WHERE {where}
+    """, params)
+    lines = np.fromiter(cur, dtype=[("product_id", np.int64), ("day", np.int64), ("quantity", np.int64), ("revenue", np.int64)])
+    if len(lines) == 0: return []
+    day_key = lines["product_id"] * 1_000_000 + (lines["day"] - lines["day"].min()) # Дней в окне заведомо меньше миллиона
+    order = np.argsort(day_key, kind="stable")
+    sorted_key = day_key[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_key[1:] != sorted_key[:-1])))
+    product_ids = lines["product_id"][order][starts]
+    quantity = np.add.reduceat(lines["quantity"][order], starts)
+    revenue = np.add.reduceat(lines["revenue"][order], starts)
+    return list(zip(product_ids.tolist(), quantity.tolist(), revenue.tolist()))
+
+def _demand_stats(rows, window_days, lead_time_days, service_level_z):
+    """
+    По дневным суммам считает для каждого товара выручку, средний спрос, СКО, CV и точку заказа.
+    Дни без продаж входят в окно как нули: дисперсия = E[q^2] - E[q]^2 по всем window_days дням.
+    """
+    stats = {}
+    if not rows: return stats
+    if np is not None:
+        product_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        quantity = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        revenue = np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows))
+        uniq, inverse = np.unique(product_ids, return_inverse=True)
+        total_qty = np.bincount(inverse, weights=quantity)
+        sum_sq = np.bincount(inverse, weights=quantity * quantity)
+        total_revenue = np.zeros(len(uniq), dtype=np.int64)
+        np.add.at(total_revenue, inverse, revenue) # Деньги суммируем точно, в целых копейках
+        mean = total_qty / window_days
+        std = np.sqrt(np.maximum(sum_sq / window_days - mean * mean, 0.0))
+        reorder = np.ceil(mean * lead_time_days + service_level_z * std * math.sqrt(lead_time_days))
+        for i, product_id in enumerate(uniq.tolist()):
+            stats[product_id] = (int(total_revenue[i]), int(total_qty[i]), float(mean[i]), float(std[i]), int(reorder[i]))
+        return stats
+    acc = {}
+    for product_id, qty, rev in rows:
+        a = acc.setdefault(product_id, [0, 0, 0])
+        a[0] += rev; a[1] += qty; a[2] += qty * qty
+    for product_id, (rev, qty, sq) in acc.items():
+        mean = qty / window_days
+        std = math.sqrt(max(sq / window_days - mean * mean, 0.0))
+        stats[product_id] = (rev, qty, mean, std, math.ceil(mean * lead_time_days + service_level_z * std * math.sqrt(lead_time_days)))
+    return stats
+
+def _xyz_class(mean, std):
+    if mean <= 0: return 'Z', None
+    cv = std / mean
+    return ('X' if cv <= XYZ_THRESHOLDS[0] else 'Y' if cv <= XYZ_THRESHOLDS[1] else 'Z'), cv
+
+def _abc_classes(revenues):
+    """revenues: список (product_id, выручка). Класс по доле накопленной выручки до товара (лидер всегда A)."""
+    if not revenues: return []
+    total = sum(r for _, r in revenues)
+    if np is not None and total > 0:
+        ids = np.array([p for p, _ in revenues], dtype=np.int64)
+        rev = np.array([r for _, r in revenues], dtype=np.float64)
+        order = np.argsort(-rev, kind="stable")
+        share_before = (np.cumsum(rev[order]) - rev[order]) / total
+        classes = np.where(share_before < ABC_THRESHOLDS[0], 'A', np.where(share_before < ABC_THRESHOLDS[1], 'B', 'C'))
+        classes[rev[order] <= 0] = 'C'
+        return list(zip(classes.tolist(), ids[order].tolist()))
+    result, cumulative = [], 0
+    for product_id, rev in sorted(revenues, key=lambda pr: -pr[1]):
+        share_before = cumulative / total if total else 1
+        cls = 'C' if rev <= 0 else 'A' if share_before < ABC_THRESHOLDS[0] else 'B' if share_before < ABC_THRESHOLDS[1] else 'C'
+        result.append((cls, product_id)); cumulative += rev
+    return result
+
+def refresh_inventory_plan(full=False, window_days=DEFAULT_WINDOW_DAYS, lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+                           service_level_z=DEFAULT_SERVICE_LEVEL_Z, cancel_token=None):
+    """
+    Пересчитывает план запасов (таблица inventory_plan).
+    Инкрементально пересчитываются только товары, затронутые изменениями из change_log с прошлого
+    расчета; полный пересчет - при full=True, смене параметров, новом дне (окно сдвинулось)
+    или если журнал изменений уже очищен. ABC-классы всегда переранжируются по всем товарам.
+    Возвращает {"mode": "full" | "incremental", "products": число пересчитанных товаров} или строку с ошибкой.
+    cancel_token (cancellation.CancelToken) - прогресс по этапам расчета и отмена: транзакция откатывается, план не меняется.
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    cur = conn.cursor()
+    def stage(number): # Завершен этап: 1 - отбор товаров, 2 - спрос и точки заказа, 3 - ABC-классы
+        if cancel_token is not None:
+            cancel_token.check(); cancel_token.report(number, INVENTORY_STAGES)
+    try:
+        with watch(cancel_token, conn):
+            conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+            state = _read_state(conn)
+            today = cur.execute("SELECT date('now')").fetchone()[0]
+            last_seq = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+            params = {"window_days": int(window_days), "lead_time_days": int(lead_time_days), "service_level_z": float(service_level_z)}
+            if not full:
+                prev_seq = state.get("last_change_seq")
+                min_seq = cur.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+                full = (prev_seq is None or state.get("computed_date") != today
+                        or any(state.get(k) != v for k, v in params.items())
+                        or (min_seq is not None and min_seq > prev_seq + 1))
+
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS inventory_affected (id INTEGER PRIMARY KEY);")
+            cur.execute("DELETE FROM temp.inventory_affected;")
+            if full:
+                cur.execute("INSERT INTO temp.inventory_affected (id) SELECT id FROM products;")
+                cur.execute("DELETE FROM inventory_plan;")
+            else: # Измененные товары + товары из измененных заказов (товары удаленных позиций пишет в журнал триггер)
+                cur.execute("""
+                    INSERT OR IGNORE INTO temp.inventory_affected (id)
+                    SELECT row_id FROM change_log WHERE table_name = 'products' AND seq > ?
+                    UNION
+                    SELECT oi.product_id FROM order_items oi
+                    WHERE oi.order_id IN (SELECT row_id FROM change_log WHERE table_name = 'orders' AND seq > ?)
+                """, (state["last_change_seq"], state["last_change_seq"]))
+                cur.execute("DELETE FROM inventory_plan WHERE product_id NOT IN (SELECT id FROM products);")
+            stage(1)
+            affected_ids = [row[0] for row in cur.execute("SELECT t.id FROM temp.inventory_affected t JOIN products p ON p.id = t.id")]
+
+            if affected_ids:
+                stats = _demand_stats(_daily_demand_rows(conn, window_days, only_affected=not full),
+                                      window_days, lead_time_days, service_level_z)
+                plan_rows = []
+                for product_id in affected_ids:
+                    revenue, total_qty, mean, std, reorder_point = stats.get(product_id, (0, 0, 0.0, 0.0, 0))
+                    xyz, cv = _xyz_class(mean, std)
+                    plan_rows.append((product_id, revenue, total_qty, mean, std, cv, xyz, reorder_point))
+                cur.executemany("""
+                    INSERT OR REPLACE INTO inventory_plan
+                        (product_id, revenue, total_quantity, avg_daily_demand, demand_std, demand_cv, xyz_class, reorder_point, computed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, plan_rows)
+
+            stage(2)
+            abc = _abc_classes(cur.execute("SELECT product_id, revenue FROM inventory_plan").fetchall())
+            cur.executemany("UPDATE inventory_plan SET abc_class = ? WHERE product_id = ? AND abc_class IS NOT ?",
+                            [(cls, product_id, cls) for cls, product_id in abc])
+
+            state_rows = dict(params, computed_date=today, last_change_seq=last_seq)
+            cur.executemany("INSERT OR REPLACE INTO inventory_plan_state (key, value) VALUES (?, ?)", list(state_rows.items()))
+            stage(3)
+            conn.commit()
+            return {"mode": "full" if full else "incremental", "products": len(affected_ids)}
+    except OperationCancelled:
+        if conn.in_transaction: conn.execute("ROLLBACK;")
+        return CANCELLED
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.execute("ROLLBACK;")
+        if is_interrupted(e, cancel_token): return CANCELLED
+        return f"SQLiteErrorInventory: {e}"
+    finally:
+        if conn: conn.close()
+
+def get_reorder_list():
+    """Товары, остаток которых опустился до точки заказа, с рекомендуемым количеством закупки."""
+    conn = create_connection()
+    if conn is None: return []
+    cur = conn.cursor()
+    lead_time_days = _read_state(conn).get("lead_time_days", DEFAULT_LEAD_TIME_DAYS)
+    cur.execute("""
+    SELECT p.id, p.name, p.article_number, p.stock_quantity, ip.reorder_point, ip.abc_class, ip.xyz_class, ip.avg_daily_demand
+    FROM inventory_plan ip
+    JOIN products p ON p.id = ip.product_id
+    WHERE ip.reorder_point > 0 AND p.stock_quantity <= ip.reorder_point
+    ORDER BY ip.abc_class, p.stock_quantity - ip.reorder_point
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    reorder_list = []
+    for row in rows:
+        # Докупаем до точки заказа плюс спрос на следующий срок поставки
+        suggested = row[4] - row[3] + math.ceil(row[7] * lead_time_days)
+        reorder_list.append({"id": row[0], "name": row[1], "article_number": row[2], "stock_quantity": row[3],
+                             "reorder_point": row[4], "abc_class": row[5], "xyz_class": row[6],
+                             "avg_daily_demand": row[7], "suggested_quantity": suggested})
+    return reorder_list
+
+def apply_reorder_points_as_levels(product_ids=None):
+    """
+    Переносит рассчитанные точки заказа в products.reorder_level (минимальный остаток для оповещений).
+    Без product_ids - для всех товаров с рассчитанным планом. Одним UPDATE; возвращает число измененных товаров.
+    """
+    sql = """
+    UPDATE products SET reorder_level = (SELECT reorder_point FROM inventory_plan WHERE product_id = products.id)
+    WHERE id IN (SELECT product_id FROM inventory_plan)
+      AND reorder_level IS NOT (SELECT reorder_point FROM inventory_plan WHERE product_id = products.id)
+    """
+    params = []
+    if product_ids is not None:
+        product_ids = [int(product_id) for product_id in product_ids]
+        if not product_ids: return 0
+        sql += f" AND id IN ({', '.join('?' for _ in product_ids)})"
+        params = product_ids
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e: return f"SQLiteErrorInventory: {e}"
+    finally:
+        if conn: conn.close()
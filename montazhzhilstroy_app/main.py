@@ -1,10 +1,39 @@
-import tkinter as tk
-from gui import MainApp 
-from database import initialize_database
+import argparse
+from app_logging import setup_logging, parse_log_levels, LOG_FILE, LOG_ROTATION_MODES
+from database import initialize_database, enable_connection_pool
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="МонтажЖилСтрой: учет товаров, клиентов и заказов")
+    parser.add_argument("--serve", action="store_true", help="запустить HTTP/JSON API без графического интерфейса")
+    parser.add_argument("--host", default=None, help="адрес API (по умолчанию 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=None, help="порт API (по умолчанию 8080)")
+    parser.add_argument("--workers", type=int, default=None, help="потоков для запросов к БД")
+    parser.add_argument("--log-level", default=None, help="уровни логирования по областям, например crud=INFO,db=DEBUG")
+    parser.add_argument("--log-file", default=LOG_FILE, help=f"файл журнала (по умолчанию {LOG_FILE})")
+    parser.add_argument("--log-rotate", choices=LOG_ROTATION_MODES, default="size", help="ротация журнала: по размеру или раз в сутки")
+    parser.add_argument("--record", default=None, help="записывать вызовы CRUD в файл для воспроизведения (workload.py)")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    initialize_database()  
-    
-    root = tk.Tk()
-    app = MainApp(root)
-    root.mainloop()
+    args = parse_args()
+    try: log_levels = parse_log_levels(args.log_level)
+    except ValueError as e: raise SystemExit(e)
+    setup_logging(args.log_file, log_levels, args.log_rotate)
+    if args.record:
+        import workload
+        initialize_database() # Снимок для воспроизведения снимается уже с актуальной схемой
+        workload.start_recording(args.record)
+    if args.serve:
+        import api_server # tkinter в этом режиме не импортируется: сервер работает и без дисплея
+        api_server.run_server(args.host or api_server.DEFAULT_HOST, args.port or api_server.DEFAULT_PORT,
+                              args.workers or api_server.DEFAULT_WORKERS)
+    else:
+        import tkinter as tk
+        from gui import MainApp
+
+        initialize_database()  
+        enable_connection_pool() # Схема с триггерами аудита разбирается один раз на соединение, а не при каждом вызове
+        
+        root = tk.Tk()
+        app = MainApp(root)
+        root.mainloop()
@@ -0,0 +1,29 @@
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+
+# Денежные суммы хранятся в БД целым числом копеек: суммы в SQL (SUM) получаются точными
+KOPECKS_PER_RUBLE = 100
+RUBLE_QUANTUM = Decimal("0.01")
+
+def to_kopecks(amount):
+    """
+    Переводит сумму в рублях (Decimal, int, str или float) в целое число копеек.
+    float переводится через str, чтобы не тянуть двоичную погрешность (0.1 -> 10, а не 9.99...).
+    Бросает ValueError, если значение не является числом.
+    """
+    if amount is None:
+        raise ValueError("Сумма не указана")
+    if isinstance(amount, float):
+        amount = str(amount)
+    try:
+        rubles = Decimal(amount) if not isinstance(amount, str) else Decimal(amount.strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+    if not rubles.is_finite():
+        raise ValueError(f"Некорректная сумма: {amount!r}")
+    return int((rubles * KOPECKS_PER_RUBLE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_kopecks(kopecks):
+    """Переводит целое число копеек из БД в Decimal рублей с двумя знаками после запятой."""
+    if kopecks is None:
+        return None
+    return (Decimal(int(kopecks)) / KOPECKS_PER_RUBLE).quantize(RUBLE_QUANTUM)
@@ -1,26 +1,40 @@
 import sqlite3
-from database import create_connection
+from database import create_connection, attach_archive_database, archive_database_exists, is_archive_attached
 from product_crud import update_product_stock # Для обновления остатков
+from reservations import available_quantity
+from client_stats import add_orders_to_stats, remove_orders_from_stats, refresh_last_order_dates, CANCELLED_STATUS
+from money import to_kopecks, from_kopecks
+from app_logging import log_crud
+from cancellation import CANCELLED, OperationCancelled, watch, is_interrupted
+
+LIST_FETCH_BATCH = 2000 # Строк списка за одно чтение: между чтениями виден прогресс и проверяется отмена
 
 ORDER_STATUSES = ['Новый', 'В обработке', 'Комплектуется', 'Готов к выдаче', 'Выполнен', 'Отменен']
 
-def add_order(client_id, order_items_data, initial_status='Новый'):
+@log_crud("add_order")
+def add_order(client_id, order_items_data, initial_status='Новый', reservation_holder=None):
     """
     Создает новый заказ и его позиции.
     order_items_data: список словарей [{'product_id': id, 'quantity': qty, 'price_per_unit': price}, ...]
+    price_per_unit - цена в рублях (Decimal-совместимая). Итоговая сумма считается в SQL по копейкам.
+    Товар, зарезервированный другими черновиками, не продается (см. reservations.py); резервы
+    reservation_holder (черновика, из которого оформляется заказ) снимаются в той же транзакции.
     """
+    try: items_prices = [to_kopecks(item['price_per_unit']) for item in order_items_data]
+    except ValueError: return "InvalidPriceError"
+
     conn = create_connection()
     if conn is None: return "ConnectionError"
     
-    total_amount = sum(item['quantity'] * item['price_per_unit'] for item in order_items_data)
-    
     cur = conn.cursor()
     try:
         conn.execute("BEGIN TRANSACTION;") # Начинаем транзакцию
 
-        # 1. Проверяем остатки и уменьшаем их
+        # 1. Проверяем остатки (за вычетом чужих резервов) и уменьшаем их
         for item in order_items_data:
-            stock_update_result = update_product_stock(item['product_id'], -item['quantity'], conn=conn) # Передаем conn
+            available = available_quantity(conn, item['product_id'], reservation_holder)
+            if available is not None and available < item['quantity']: stock_update_result = "InsufficientStockError"
+            else: stock_update_result = update_product_stock(item['product_id'], -item['quantity'], conn=conn) # Передаем conn
             if stock_update_result is not True: # Если не True, значит ошибка
                 conn.execute("ROLLBACK;")
                 if stock_update_result == "InsufficientStockError":
@@ -32,8 +46,8 @@ def add_order(client_id, order_items_data, initial_status='Новый'):
                 return stock_update_result # Другая ошибка обновления остатков
 
         # 2. Создаем заказ
-        sql_order = '''INSERT INTO orders (client_id, total_amount, status) VALUES (?, ?, ?)'''
-        cur.execute(sql_order, (client_id, total_amount, initial_status))
+        sql_order = '''INSERT INTO orders (client_id, status) VALUES (?, ?)'''
+        cur.execute(sql_order, (client_id, initial_status))
         order_id = cur.lastrowid
         if not order_id:
             conn.execute("ROLLBACK;")
@@ -41,8 +55,16 @@ def add_order(client_id, order_items_data, initial_status='Новый'):
 
         # 3. Добавляем позиции заказа
         sql_item = '''INSERT INTO order_items (order_id, product_id, quantity, price_per_unit) VALUES (?, ?, ?, ?)'''
-        for item in order_items_data:
-            cur.execute(sql_item, (order_id, item['product_id'], item['quantity'], item['price_per_unit']))
+        cur.executemany(sql_item, [(order_id, item['product_id'], item['quantity'], price_kopecks)
+                                   for item, price_kopecks in zip(order_items_data, items_prices)])
+
+        # 4. Итог заказа считается точно в копейках на стороне SQLite
+        update_order_total(order_id, conn)
+        add_orders_to_stats(conn, "o.id = :order_id", {"order_id": order_id}) # Итоги клиента (client_stats.py)
+
+        # 5. Резервы черновика превратились в заказ
+        if reservation_holder is not None:
+            cur.execute("DELETE FROM stock_reservations WHERE holder = ?", (reservation_holder,))
         
         conn.commit() # Завершаем транзакцию
         return order_id
@@ -52,61 +74,115 @@ def add_order(client_id, order_items_data, initial_status='Новый'):
     finally:
         if conn: conn.close()
 
-def get_all_orders_with_details():
-    """Получает все заказы с именем клиента."""
-    conn = create_connection()
+def update_order_total(order_id, conn):
+    """Пересчитывает orders.total_amount как SUM(quantity * price_per_unit) по позициям (в копейках)."""
+    conn.execute("""
+        UPDATE orders SET total_amount = (
+            SELECT COALESCE(SUM(quantity * price_per_unit), 0) FROM order_items WHERE order_id = orders.id
+        ) WHERE id = ?
+    """, (order_id,))
+
+def get_all_orders_with_details(include_archived=False, limit=None, offset=0, cancel_token=None):
+    """
+    Получает заказы с именем клиента, новые первыми. С include_archived=True добавляются заказы из архива.
+    limit/offset - постраничная выборка (limit=None - все заказы).
+    cancel_token (cancellation.CancelToken) - прогресс по прочитанным строкам и отмена (возвращается "Cancelled").
+    """
+    if include_archived and not archive_database_exists(): include_archived = False
+    conn = create_connection(attach_archive=include_archived)
     if conn is None: return []
     cur = conn.cursor()
-    sql = """
+    orders_source = "all_orders" if include_archived else "orders"
+    sql = f"""
     SELECT o.id, c.full_name, o.order_date, o.status, o.total_amount
-    FROM orders o
+    FROM {orders_source} o
     JOIN clients c ON o.client_id = c.id
     ORDER BY o.order_date DESC, o.id DESC
+    LIMIT ? OFFSET ?
     """
-    cur.execute(sql)
-    rows = cur.fetchall()
-    conn.close()
+    try:
+        with watch(cancel_token, conn):
+            total = None
+            if cancel_token is not None:
+                total = max(0, cur.execute(f"SELECT COUNT(*) FROM {orders_source} o JOIN clients c ON o.client_id = c.id").fetchone()[0] - int(offset))
+                if limit is not None: total = min(total, int(limit))
+            cur.execute(sql, (-1 if limit is None else int(limit), int(offset)))
+            rows = []
+            while True:
+                batch = cur.fetchmany(LIST_FETCH_BATCH)
+                if not batch: break
+                rows.extend(batch)
+                if cancel_token is not None: cancel_token.report(len(rows), total)
+    except OperationCancelled: return CANCELLED
+    except sqlite3.Error as e:
+        if is_interrupted(e, cancel_token): return CANCELLED
+        raise
+    finally:
+        conn.close()
     orders = []
     for row in rows:
         orders.append({
             "id": row[0], "client_name": row[1], "order_date": row[2],
-            "status": row[3], "total_amount": row[4]
+            "status": row[3], "total_amount": from_kopecks(row[4])
         })
     return orders
 
-def get_order_details_by_id(order_id):
-    """Получает детали заказа, включая информацию о клиенте и все позиции заказа."""
+def get_orders_by_ids(order_ids):
+    """Получает строки списка заказов (как в get_all_orders_with_details) только для указанных id."""
+    order_ids = [int(order_id) for order_id in order_ids]
+    if not order_ids: return []
     conn = create_connection()
-    if conn is None: return None
+    if conn is None: return []
     cur = conn.cursor()
-    
-    order_info = {}
-    
-    # 1. Информация о заказе и клиенте
-    sql_order = """
-    SELECT o.id, o.client_id, c.full_name, c.email, c.phone_number, o.order_date, o.status, o.total_amount
+    sql = f"""
+    SELECT o.id, c.full_name, o.order_date, o.status, o.total_amount
     FROM orders o
     JOIN clients c ON o.client_id = c.id
+    WHERE o.id IN ({', '.join('?' for _ in order_ids)})
+    """
+    cur.execute(sql, order_ids)
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": row[0], "client_name": row[1], "order_date": row[2],
+             "status": row[3], "total_amount": from_kopecks(row[4])} for row in rows]
+
+ORDER_DETAILS_COLUMNS = "o.id, o.client_id, c.full_name, c.email, c.phone_number, o.order_date, o.status, o.total_amount, c.address"
+
+def _order_details_header(order_row, schema):
+    return {
+        "id": order_row[0], "client_id": order_row[1], "client_full_name": order_row[2],
+        "client_email": order_row[3], "client_phone_number": order_row[4],
+        "order_date": order_row[5], "status": order_row[6], "total_amount": from_kopecks(order_row[7]),
+        "client_address": order_row[8],
+        "is_archived": schema == "archive",
+        "items": []
+    }
+
+def _order_details_item(item_row):
+    return {"product_id": item_row[0], "product_name": item_row[1], "product_article": item_row[2],
+            "quantity": item_row[3], "price_per_unit": from_kopecks(item_row[4])}
+
+def _fetch_order_details(cur, order_id, schema="main"):
+    """Читает заказ и его позиции из указанной схемы (main или archive). Возвращает None, если заказа там нет."""
+    # 1. Информация о заказе и клиенте
+    sql_order = f"""
+    SELECT {ORDER_DETAILS_COLUMNS}
+    FROM {schema}.orders o
+    JOIN clients c ON o.client_id = c.id
     WHERE o.id = ?
     """
     cur.execute(sql_order, (order_id,))
     order_row = cur.fetchone()
     
     if not order_row:
-        conn.close()
-        return None # Заказ не найден
+        return None
         
-    order_info = {
-        "id": order_row[0], "client_id": order_row[1], "client_full_name": order_row[2],
-        "client_email": order_row[3], "client_phone_number": order_row[4],
-        "order_date": order_row[5], "status": order_row[6], "total_amount": order_row[7],
-        "items": []
-    }
+    order_info = _order_details_header(order_row, schema)
     
     # 2. Позиции заказа
-    sql_items = """
+    sql_items = f"""
     SELECT oi.product_id, p.name, p.article_number, oi.quantity, oi.price_per_unit
-    FROM order_items oi
+    FROM {schema}.order_items oi
     JOIN products p ON oi.product_id = p.id
     WHERE oi.order_id = ?
     """
@@ -114,14 +190,155 @@ def get_order_details_by_id(order_id):
     item_rows = cur.fetchall()
     
     for item_row in item_rows:
-        order_info["items"].append({
-            "product_id": item_row[0], "product_name": item_row[1], "product_article": item_row[2],
-            "quantity": item_row[3], "price_per_unit": item_row[4]
-        })
+        order_info["items"].append(_order_details_item(item_row))
+    return order_info
+
+def get_order_details_by_id(order_id):
+    """
+    Получает детали заказа, включая информацию о клиенте и все позиции заказа.
+    Если в оперативной БД заказа нет, он ищется в архиве (is_archived=True).
+    """
+    conn = create_connection()
+    if conn is None: return None
+    cur = conn.cursor()
+    
+    order_info = _fetch_order_details(cur, order_id)
+    if order_info is None and archive_database_exists():
+        attach_archive_database(conn)
+        order_info = _fetch_order_details(cur, order_id, schema="archive")
         
     conn.close()
-    return order_info
+    return order_info # None, если заказ не найден
+
+# Постраничный просмотр позиций больших заказов (окно деталей заказа): сортировка и поиск - в SQL
+ORDER_LINES_PAGE = 200
+ORDER_LINE_SORT_COLUMNS = {
+    "position": "oi.id", "article": "p.article_number", "product": "p.name",
+    "quantity": "oi.quantity", "price": "oi.price_per_unit", "subtotal": "oi.quantity * oi.price_per_unit",
+}
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+def _order_lines_where(conn, order_id, search):
+    """Условие отбора позиций заказа и параметры. Поиск по названию и артикулу без учета регистра (и для кириллицы)."""
+    if not search: return "oi.order_id = ?", [order_id]
+    conn.create_function("casefold", 1, _casefold, deterministic=True) # LIKE и lower() в SQLite знают регистр только латиницы
+    needle = search.strip().casefold()
+    return "oi.order_id = ? AND (instr(casefold(p.name), ?) > 0 OR instr(casefold(p.article_number), ?) > 0)", [order_id, needle, needle]
 
+def _order_lines_summary(conn, order_id, search, schema):
+    where, params = _order_lines_where(conn, order_id, search)
+    lines, quantity, amount = conn.execute(f"""
+    SELECT COUNT(*), COALESCE(SUM(oi.quantity), 0), COALESCE(SUM(oi.quantity * oi.price_per_unit), 0)
+    FROM {schema}.order_items oi JOIN products p ON oi.product_id = p.id
+    WHERE {where}""", params).fetchone()
+    return {"lines": lines, "quantity": quantity, "amount": from_kopecks(amount)}
+
+def get_order_header(order_id):
+    """
+    Заказ с клиентом, без позиций, и итоги по позициям, посчитанные в SQL ("lines", "quantity", "amount").
+    Для окна деталей: открывается сразу при любом числе позиций. None, если заказа нет ни в БД, ни в архиве.
+    """
+    conn = create_connection()
+    if conn is None: return None
+    try:
+        for schema in ("main", "archive"):
+            if schema == "archive":
+                if not archive_database_exists(): return None
+                attach_archive_database(conn)
+            order_row = conn.execute(f"""
+            SELECT {ORDER_DETAILS_COLUMNS} FROM {schema}.orders o JOIN clients c ON o.client_id = c.id WHERE o.id = ?
+            """, (order_id,)).fetchone()
+            if order_row is not None:
+                header = _order_details_header(order_row, schema)
+                del header["items"]
+                header.update(_order_lines_summary(conn, order_id, None, schema))
+                return header
+        return None
+    finally:
+        conn.close()
+
+def get_order_lines_summary(order_id, search=None, archived=False):
+    """Число позиций, единиц и сумма по позициям заказа, отобранным поиском: {"lines", "quantity", "amount"}."""
+    conn = create_connection(attach_archive=archived)
+    if conn is None: return "ConnectionError"
+    try: return _order_lines_summary(conn, order_id, search, "archive" if archived else "main")
+    except sqlite3.Error as e: return f"SQLiteErrorOrder: {e}"
+    finally:
+        conn.close()
+
+def get_order_lines(order_id, offset=0, limit=ORDER_LINES_PAGE, sort_by="position", descending=False, search=None, archived=False):
+    """
+    Страница позиций заказа (как items в get_order_details_by_id, плюс "id" позиции).
+    sort_by - ключ ORDER_LINE_SORT_COLUMNS; при равных значениях порядок - по id позиции, поэтому страницы не перекрываются.
+    """
+    if sort_by not in ORDER_LINE_SORT_COLUMNS: return f"InvalidSortError:{sort_by}"
+    direction = "DESC" if descending else "ASC"
+    conn = create_connection(attach_archive=archived)
+    if conn is None: return "ConnectionError"
+    try:
+        where, params = _order_lines_where(conn, order_id, search)
+        rows = conn.execute(f"""
+        SELECT oi.product_id, p.name, p.article_number, oi.quantity, oi.price_per_unit, oi.id
+        FROM {"archive" if archived else "main"}.order_items oi JOIN products p ON oi.product_id = p.id
+        WHERE {where}
+        ORDER BY {ORDER_LINE_SORT_COLUMNS[sort_by]} {direction}, oi.id {direction}
+        LIMIT ? OFFSET ?""", (*params, int(limit), int(offset))).fetchall()
+    except sqlite3.Error as e: return f"SQLiteErrorOrder: {e}"
+    finally:
+        conn.close()
+    return [{**_order_details_item(row), "id": row[5]} for row in rows]
+
+def iter_orders_details(order_ids, include_archived=True, conn=None):
+    """
+    Детали многих заказов (как get_order_details_by_id) двумя запросами на схему вместо двух на заказ:
+    id кладутся во временную таблицу, заголовки и позиции читаются упорядоченными по id заказа
+    и сливаются на лету. Генератор: заказы отдаются по мере чтения, целиком в память не грузятся.
+    Сначала оперативные заказы, затем архивные; отсутствующие id пропускаются.
+    Если conn передан (например, снимок для отчетов), архив берется из него, если он подключен.
+    """
+    close_conn_locally = conn is None
+    if close_conn_locally:
+        conn = create_connection()
+        if conn is None: return
+    try:
+        schemas = ["main"]
+        if include_archived and not close_conn_locally:
+            if is_archive_attached(conn): schemas.append("archive")
+        elif include_archived and archive_database_exists():
+            attach_archive_database(conn) # ATTACH - до записи во временную таблицу (она открывает транзакцию)
+            schemas.append("archive")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS details_orders (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.details_orders")
+        conn.executemany("INSERT OR IGNORE INTO temp.details_orders (id) VALUES (?)", ((int(order_id),) for order_id in order_ids))
+        for schema in schemas:
+            headers = conn.execute(f"""
+            SELECT {ORDER_DETAILS_COLUMNS}
+            FROM temp.details_orders d
+            JOIN {schema}.orders o ON o.id = d.id
+            JOIN clients c ON o.client_id = c.id
+            ORDER BY o.id
+            """)
+            items = conn.execute(f"""
+            SELECT oi.product_id, p.name, p.article_number, oi.quantity, oi.price_per_unit, oi.order_id
+            FROM temp.details_orders d
+            JOIN {schema}.order_items oi ON oi.order_id = d.id
+            JOIN products p ON oi.product_id = p.id
+            ORDER BY oi.order_id, oi.id
+            """)
+            item_row = items.fetchone()
+            for order_row in headers:
+                order_info = _order_details_header(order_row, schema)
+                while item_row is not None and item_row[5] <= order_info["id"]:
+                    if item_row[5] == order_info["id"]: order_info["items"].append(_order_details_item(item_row))
+                    item_row = items.fetchone()
+                yield order_info
+    finally:
+        conn.rollback()
+        if close_conn_locally: conn.close()
+
+@log_crud("update_order_status")
 def update_order_status(order_id, new_status):
     """Обновляет статус заказа."""
     if new_status not in ORDER_STATUSES:
@@ -142,12 +359,17 @@ def update_order_status(order_id, new_status):
 
     try:
         conn.execute("BEGIN TRANSACTION;")
+        old_status_row = cur.execute("SELECT status FROM orders WHERE id = ?", (order_id,)).fetchone()
+        # Купленные товары клиента меняются, только если заказ отменяется или перестает быть отмененным
+        products_changed = old_status_row is not None and (old_status_row[0] == CANCELLED_STATUS) != (new_status == CANCELLED_STATUS)
+        remove_orders_from_stats(conn, "o.id = :order_id", {"order_id": order_id}, products=products_changed)
         sql = "UPDATE orders SET status = ? WHERE id = ?"
         cur.execute(sql, (new_status, order_id))
         
         if cur.rowcount == 0:
             conn.execute("ROLLBACK;")
             return "NotFound"
+        add_orders_to_stats(conn, "o.id = :order_id", {"order_id": order_id}, products=products_changed)
 
         # Если заказ отменяется и он не был "Выполнен" или уже "Отменен" ранее
         if new_status == 'Отменен' and current_order_details and \
@@ -167,6 +389,7 @@ def update_order_status(order_id, new_status):
     finally:
         if conn: conn.close()
 
+@log_crud("delete_order")
 def delete_order(order_id):
     """Удаляет заказ. Позиции удаляются каскадно. Товары возвращаются на склад, если заказ не 'Выполнен'."""
     conn = create_connection()
@@ -179,6 +402,7 @@ def delete_order(order_id):
 
     cur = conn.cursor()
     try:
+        if archive_database_exists(): attach_archive_database(conn) # Дата последнего заказа клиента может быть в архиве
         conn.execute("BEGIN TRANSACTION;")
         
         # Если заказ не "Выполнен" и не "Отменен", возвращаем товары на склад
@@ -189,16 +413,105 @@ def delete_order(order_id):
                     conn.execute("ROLLBACK;")
                     return f"StockReturnErrorOnDelete:{stock_update_result}"
 
+        remove_orders_from_stats(conn, "o.id = :order_id", {"order_id": order_id})
         cur.execute("DELETE FROM orders WHERE id = ?", (order_id,)) # order_items удалятся каскадно
         
         if cur.rowcount == 0: # Хотя get_order_details_by_id уже проверил
             conn.execute("ROLLBACK;")
             return "NotFound"
+        refresh_last_order_dates(conn, [current_order_details['client_id']])
             
         conn.commit()
         return True
     except sqlite3.Error as e:
-        conn.execute("ROLLBACK;")
+        if conn.in_transaction: conn.execute("ROLLBACK;") # Ошибка могла случиться еще при подключении архива
+        return f"SQLiteErrorOrderDelete: {e}"
+    finally:
+        if conn: conn.close()
+
+# Заказы в этих статусах уже не держат товар на складе: при отмене/удалении его не возвращают
+STOCK_RELEASED_STATUSES = ('Выполнен', 'Отменен')
+BULK_ORDERS_FILTER = "o.id IN (SELECT id FROM temp.bulk_orders WHERE old_status IS NOT NULL)" # Найденные заказы пакета
+
+def _load_bulk_order_ids(conn, order_ids):
+    """
+    Заполняет временную таблицу bulk_orders (id, прежний статус) для пакетной операции.
+    Через таблицу, а не IN (?, ?, ...), чтобы не упираться в лимит параметров SQLite.
+    Возвращает {order_id: прежний статус или None, если заказа нет}.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_orders (id INTEGER PRIMARY KEY, old_status TEXT)")
+    conn.execute("DELETE FROM temp.bulk_orders")
+    conn.executemany("INSERT OR IGNORE INTO temp.bulk_orders (id) VALUES (?)", [(order_id,) for order_id in order_ids])
+    conn.execute("UPDATE temp.bulk_orders SET old_status = (SELECT status FROM orders WHERE orders.id = bulk_orders.id)")
+    return dict(conn.execute("SELECT id, old_status FROM temp.bulk_orders").fetchall())
+
+def _restock_bulk_orders(conn):
+    """Возвращает на склад товары всех заказов из bulk_orders, еще удерживающих товар, одним UPDATE."""
+    placeholders = ", ".join("?" for _ in STOCK_RELEASED_STATUSES)
+    released_items = f"""
+        FROM order_items oi JOIN temp.bulk_orders b ON b.id = oi.order_id
+        WHERE b.old_status IS NOT NULL AND b.old_status NOT IN ({placeholders})
+    """
+    conn.execute(f"""
+        UPDATE products SET stock_quantity = stock_quantity + (
+            SELECT SUM(oi.quantity) {released_items} AND oi.product_id = products.id
+        )
+        WHERE id IN (SELECT oi.product_id {released_items})
+    """, STOCK_RELEASED_STATUSES * 2)
+
+@log_crud("bulk_update_order_status")
+def bulk_update_order_status(order_ids, new_status):
+    """
+    Меняет статус сразу у нескольких заказов в одной транзакции.
+    При отмене товары всех затронутых заказов возвращаются на склад одним агрегированным UPDATE
+    (как и в update_order_status - только для заказов, которые не были 'Выполнен' или 'Отменен').
+    Возвращает {order_id: True | "NotFound"} или строку ошибки, если транзакция откатилась целиком.
+    """
+    if new_status not in ORDER_STATUSES: return "InvalidStatusError"
+    order_ids = [int(order_id) for order_id in order_ids]
+    if not order_ids: return {}
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        conn.execute("BEGIN TRANSACTION;")
+        old_statuses = _load_bulk_order_ids(conn, order_ids)
+        if new_status == 'Отменен':
+            _restock_bulk_orders(conn)
+        remove_orders_from_stats(conn, BULK_ORDERS_FILTER)
+        conn.execute("UPDATE orders SET status = ? WHERE id IN (SELECT id FROM temp.bulk_orders WHERE old_status IS NOT NULL)", (new_status,))
+        add_orders_to_stats(conn, BULK_ORDERS_FILTER)
+        conn.commit()
+        return {order_id: True if old_statuses.get(order_id) is not None else "NotFound" for order_id in order_ids}
+    except sqlite3.Error as e:
+        conn.rollback()
+        return f"SQLiteErrorOrderStatus: {e}"
+    finally:
+        if conn: conn.close()
+
+@log_crud("bulk_delete_orders")
+def bulk_delete_orders(order_ids):
+    """
+    Удаляет несколько заказов в одной транзакции. Товары заказов, кроме 'Выполнен' и 'Отменен',
+    возвращаются на склад одним агрегированным UPDATE; позиции удаляются каскадно.
+    Возвращает {order_id: True | "NotFound"} или строку ошибки, если транзакция откатилась целиком.
+    """
+    order_ids = [int(order_id) for order_id in order_ids]
+    if not order_ids: return {}
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        if archive_database_exists(): attach_archive_database(conn) # Для пересчета даты последнего заказа клиентов
+        conn.execute("BEGIN TRANSACTION;")
+        old_statuses = _load_bulk_order_ids(conn, order_ids)
+        _restock_bulk_orders(conn)
+        client_ids = [row[0] for row in conn.execute(f"SELECT DISTINCT o.client_id FROM orders o WHERE {BULK_ORDERS_FILTER}")]
+        remove_orders_from_stats(conn, BULK_ORDERS_FILTER)
+        conn.execute("DELETE FROM orders WHERE id IN (SELECT id FROM temp.bulk_orders WHERE old_status IS NOT NULL)")
+        refresh_last_order_dates(conn, client_ids)
+        conn.commit()
+        return {order_id: True if old_statuses.get(order_id) is not None else "NotFound" for order_id in order_ids}
+    except sqlite3.Error as e:
+        conn.rollback()
         return f"SQLiteErrorOrderDelete: {e}"
     finally:
         if conn: conn.close()
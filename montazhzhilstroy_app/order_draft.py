@@ -0,0 +1,180 @@
+import sqlite3
+import uuid
+from database import create_connection
+from money import to_kopecks, from_kopecks
+
+class OrderDraft:
+    """
+    Черновик заказа: строки по product_id (поиск и изменение строки за O(1)),
+    итог в копейках поддерживается при каждом изменении, а не пересчитывается заново.
+    save() пишет в order_drafts / order_draft_items только изменившиеся строки,
+    поэтому частое автосохранение дешево и при сбое теряется лишь несохраненный хвост.
+    holder - ключ резервов остатков этого черновика в текущем сеансе (reservations.py).
+    """
+    def __init__(self, draft_id=None, client_id=None):
+        self.draft_id, self.client_id = draft_id, client_id
+        self.holder = uuid.uuid4().hex
+        self.lines = {} # product_id -> {'product_id', 'product_name', 'quantity', 'price_per_unit'} (формат для add_order)
+        self.price_kopecks = {}
+        self.positions = {}
+        self.total_kopecks = 0
+        self.dirty_ids = set()
+        self.header_dirty = False
+        self.next_position = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def total(self):
+        return from_kopecks(self.total_kopecks)
+
+    @property
+    def is_dirty(self):
+        return bool(self.dirty_ids) or self.header_dirty
+
+    def get(self, product_id):
+        return self.lines.get(int(product_id))
+
+    def items(self):
+        """Строки в порядке добавления - в формате order_items_data для add_order."""
+        return list(self.lines.values())
+
+    def subtotal(self, product_id):
+        product_id = int(product_id)
+        return from_kopecks(self.lines[product_id]["quantity"] * self.price_kopecks[product_id])
+
+    def set_client(self, client_id):
+        if client_id != self.client_id:
+            self.client_id, self.header_dirty = client_id, True
+
+    def add(self, product, quantity):
+        """Добавляет товар (словарь как в get_all_products) или увеличивает количество в его строке. Возвращает строку."""
+        line = self.lines.get(product["id"])
+        if line is not None: return self.set_quantity(product["id"], line["quantity"] + quantity)
+        return self._put_line(product["id"], product["name"], quantity, to_kopecks(product["price"]), self._take_position())
+
+    def set_quantity(self, product_id, quantity):
+        """Меняет количество в строке; 0 и меньше удаляет строку (возвращается None)."""
+        product_id = int(product_id)
+        line = self.lines[product_id]
+        if quantity <= 0:
+            self.remove(product_id); return None
+        self.total_kopecks += (quantity - line["quantity"]) * self.price_kopecks[product_id]
+        line["quantity"] = quantity
+        self.dirty_ids.add(product_id)
+        return line
+
+    def remove(self, product_id):
+        product_id = int(product_id)
+        line = self.lines.pop(product_id, None)
+        if line is None: return False
+        self.total_kopecks -= line["quantity"] * self.price_kopecks.pop(product_id)
+        self.positions.pop(product_id)
+        self.dirty_ids.add(product_id)
+        return True
+
+    def _take_position(self):
+        self.next_position += 1
+        return self.next_position
+
+    def _put_line(self, product_id, product_name, quantity, price_kopecks, position):
+        line = {"product_id": product_id, "product_name": product_name, "quantity": quantity, "price_per_unit": from_kopecks(price_kopecks)}
+        self.lines[product_id] = line
+        self.price_kopecks[product_id] = price_kopecks
+        self.positions[product_id] = position
+        self.next_position = max(self.next_position, position)
+        self.total_kopecks += quantity * price_kopecks
+        self.dirty_ids.add(product_id)
+        return line
+
+    def save(self):
+        """
+        Сохраняет изменения с прошлого save() одной транзакцией. Пустой черновик без клиента в БД не создается.
+        Возвращает True или строку ошибки.
+        """
+        if not self.is_dirty: return True
+        if self.draft_id is None and not self.lines and self.client_id is None:
+            self.dirty_ids.clear(); self.header_dirty = False; return True
+        conn = create_connection()
+        if conn is None: return "ConnectionError"
+        try:
+            conn.execute("BEGIN TRANSACTION;")
+            if self.draft_id is None:
+                self.draft_id = conn.execute("INSERT INTO order_drafts (client_id) VALUES (?)", (self.client_id,)).lastrowid
+            else:
+                conn.execute("UPDATE order_drafts SET client_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (self.client_id, self.draft_id))
+            changed = [product_id for product_id in self.dirty_ids if product_id in self.lines]
+            removed = [(self.draft_id, product_id) for product_id in self.dirty_ids if product_id not in self.lines]
+            conn.executemany("""
+            INSERT INTO order_draft_items (draft_id, product_id, product_name, quantity, price_per_unit, position)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (draft_id, product_id) DO UPDATE SET product_name = excluded.product_name, quantity = excluded.quantity,
+                price_per_unit = excluded.price_per_unit, position = excluded.position
+            """, [(self.draft_id, product_id, self.lines[product_id]["product_name"], self.lines[product_id]["quantity"],
+                   self.price_kopecks[product_id], self.positions[product_id]) for product_id in changed])
+            conn.executemany("DELETE FROM order_draft_items WHERE draft_id = ? AND product_id = ?", removed)
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction: conn.rollback()
+            if not conn.execute("SELECT 1 FROM order_drafts WHERE id = ?", (self.draft_id,)).fetchone(): self.draft_id = None
+            return f"SQLiteErrorDraft: {e}"
+        finally:
+            conn.close()
+        self.dirty_ids.clear(); self.header_dirty = False
+        return True
+
+    def discard(self):
+        """Удаляет сохраненный черновик (после оформления заказа или очистки формы)."""
+        if self.draft_id is None: return True
+        result = delete_order_draft(self.draft_id)
+        if result in (True, "NotFound"):
+            self.draft_id = None
+            self.dirty_ids.clear(); self.header_dirty = False
+            return True
+        return result
+
+def get_order_drafts():
+    """Сохраненные черновики, последние измененные первыми: без строк, только итоги."""
+    conn = create_connection()
+    if conn is None: return []
+    rows = conn.execute("""
+    SELECT d.id, d.client_id, c.full_name, d.updated_at, COUNT(i.product_id), COALESCE(SUM(i.quantity * i.price_per_unit), 0)
+    FROM order_drafts d
+    LEFT JOIN clients c ON c.id = d.client_id
+    LEFT JOIN order_draft_items i ON i.draft_id = d.id
+    GROUP BY d.id
+    ORDER BY d.updated_at DESC, d.id DESC
+    """).fetchall()
+    conn.close()
+    return [{"id": row[0], "client_id": row[1], "client_name": row[2], "updated_at": row[3],
+             "lines_count": row[4], "total": from_kopecks(row[5])} for row in rows]
+
+def load_order_draft(draft_id):
+    """Загружает черновик в OrderDraft или возвращает "NotFound"."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        header = conn.execute("SELECT id, client_id FROM order_drafts WHERE id = ?", (draft_id,)).fetchone()
+        if header is None: return "NotFound"
+        draft = OrderDraft(header[0], header[1])
+        for product_id, product_name, quantity, price_kopecks, position in conn.execute(
+                "SELECT product_id, product_name, quantity, price_per_unit, position FROM order_draft_items WHERE draft_id = ? ORDER BY position",
+                (draft_id,)):
+            draft._put_line(product_id, product_name, quantity, price_kopecks, position)
+        draft.dirty_ids.clear()
+        return draft
+    except sqlite3.Error as e: return f"SQLiteErrorDraft: {e}"
+    finally:
+        conn.close()
+
+def delete_order_draft(draft_id):
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        cur = conn.execute("DELETE FROM order_drafts WHERE id = ?", (draft_id,)) # Строки удаляются каскадно
+        conn.commit()
+        return True if cur.rowcount > 0 else "NotFound"
+    except sqlite3.Error as e: return f"SQLiteErrorDraft: {e}"
+    finally:
+        conn.close()
@@ -1,14 +1,25 @@
 import sqlite3
-from database import create_connection 
+from database import create_connection, attach_archive_database, archive_database_exists
+from money import to_kopecks, from_kopecks
+from app_logging import log_crud
 
-def add_product(name, article_number, category, description, price, stock_quantity):
+@log_crud("add_product")
+def add_product(name, article_number, category, description, price, stock_quantity, cost_price=0, reorder_level=0):
+    """
+    Добавляет товар. price и cost_price (закупочная цена) - суммы в рублях
+    (Decimal, str, int или float), в БД хранятся в копейках.
+    reorder_level - минимальный остаток, при падении до которого создается оповещение.
+    """
+    if int(reorder_level) < 0: return "ReorderLevelCannotBeNegative"
+    try: price_kopecks, cost_price_kopecks = to_kopecks(price), to_kopecks(cost_price)
+    except ValueError: return "InvalidPriceError"
     conn = create_connection()
     if conn is None: return "ConnectionError"
-    sql = ''' INSERT INTO products(name, article_number, category, description, price, stock_quantity)
-              VALUES(?,?,?,?,?,?) '''
+    sql = ''' INSERT INTO products(name, article_number, category, description, price, stock_quantity, cost_price, reorder_level)
+              VALUES(?,?,?,?,?,?,?,?) '''
     cur = conn.cursor()
     try:
-        cur.execute(sql, (name, article_number, category, description, price, stock_quantity))
+        cur.execute(sql, (name, article_number, category, description, price_kopecks, stock_quantity, cost_price_kopecks, reorder_level))
         conn.commit()
         return cur.lastrowid 
     except sqlite3.IntegrityError as e: 
@@ -24,29 +35,54 @@ def get_product_by_id(product_id):
     conn = create_connection()
     if conn is None: return None
     cur = conn.cursor()
-    cur.execute("SELECT id, name, article_number, category, description, price, stock_quantity FROM products WHERE id=?", (product_id,))
+    cur.execute("SELECT id, name, article_number, category, description, price, stock_quantity, cost_price, reorder_level FROM products WHERE id=?", (product_id,))
     row = cur.fetchone()
     conn.close()
     if row:
         return {"id": row[0], "name": row[1], "article_number": row[2], "category": row[3], 
-                "description": row[4], "price": row[5], "stock_quantity": row[6]}
+                "description": row[4], "price": from_kopecks(row[5]), "stock_quantity": row[6],
+                "cost_price": from_kopecks(row[7]), "reorder_level": row[8]}
     return None
 
-def get_all_products():
+def get_all_products(limit=None, offset=0):
+    """Список товаров по названию. limit/offset - постраничная выборка (limit=None - все товары)."""
     conn = create_connection()
     if conn is None: return []
     cur = conn.cursor()
     # Выбираем только товары с положительным остатком для добавления в заказ, или все для каталога
     # Для добавления в заказ лучше фильтровать в GUI или при выборе
-    cur.execute("SELECT id, name, article_number, price, stock_quantity FROM products ORDER BY name ASC") 
+    cur.execute("SELECT id, name, article_number, price, stock_quantity, category FROM products ORDER BY name ASC, id ASC LIMIT ? OFFSET ?",
+                (-1 if limit is None else int(limit), int(offset)))
     rows = cur.fetchall()
     conn.close()
     products = []
     for row in rows:
         products.append({"id": row[0], "name": row[1], "article_number": row[2], 
-                         "price": row[3], "stock_quantity": row[4]})
+                         "price": from_kopecks(row[3]), "stock_quantity": row[4], "category": row[5]})
     return products
 
+def get_product_categories():
+    """Список различных категорий товаров (для фильтров)."""
+    conn = create_connection()
+    if conn is None: return []
+    rows = conn.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category <> '' ORDER BY category").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def get_products_by_ids(product_ids):
+    """Получает строки списка товаров (как в get_all_products) только для указанных id."""
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids: return []
+    conn = create_connection()
+    if conn is None: return []
+    cur = conn.cursor()
+    cur.execute(f"SELECT id, name, article_number, price, stock_quantity, category FROM products WHERE id IN ({', '.join('?' for _ in product_ids)})", product_ids)
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": row[0], "name": row[1], "article_number": row[2], "price": from_kopecks(row[3]),
+             "stock_quantity": row[4], "category": row[5]} for row in rows]
+
+@log_crud("update_product_stock")
 def update_product_stock(product_id, quantity_change, conn=None):
     """
     Обновляет остаток товара. quantity_change может быть положительным (возврат) или отрицательным (продажа).
@@ -86,7 +122,8 @@ def update_product_stock(product_id, quantity_change, conn=None):
             conn.close()
 
 
-def update_product(product_id, name=None, article_number=None, category=None, description=None, price=None, stock_quantity=None):
+@log_crud("update_product")
+def update_product(product_id, name=None, article_number=None, category=None, description=None, price=None, stock_quantity=None, cost_price=None, reorder_level=None):
     conn = create_connection()
     if conn is None: return "ConnectionError"
     cur = conn.cursor()
@@ -95,11 +132,21 @@ def update_product(product_id, name=None, article_number=None, category=None, de
     if article_number is not None: fields_to_update.append("article_number = ?"); params.append(article_number)
     if category is not None: fields_to_update.append("category = ?"); params.append(category)
     if description is not None: fields_to_update.append("description = ?"); params.append(description)
-    if price is not None: fields_to_update.append("price = ?"); params.append(price)
+    if price is not None:
+        try: params.append(to_kopecks(price))
+        except ValueError: conn.close(); return "InvalidPriceError"
+        fields_to_update.append("price = ?")
+    if cost_price is not None:
+        try: params.append(to_kopecks(cost_price))
+        except ValueError: conn.close(); return "InvalidPriceError"
+        fields_to_update.append("cost_price = ?")
+    if reorder_level is not None:
+        if int(reorder_level) < 0: conn.close(); return "ReorderLevelCannotBeNegative"
+        fields_to_update.append("reorder_level = ?"); params.append(reorder_level)
     if stock_quantity is not None: 
-        if int(stock_quantity) < 0: return "StockCannotBeNegative"
+        if int(stock_quantity) < 0: conn.close(); return "StockCannotBeNegative"
         fields_to_update.append("stock_quantity = ?"); params.append(stock_quantity)
-    if not fields_to_update: return "NoDataToUpdate"
+    if not fields_to_update: conn.close(); return "NoDataToUpdate"
     sql = f"UPDATE products SET {', '.join(fields_to_update)} WHERE id = ?"
     params.append(product_id)
     try:
@@ -114,11 +161,16 @@ def update_product(product_id, name=None, article_number=None, category=None, de
     finally:
         if conn: conn.close()
 
+@log_crud("delete_product")
 def delete_product(product_id):
     conn = create_connection()
     if conn is None: return "ConnectionError"
     cur = conn.cursor()
     try:
+        if archive_database_exists(): # Внешние ключи не действуют между файлами, проверяем архив вручную
+            attach_archive_database(conn)
+            cur.execute("SELECT 1 FROM archive.order_items WHERE product_id = ? LIMIT 1", (product_id,))
+            if cur.fetchone(): return "HasOrderItemsError"
         cur.execute('DELETE FROM products WHERE id=?', (product_id,))
         conn.commit()
         return True if cur.rowcount > 0 else "NotFound"
@@ -0,0 +1,260 @@
+"""
+Снимок БД для тяжелых отчетов: согласованная копия в памяти (или во временной БД на диске),
+по которой работают аналитика и выгрузки, не удерживая блокировки рабочего файла.
+    with ReportSnapshot(include_archived=True) as snapshot:
+        rows = analytics.aggregate_sales(by="product", include_archived=snapshot.has_archive, conn=snapshot.conn)
+Проверка изоляции (на копии БД): python report_snapshot.py --benchmark
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import database
+from database import attach_archive_database, archive_database_exists, ORDER_COLUMNS, ORDER_ITEM_COLUMNS, \
+    SQL_CREATE_ARCHIVE_ORDERS_TABLE, SQL_CREATE_ARCHIVE_ORDER_ITEMS_TABLE, SQL_CREATE_ARCHIVE_INDEXES, SQL_CREATE_ALL_ORDERS_VIEWS
+from api_loadtest import percentile
+from cancellation import CANCELLED, OperationCancelled, watch, is_interrupted
+
+# Таблицы снимка, ограниченного периодом, если список таблиц не задан: справочники целиком, заказы за период
+REPORT_TABLES = ("products", "clients", "orders", "order_items")
+ARCHIVE_TABLE_COLUMNS = {"orders": ORDER_COLUMNS, "order_items": ORDER_ITEM_COLUMNS}
+# Отбор строк по периоду (date_from включительно, date_to - нет, как в analytics.py); {schema} - main или archive
+DATE_FILTERS = {
+    "orders": "order_date >= :date_from AND order_date < :date_to",
+    "order_items": "order_id IN (SELECT id FROM {schema}.orders WHERE order_date >= :date_from AND order_date < :date_to)",
+}
+OPEN_DATE_FROM, OPEN_DATE_TO = "", "9999-12-31"
+BACKUP_STEP_PAGES = 1024 # Страниц за шаг backup при отменяемом снятии: между шагами - прогресс и проверка отмены
+COPY_BATCH_ROWS = 5000 # То же для копирования строк
+
+class ReportSnapshot:
+    """
+    Копия рабочей БД для отчетов. Без ограничений снимается backup API (постранично, одним шагом);
+    tables и период date_from / date_to - копирование только нужных таблиц и строк через SELECT.
+    Основная и архивная БД читаются в одной транзакции, поэтому снимок согласован и во время архивации.
+    Устаревание определяется по PRAGMA data_version рабочей БД: refresh() - снять заново, ensure_fresh() -
+    только если данные изменились. path=":memory:" - снимок в памяти, "" - во временном файле SQLite.
+    """
+    def __init__(self, tables=None, date_from=None, date_to=None, include_archived=False, path=":memory:"):
+        self.tables = tuple(tables) if tables else None
+        self.date_from, self.date_to = date_from, date_to
+        self.include_archived = include_archived
+        self.path = path
+        self.conn = None
+        self.has_archive = False
+        self.source = None # Соединение с рабочей БД, открытое между снимками: data_version считается для соединения
+        self.data_versions = None
+        self.taken_at = None
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        result = self.ensure_fresh()
+        if result is not True: raise sqlite3.OperationalError(result)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def is_partial(self):
+        return self.tables is not None or self.date_from is not None or self.date_to is not None
+
+    def _open_source(self):
+        if self.source is None:
+            # Свое соединение, а не create_connection(): снимок может обновляться из фонового потока
+            self.source = sqlite3.connect(database.DATABASE_NAME, check_same_thread=False)
+        if self.include_archived and archive_database_exists() and not database.is_archive_attached(self.source):
+            attach_archive_database(self.source)
+        return self.source
+
+    def _schemas(self):
+        return ("main", "archive") if database.is_archive_attached(self.source) else ("main",)
+
+    def _read_data_versions(self):
+        return tuple(self.source.execute(f"PRAGMA {schema}.data_version").fetchone()[0] for schema in self._schemas())
+
+    def is_stale(self):
+        """Изменилась ли рабочая БД (в том числе другими процессами) с момента снимка."""
+        with self.lock:
+            if self.conn is None: return True
+            try: return self._read_data_versions() != self.data_versions
+            except sqlite3.Error: return True
+
+    def ensure_fresh(self):
+        """Снимает снимок, если его нет или данные изменились. True или строка ошибки."""
+        return self.refresh() if self.is_stale() else True
+
+    def refresh(self, cancel_token=None):
+        """
+        Снимает снимок заново (старый закрывается после успешного снятия нового). True или строка ошибки.
+        cancel_token - прогресс (страниц или строк) и отмена: недоснятый снимок отбрасывается, старый остается.
+        """
+        with self.lock:
+            started = time.perf_counter()
+            target = None
+            try:
+                source = self._open_source()
+                target = sqlite3.connect(self.path, check_same_thread=False)
+                source.execute("BEGIN;")
+                for schema in self._schemas(): # Чтение фиксирует состояние каждой схемы до конца транзакции
+                    source.execute(f"SELECT COUNT(*) FROM {schema}.sqlite_master").fetchone()
+                versions = self._read_data_versions()
+                with watch(cancel_token, source):
+                    if self.is_partial: rows = self._copy_tables(source, target, cancel_token)
+                    elif cancel_token is None:
+                        source.backup(target)
+                        rows = None
+                    else:
+                        def backup_progress(status, remaining, total):
+                            cancel_token.check(); cancel_token.report(total - remaining, total)
+                        source.backup(target, pages=BACKUP_STEP_PAGES, progress=backup_progress, sleep=0)
+                        rows = None
+                    has_archive = "archive" in self._schemas()
+                    if has_archive: rows = self._copy_archive(source, target, rows, cancel_token)
+                source.rollback()
+            except (sqlite3.Error, OperationCancelled) as e:
+                if self.source is not None and self.source.in_transaction: self.source.rollback()
+                if target is not None: target.close()
+                if isinstance(e, OperationCancelled) or is_interrupted(e, cancel_token): return CANCELLED
+                return f"SQLiteErrorSnapshot: {e}"
+            old_conn = self.conn
+            self.conn, self.has_archive, self.data_versions = target, has_archive, versions
+            self.taken_at = time.time()
+            page_count = target.execute("PRAGMA page_count").fetchone()[0]
+            page_size = target.execute("PRAGMA page_size").fetchone()[0]
+            self.stats = {"mode": "tables" if self.is_partial else "backup", "rows": rows,
+                          "bytes": page_count * page_size, "elapsed_s": round(time.perf_counter() - started, 3)}
+        if old_conn is not None: old_conn.close()
+        return True
+
+    def _date_filter(self, table, schema):
+        condition = DATE_FILTERS.get(table)
+        if condition is None or self.date_from is None and self.date_to is None: return "1 = 1", {}
+        return condition.format(schema=schema), {"date_from": self.date_from or OPEN_DATE_FROM, "date_to": self.date_to or OPEN_DATE_TO}
+
+    def _copy_rows(self, source, target, schema, table, target_table, columns, cancel_token=None):
+        condition, params = self._date_filter(table, schema)
+        cur = source.execute(f"SELECT {columns} FROM {schema}.{table} WHERE {condition}", params)
+        placeholders = ", ".join("?" for _ in columns.split(","))
+        insert_sql = f"INSERT INTO {target_table} ({columns}) VALUES ({placeholders})"
+        if cancel_token is None: return target.executemany(insert_sql, cur).rowcount
+        copied = 0
+        while True:
+            batch = cur.fetchmany(COPY_BATCH_ROWS)
+            if not batch: return copied
+            cancel_token.check()
+            copied += target.executemany(insert_sql, batch).rowcount
+            cancel_token.report(copied)
+
+    def _copy_tables(self, source, target, cancel_token=None):
+        """Копирует таблицы self.tables (по умолчанию REPORT_TABLES) из main с их индексами, без триггеров."""
+        tables = self.tables or REPORT_TABLES
+        rows = {}
+        target.execute("BEGIN;")
+        for table in tables:
+            ddl = source.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+            if ddl is None: continue
+            target.execute(ddl[0])
+            columns = ", ".join(row[1] for row in source.execute(f"PRAGMA main.table_info({table})"))
+            rows[table] = self._copy_rows(source, target, "main", table, table, columns, cancel_token)
+        # Индексы строятся после вставки строк - так быстрее, чем поддерживать их при каждой вставке
+        indexes = source.execute(f"""
+        SELECT sql FROM main.sqlite_master WHERE type = 'index' AND sql IS NOT NULL
+          AND tbl_name IN ({', '.join('?' for _ in rows)})""", list(rows)).fetchall()
+        for (index_sql,) in indexes:
+            target.execute(index_sql)
+        target.commit()
+        return rows
+
+    def _copy_archive(self, source, target, rows, cancel_token=None):
+        """Архивные заказы - в схему archive снимка, с теми же представлениями all_orders / all_order_items."""
+        rows = dict(rows or {})
+        target.execute("ATTACH DATABASE ? AS archive;", (self.path,)) # ':memory:' / '' - отдельная новая БД
+        target.executescript(f"{SQL_CREATE_ARCHIVE_ORDERS_TABLE}\n{SQL_CREATE_ARCHIVE_ORDER_ITEMS_TABLE}")
+        target.execute("BEGIN;")
+        for table, columns in ARCHIVE_TABLE_COLUMNS.items():
+            if self.tables is not None and table not in self.tables: continue
+            rows[f"archive.{table}"] = self._copy_rows(source, target, "archive", table, f"archive.{table}", columns, cancel_token)
+        target.commit()
+        target.executescript(f"{SQL_CREATE_ARCHIVE_INDEXES}\n{SQL_CREATE_ALL_ORDERS_VIEWS}")
+        return rows
+
+    def close(self):
+        with self.lock:
+            for conn in (self.conn, self.source):
+                if conn is not None: conn.close()
+            self.conn = self.source = self.data_versions = None
+
+def benchmark_report_isolation(db_path=database.DATABASE_NAME, report_runs=3, writer_pause_s=0.002):
+    """
+    Задержка записи (как при оформлении заказов) без отчетов, во время отчета по рабочей БД и во время
+    отчета по снимку. Выполняется на копии db_path. Возвращает {режим: {"writes", "p50_ms", "p99_ms", "max_ms"}}.
+    """
+    import analytics
+    import product_crud as pc
+    workdir = tempfile.mkdtemp(prefix="snapshot_bench_")
+    copy_path = os.path.join(workdir, os.path.basename(db_path))
+    saved_name, saved_archive = database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(copy_path)
+    try: source.backup(target)
+    finally:
+        target.close(); source.close()
+    database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME = copy_path, os.path.join(workdir, "archive.db")
+    product_id = pc.get_all_products()[0]["id"]
+
+    def measure(report):
+        latencies, stop = [], threading.Event()
+        def writer():
+            step = 1
+            while not stop.is_set():
+                started = time.perf_counter()
+                pc.update_product_stock(product_id, step)
+                latencies.append((time.perf_counter() - started) * 1000)
+                step = -step
+                time.sleep(writer_pause_s)
+        thread = threading.Thread(target=writer, daemon=True)
+        thread.start()
+        started = time.perf_counter()
+        report()
+        report_s = time.perf_counter() - started
+        stop.set(); thread.join()
+        latencies.sort()
+        return {"writes": len(latencies), "report_s": round(report_s, 3), "p50_ms": round(percentile(latencies, 50), 3),
+                "p99_ms": round(percentile(latencies, 99), 3), "max_ms": round(latencies[-1], 3) if latencies else 0.0}
+
+    def live_reports():
+        for _ in range(report_runs): analytics.aggregate_sales(by="product", period="day")
+
+    def snapshot_reports():
+        with ReportSnapshot() as snapshot:
+            for _ in range(report_runs): analytics.aggregate_sales(by="product", period="day", conn=snapshot.conn)
+
+    try:
+        return {"idle": measure(lambda: time.sleep(0.5)), "live": measure(live_reports), "snapshot": measure(snapshot_reports)}
+    finally:
+        database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME = saved_name, saved_archive
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Снимок БД для отчетов")
+    parser.add_argument("--benchmark", action="store_true", help="сравнить задержку записи во время отчетов с моментальным снимком и без")
+    parser.add_argument("--from", dest="date_from", help="снимок за период: начало, ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="date_to", help="конец периода (не включается), ГГГГ-ММ-ДД")
+    parser.add_argument("--archive", action="store_true", help="включить архивные заказы")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.benchmark:
+        for mode, row in benchmark_report_isolation().items():
+            print(f"{mode:<9} записей: {row['writes']:>6}  отчет: {row['report_s']:>7} с  p50: {row['p50_ms']:>8} мс  "
+                  f"p99: {row['p99_ms']:>8} мс  макс: {row['max_ms']:>8} мс")
+    else:
+        snapshot = ReportSnapshot(date_from=args.date_from, date_to=args.date_to, include_archived=args.archive)
+        print(snapshot.refresh(), snapshot.stats)
+        snapshot.close()
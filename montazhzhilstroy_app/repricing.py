@@ -0,0 +1,195 @@
+import sqlite3
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from database import create_connection, attach_archive_database, archive_database_exists
+from money import to_kopecks, from_kopecks
+
+BASIS_POINTS = 10000 # 100% = 10000 б.п.: проценты с точностью до сотых считаются в целых числах
+PREVIEW_LIMIT = 500
+REPRICING_MODES = ("percent", "absolute", "rules")
+REPRICING_FILTERS = ("category", "article_prefix", "price_min", "price_max", "article_numbers")
+
+def _to_basis_points(percent):
+    """Процент (7, '7,5', Decimal('-3.25')) -> целые базисные пункты. Бросает ValueError."""
+    try: value = Decimal(str(percent).strip().replace(",", "."))
+    except InvalidOperation: raise ValueError(f"Некорректный процент: {percent!r}")
+    if not value.is_finite(): raise ValueError(f"Некорректный процент: {percent!r}")
+    basis_points = int((value * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    if basis_points <= -BASIS_POINTS: raise ValueError("Снижение цены на 100% и более недопустимо")
+    return basis_points
+
+def _percent_sql(percent):
+    # Округление половины вверх в целых копейках: (цена * (10000 + б.п.) + 5000) / 10000
+    return f"((price * ? + {BASIS_POINTS // 2}) / {BASIS_POINTS})", [BASIS_POINTS + _to_basis_points(percent)]
+
+def _new_price_sql(change):
+    """
+    SQL-выражение новой цены (в копейках) и его параметры. change - словарь:
+      {"mode": "percent", "value": 7}            - +7% ко всем ценам
+      {"mode": "absolute", "value": "-150.00"}   - минус 150 руб.
+      {"mode": "rules", "rules": [("1000", 10), ("5000", 7), (None, 5)]}
+          - ступени по текущей цене: до 1000 руб. +10%, до 5000 руб. +7%, дороже +5%
+    Необязательный "round_to" - шаг округления результата в рублях ("1", "10"); по умолчанию копейка.
+    Бросает ValueError при некорректном описании.
+    """
+    mode = change.get("mode")
+    if mode == "percent":
+        expr, params = _percent_sql(change.get("value"))
+    elif mode == "absolute":
+        expr, params = "(price + ?)", [to_kopecks(change.get("value"))]
+    elif mode == "rules":
+        rules = list(change.get("rules") or [])
+        if not rules: raise ValueError("Не заданы правила переоценки")
+        bounded = sorted((to_kopecks(bound), percent) for bound, percent in rules if bound is not None)
+        open_ended = [percent for bound, percent in rules if bound is None]
+        if len(open_ended) > 1: raise ValueError("Правило 'выше' может быть только одно")
+        expr, params = "CASE", []
+        for bound, percent in bounded:
+            percent_expr, percent_params = _percent_sql(percent)
+            expr += f" WHEN price <= ? THEN {percent_expr}"; params += [bound] + percent_params
+        if open_ended:
+            percent_expr, percent_params = _percent_sql(open_ended[0])
+            expr += f" ELSE {percent_expr}"; params += percent_params
+        else: expr += " ELSE price" # Цены выше последней ступени не меняются
+        expr += " END"
+    else:
+        raise ValueError(f"Неизвестный режим переоценки: {mode!r}")
+
+    step = to_kopecks(change.get("round_to") or "0.01")
+    if step <= 0: raise ValueError("Шаг округления должен быть положительным")
+    if step > 1:
+        expr = f"((({expr}) + ?) / ?) * ?"; params += [step // 2, step, step]
+    return f"MAX(0, {expr})", params
+
+def _filter_sql(conn, filters):
+    """
+    Условие WHERE по фильтрам: category, article_prefix, price_min / price_max (руб., включительно),
+    article_numbers - список артикулов (например, из прайса поставщика), кладется во временную таблицу.
+    """
+    unknown = [name for name in filters if name not in REPRICING_FILTERS]
+    if unknown: raise ValueError(f"Неизвестные фильтры: {', '.join(unknown)}")
+    conditions, params = ["1 = 1"], []
+    if filters.get("category"): conditions.append("category = ?"); params.append(filters["category"])
+    if filters.get("article_prefix"):
+        prefix = filters["article_prefix"]
+        conditions.append("substr(article_number, 1, ?) = ?"); params += [len(prefix), prefix]
+    if filters.get("price_min") not in (None, ""): conditions.append("price >= ?"); params.append(to_kopecks(filters["price_min"]))
+    if filters.get("price_max") not in (None, ""): conditions.append("price <= ?"); params.append(to_kopecks(filters["price_max"]))
+    if filters.get("article_numbers") is not None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS repricing_articles (article_number TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("DELETE FROM temp.repricing_articles")
+        conn.executemany("INSERT OR IGNORE INTO temp.repricing_articles VALUES (?)",
+                         [(article.strip(),) for article in filters["article_numbers"] if article and article.strip()])
+        conditions.append("article_number IN (SELECT article_number FROM temp.repricing_articles)")
+    return " AND ".join(conditions), params
+
+def preview_repricing(filters, change, limit=PREVIEW_LIMIT):
+    """
+    Показывает, что сделает apply_repricing, ничего не меняя: тем же SQL-выражением.
+    Возвращает {"count", "old_total", "new_total", "rows": [...первые limit товаров...]} или строку ошибки.
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        new_price_sql, price_params = _new_price_sql(change)
+        where_sql, where_params = _filter_sql(conn, filters)
+        cte = f"""
+        WITH repriced AS (
+            SELECT id, name, article_number, category, price, {new_price_sql} AS new_price
+            FROM products WHERE {where_sql}
+        )"""
+        params = price_params + where_params
+        count, old_total, new_total = conn.execute(
+            f"{cte} SELECT COUNT(*), COALESCE(SUM(price), 0), COALESCE(SUM(new_price), 0) FROM repriced WHERE new_price <> price",
+            params).fetchone()
+        rows = conn.execute(f"{cte} SELECT id, name, article_number, category, price, new_price FROM repriced WHERE new_price <> price ORDER BY name LIMIT ?",
+                            params + [int(limit)]).fetchall()
+        return {"count": count, "old_total": from_kopecks(old_total), "new_total": from_kopecks(new_total),
+                "rows": [{"id": row[0], "name": row[1], "article_number": row[2], "category": row[3],
+                          "old_price": from_kopecks(row[4]), "new_price": from_kopecks(row[5])} for row in rows]}
+    except ValueError as e: return f"InvalidRepricingError:{e}"
+    except sqlite3.Error as e: return f"SQLiteErrorRepricing: {e}"
+    finally:
+        conn.close()
+
+def apply_repricing(filters, change, description=None):
+    """
+    Переоценивает отфильтрованные товары одним UPDATE в одной транзакции.
+    Старые и новые цены пишет триггер в price_history; строки помечаются номером пакета price_change_batches.
+    Возвращает число измененных товаров (0 - нечего менять, пакет не создается) или строку ошибки.
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        new_price_sql, price_params = _new_price_sql(change)
+        conn.execute("BEGIN TRANSACTION;")
+        where_sql, where_params = _filter_sql(conn, filters)
+        last_history_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM price_history").fetchone()[0]
+        cur = conn.execute(f"UPDATE products SET price = {new_price_sql} WHERE {where_sql} AND {new_price_sql} <> price",
+                           price_params + where_params + price_params)
+        updated = cur.rowcount
+        if updated == 0:
+            conn.rollback()
+            return 0
+        batch_id = conn.execute("INSERT INTO price_change_batches (description, products_count) VALUES (?, ?)",
+                                (description, updated)).lastrowid
+        conn.execute("UPDATE price_history SET batch_id = ? WHERE id > ?", (batch_id, last_history_id))
+        conn.commit()
+        return updated
+    except ValueError as e:
+        if conn.in_transaction: conn.rollback()
+        return f"InvalidRepricingError:{e}"
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorRepricing: {e}"
+    finally:
+        conn.close()
+
+def get_price_history(product_id, limit=100):
+    """История цены товара, новые изменения первыми."""
+    conn = create_connection()
+    if conn is None: return []
+    rows = conn.execute("""
+    SELECT h.changed_at, h.old_price, h.new_price, h.batch_id, b.description
+    FROM price_history h LEFT JOIN price_change_batches b ON b.id = h.batch_id
+    WHERE h.product_id = ?
+    ORDER BY h.changed_at DESC, h.id DESC
+    LIMIT ?
+    """, (product_id, int(limit))).fetchall()
+    conn.close()
+    return [{"changed_at": row[0], "old_price": from_kopecks(row[1]), "new_price": from_kopecks(row[2]),
+             "batch_id": row[3], "batch_description": row[4]} for row in rows]
+
+def audit_order_pricing(order_id):
+    """
+    Сверяет цены позиций заказа с ценой товара по прайсу на дату заказа (по price_history).
+    Работает и для архивных заказов. Возвращает список позиций или "NotFound".
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        schemas = ["main"]
+        if archive_database_exists():
+            attach_archive_database(conn)
+            schemas.append("archive")
+        for schema in schemas:
+            rows = conn.execute(f"""
+            SELECT oi.product_id, p.name, oi.quantity, oi.price_per_unit,
+                   COALESCE(
+                       (SELECT h.new_price FROM price_history h WHERE h.product_id = oi.product_id AND h.changed_at <= o.order_date
+                        ORDER BY h.changed_at DESC, h.id DESC LIMIT 1),
+                       (SELECT h.old_price FROM price_history h WHERE h.product_id = oi.product_id AND h.changed_at > o.order_date
+                        ORDER BY h.changed_at ASC, h.id ASC LIMIT 1),
+                       p.price) -- Истории нет: цена с тех пор не менялась
+            FROM {schema}.order_items oi
+            JOIN {schema}.orders o ON o.id = oi.order_id
+            JOIN products p ON p.id = oi.product_id
+            WHERE oi.order_id = ?
+            """, (order_id,)).fetchall()
+            if rows: break
+        else:
+            return "NotFound"
+        return [{"product_id": row[0], "product_name": row[1], "quantity": row[2], "price_per_unit": from_kopecks(row[3]),
+                 "catalog_price": from_kopecks(row[4]), "difference": from_kopecks(row[3] - row[4])} for row in rows]
+    except sqlite3.Error as e: return f"SQLiteErrorRepricing: {e}"
+    finally:
+        conn.close()
@@ -0,0 +1,99 @@
+import sqlite3
+from database import create_connection
+
+RESERVATION_TTL_MINUTES = 15 # Резерв черновика, который не трогали дольше, освобождается сам
+
+# Резервы других черновиков (holder IS NOT ? - при holder=None учитываются все); истекшие не считаются
+ACTIVE_HOLDS_SQL = """
+    SELECT COALESCE(SUM(r.quantity), 0) FROM stock_reservations r
+    WHERE r.product_id = p.id AND r.expires_at > CURRENT_TIMESTAMP AND r.holder IS NOT ?"""
+AVAILABLE_QUANTITY_SQL = f"SELECT p.stock_quantity - ({ACTIVE_HOLDS_SQL}) FROM products p WHERE p.id = ?"
+
+def available_quantity(conn, product_id, holder=None):
+    """Остаток товара за вычетом чужих действующих резервов (в открытой транзакции conn). None - товара нет."""
+    row = conn.execute(AVAILABLE_QUANTITY_SQL, (holder, product_id)).fetchone()
+    return row[0] if row else None
+
+def get_available_quantities(product_ids, holder=None):
+    """{product_id: доступный остаток} с учетом резервов всех черновиков, кроме holder."""
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids: return {}
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        rows = conn.execute(f"""
+        SELECT p.id, p.stock_quantity - ({ACTIVE_HOLDS_SQL}) FROM products p
+        WHERE p.id IN ({', '.join('?' for _ in product_ids)})""", (holder, *product_ids)).fetchall()
+        return dict(rows)
+    except sqlite3.Error as e: return f"SQLiteErrorReservation: {e}"
+    finally:
+        conn.close()
+
+def reserve_stock(holder, product_id, quantity, ttl_minutes=RESERVATION_TTL_MINUTES):
+    """
+    Устанавливает резерв holder на товар в quantity штук (не прибавляет; 0 снимает резерв).
+    Проверка доступного остатка и запись резерва - одна транзакция BEGIN IMMEDIATE, поэтому два оператора
+    не могут зарезервировать одни и те же последние единицы.
+    Возвращает True, "NotFound" или "StockReservedError:<сколько доступно>".
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+        if quantity <= 0:
+            conn.execute("DELETE FROM stock_reservations WHERE holder = ? AND product_id = ?", (holder, product_id))
+            conn.commit()
+            return True
+        available = available_quantity(conn, product_id, holder)
+        if available is None:
+            conn.rollback(); return "NotFound"
+        if quantity > available:
+            conn.rollback(); return f"StockReservedError:{max(available, 0)}"
+        conn.execute("""
+        INSERT INTO stock_reservations (holder, product_id, quantity, expires_at) VALUES (?, ?, ?, datetime('now', ?))
+        ON CONFLICT (holder, product_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at
+        """, (holder, product_id, int(quantity), f"+{int(ttl_minutes)} minutes"))
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorReservation: {e}"
+    finally:
+        conn.close()
+
+def renew_reservations(holder, ttl_minutes=RESERVATION_TTL_MINUTES):
+    """Продлевает резервы черновика, который продолжают редактировать. Возвращает число продленных резервов."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        cur = conn.execute("UPDATE stock_reservations SET expires_at = datetime('now', ?) WHERE holder = ? AND expires_at > CURRENT_TIMESTAMP",
+                           (f"+{int(ttl_minutes)} minutes", holder))
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e: return f"SQLiteErrorReservation: {e}"
+    finally:
+        conn.close()
+
+def release_reservations(holder):
+    """Снимает все резервы черновика (очистка формы, закрытие программы)."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        conn.execute("DELETE FROM stock_reservations WHERE holder = ?", (holder,))
+        conn.commit()
+        return True
+    except sqlite3.Error as e: return f"SQLiteErrorReservation: {e}"
+    finally:
+        conn.close()
+
+def prune_expired_reservations():
+    """Удаляет истекшие резервы (они и так не учитываются, но занимают место)."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        cur = conn.execute("DELETE FROM stock_reservations WHERE expires_at <= CURRENT_TIMESTAMP")
+        conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e: return f"SQLiteErrorReservation: {e}"
+    finally:
+        conn.close()
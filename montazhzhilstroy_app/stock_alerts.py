@@ -0,0 +1,48 @@
+import sqlite3
+from database import create_connection
+
+def get_open_stock_alerts(limit=200):
+    """Открытые оповещения о низком остатке. Читает только таблицу stock_alerts (частичный индекс по открытым)."""
+    conn = create_connection()
+    if conn is None: return []
+    cur = conn.cursor()
+    cur.execute("""
+    SELECT id, product_id, product_name, article_number, stock_quantity, reorder_level, created_at
+    FROM stock_alerts
+    WHERE closed_at IS NULL
+    ORDER BY stock_quantity - reorder_level ASC, created_at ASC
+    LIMIT ?
+    """, (int(limit),))
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": row[0], "product_id": row[1], "product_name": row[2], "article_number": row[3],
+             "stock_quantity": row[4], "reorder_level": row[5], "created_at": row[6]} for row in rows]
+
+def acknowledge_stock_alert(alert_id):
+    """Закрывает оповещение вручную (оператор принял к сведению). Новое появится при следующем падении остатка."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    cur = conn.cursor()
+    try:
+        cur.execute("UPDATE stock_alerts SET closed_at = CURRENT_TIMESTAMP, close_reason = 'acknowledged' WHERE id = ? AND closed_at IS NULL", (alert_id,))
+        conn.commit()
+        return True if cur.rowcount > 0 else "NotFound"
+    except sqlite3.Error as e: return f"SQLiteError: {e}"
+    finally:
+        if conn: conn.close()
+
+def get_low_stock_products():
+    """Товары с остатком не выше минимального. Условие совпадает с частичным индексом idx_products_low_stock."""
+    conn = create_connection()
+    if conn is None: return []
+    cur = conn.cursor()
+    cur.execute("""
+    SELECT id, name, article_number, stock_quantity, reorder_level
+    FROM products
+    WHERE stock_quantity <= reorder_level
+    ORDER BY stock_quantity ASC
+    """)
+    rows = cur.fetchall()
+    conn.close()
+    return [{"id": row[0], "name": row[1], "article_number": row[2], "stock_quantity": row[3],
+             "reorder_level": row[4]} for row in rows]
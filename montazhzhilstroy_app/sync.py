@@ -0,0 +1,255 @@
+"""
+Дельта-синхронизация справочников (товары и клиенты) между копиями БД в филиалах.
+    python sync.py export to_office2.json.gz --peer office2   # изменения с прошлой выгрузки для филиала office2
+    python sync.py import from_office1.json.gz               # слить изменения другого филиала
+    python sync.py new-site-id                               # один раз на БД, скопированной с другого филиала
+Передаются только строки, измененные после отметки (updated_at), и надгробия удаленных строк.
+Правила слияния одинаковы на обеих сторонах, поэтому после обмена копии сходятся:
+- строки сопоставляются по sync_uuid; новая строка с артикулом / email (без учета регистра и пробелов),
+  который уже есть под другим uuid, - та же сущность, остается меньший из двух uuid;
+- побеждает более поздний updated_at, при равенстве - филиал с большим site_id;
+- удаление побеждает изменение, сделанное не позже него; строка, на которую ссылаются заказы, не удаляется (blocked).
+Заказы не синхронизируются: у каждого филиала свои заказы и свой склад.
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import time
+from database import create_connection, archive_database_exists, SYNC_TABLES, SYNC_TIMESTAMP_SQL
+
+CHANGESET_FORMAT = 1
+# Клиенты сопоставляются по email_norm: email уникален с точностью до регистра и пробелов (client_crud._email_taken)
+SYNC_NATURAL_KEYS = {"products": "article_number", "clients": "email_norm"}
+# Заказы, которые не дают удалить строку справочника (ON DELETE RESTRICT)
+SYNC_ORDER_REFERENCES = {"products": ("order_items", "product_id"), "clients": ("orders", "client_id")}
+# Окно выгрузки начинается чуть раньше отметки: изменение, зафиксированное одновременно с прошлой
+# выгрузкой, не теряется, а повторно полученные строки при импорте ничего не меняют
+WATERMARK_OVERLAP = "-5 seconds"
+IMPORT_ACTIONS = ("inserted", "updated", "deleted", "merged", "kept_local", "blocked")
+
+def _open_changeset(path, mode, compressed=None):
+    if compressed is None: compressed = path.endswith(".gz")
+    return gzip.open(path, mode + "t", encoding="utf-8") if compressed else open(path, mode, encoding="utf-8")
+
+def _get_state(conn, key):
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _set_state(conn, key, value):
+    conn.execute("INSERT INTO sync_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+
+def _site_id(conn):
+    site_id = _get_state(conn, "site_id")
+    if site_id is None:
+        site_id = conn.execute("SELECT lower(hex(randomblob(16)))").fetchone()[0]
+        _set_state(conn, "site_id", site_id)
+        conn.commit()
+    return site_id
+
+def get_site_id():
+    """Идентификатор этой копии БД (создается при первом обращении)."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try: return _site_id(conn)
+    except sqlite3.Error as e: return f"SQLiteErrorSync: {e}"
+    finally:
+        conn.close()
+
+def new_site_id():
+    """Новый site_id: нужен БД, скопированной файлом с другого филиала (иначе у копий один site_id)."""
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    try:
+        conn.execute("DELETE FROM sync_state") # Отметки обмена относились к старому site_id
+        conn.commit()
+        return _site_id(conn)
+    except sqlite3.Error as e: return f"SQLiteErrorSync: {e}"
+    finally:
+        conn.close()
+
+def export_changes(path, peer=None, since=None):
+    """
+    Пишет в path (.gz - со сжатием) строки товаров и клиентов, измененные после since, и надгробия.
+    since=None и peer - с отметки прошлой выгрузки для этого филиала (первая выгрузка - все строки);
+    после успешной записи отметка peer сдвигается. Возвращает сводку или строку ошибки.
+    """
+    conn = create_connection()
+    if conn is None: return "ConnectionError"
+    started = time.perf_counter()
+    try:
+        site_id = _site_id(conn)
+        if since is None and peer: since = _get_state(conn, f"export:{peer}")
+        conn.execute("BEGIN TRANSACTION;") # Все таблицы читаются из одного снимка
+        until = conn.execute(f"SELECT {SYNC_TIMESTAMP_SQL}").fetchone()[0]
+        lower = conn.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', ?, ?)", (since, WATERMARK_OVERLAP)).fetchone()[0] if since else ""
+        tables = {}
+        for table, columns in SYNC_TABLES.items():
+            names = ("sync_uuid", "updated_at") + columns
+            rows = conn.execute(f"SELECT {', '.join(names)} FROM {table} WHERE updated_at > ? ORDER BY updated_at", (lower,)).fetchall()
+            tables[table] = {"columns": list(names), "rows": rows}
+        tombstones = conn.execute("SELECT table_name, sync_uuid, deleted_at FROM sync_tombstones WHERE deleted_at > ? ORDER BY deleted_at",
+                                  (lower,)).fetchall()
+        conn.rollback()
+        changeset = {"format": CHANGESET_FORMAT, "site_id": site_id, "since": since, "until": until,
+                     "tables": tables, "tombstones": tombstones}
+        tmp_path = f"{path}.tmp"
+        try:
+            with _open_changeset(tmp_path, "w", compressed=path.endswith(".gz")) as f:
+                json.dump(changeset, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            return f"SyncFileError:{e}"
+        if peer:
+            _set_state(conn, f"export:{peer}", until)
+            conn.commit()
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorSync: {e}"
+    finally:
+        conn.close()
+    return {"since": since, "until": until, **{table: len(data["rows"]) for table, data in tables.items()},
+            "tombstones": len(tombstones), "bytes": os.path.getsize(path), "elapsed_s": round(time.perf_counter() - started, 3)}
+
+def load_changeset(path):
+    """Читает и проверяет файл изменений. Возвращает словарь или строку ошибки."""
+    try:
+        with _open_changeset(path, "r") as f:
+            changeset = json.load(f)
+    except (OSError, ValueError) as e: return f"SyncFileError:{e}"
+    if not isinstance(changeset, dict) or changeset.get("format") != CHANGESET_FORMAT:
+        return "InvalidChangesetError:неизвестный формат файла"
+    for table, columns in SYNC_TABLES.items():
+        data = changeset.get("tables", {}).get(table, {"columns": ["sync_uuid", "updated_at", *columns], "rows": []})
+        if data.get("columns") != ["sync_uuid", "updated_at", *columns]:
+            return f"InvalidChangesetError:столбцы {table} не совпадают со схемой этой БД"
+    return changeset
+
+def _blocked_sql(table, attached_archive):
+    ref_table, ref_column = SYNC_ORDER_REFERENCES[table]
+    checks = [f"EXISTS (SELECT 1 FROM main.{ref_table} r WHERE r.{ref_column} = t.id)"]
+    if attached_archive: checks.append(f"EXISTS (SELECT 1 FROM archive.{ref_table} r WHERE r.{ref_column} = t.id)")
+    return " OR ".join(checks)
+
+def _merge_table(conn, table, columns, rows, remote_wins, attached_archive):
+    """Сливает строки и надгробия одной таблицы (внутри общей транзакции импорта). Возвращает счетчики IMPORT_ACTIONS."""
+    counts = dict.fromkeys(IMPORT_ACTIONS, 0)
+    key, names = SYNC_NATURAL_KEYS[table], ("sync_uuid", "updated_at") + columns
+    incoming = f"temp.sync_in_{table}"
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS sync_in_{table} (sync_uuid TEXT PRIMARY KEY, updated_at TEXT, {', '.join(columns)})")
+    conn.execute(f"DELETE FROM {incoming}")
+    conn.executemany(f"INSERT OR REPLACE INTO {incoming} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})", rows)
+
+    # Одна сущность, заведенная в обоих филиалах (тот же артикул / email, разные uuid): остается меньший uuid.
+    # Если остался наш, строка помечается измененной, чтобы другой филиал получил его со следующей выгрузкой.
+    merges = conn.execute(f"""
+    SELECT t.id, t.sync_uuid, i.sync_uuid FROM {incoming} i JOIN {table} t ON t.{key} = i.{key}
+    WHERE t.sync_uuid <> i.sync_uuid AND NOT EXISTS (SELECT 1 FROM {table} WHERE sync_uuid = i.sync_uuid)
+    """).fetchall()
+    conn.executemany(f"UPDATE {table} SET sync_uuid = ? WHERE id = ?",
+                     [(remote_uuid, row_id) for row_id, local_uuid, remote_uuid in merges if remote_uuid < local_uuid])
+    conn.executemany(f"UPDATE {incoming} SET sync_uuid = ? WHERE sync_uuid = ?",
+                     [(local_uuid, remote_uuid) for _, local_uuid, remote_uuid in merges if local_uuid < remote_uuid])
+    counts["merged"] = len(merges)
+
+    # Удаления: надгробие не раньше последнего изменения строки; строки с заказами остаются
+    deletable = f"""
+    FROM {table} t JOIN temp.sync_in_tombstones d ON d.table_name = '{table}' AND d.sync_uuid = t.sync_uuid
+    WHERE d.deleted_at >= t.updated_at"""
+    counts["blocked"] = conn.execute(f"SELECT COUNT(*) {deletable} AND ({_blocked_sql(table, attached_archive)})").fetchone()[0]
+    counts["deleted"] = conn.execute(f"""DELETE FROM {table} WHERE id IN (
+    SELECT t.id {deletable} AND NOT ({_blocked_sql(table, attached_archive)}))""").rowcount
+    # Время удаления берется из филиала-источника (триггер поставил текущее), чтобы надгробие не ушло обратно
+    conn.execute(f"""
+    INSERT INTO sync_tombstones (table_name, sync_uuid, deleted_at)
+    SELECT table_name, sync_uuid, deleted_at FROM temp.sync_in_tombstones d
+    WHERE d.table_name = '{table}' AND NOT EXISTS (SELECT 1 FROM {table} WHERE sync_uuid = d.sync_uuid)
+    ON CONFLICT (table_name, sync_uuid) DO UPDATE SET deleted_at = MIN(deleted_at, excluded.deleted_at)
+    """)
+
+    # Изменения: более поздний updated_at, при равенстве - больший site_id; одинаковые строки не переписываются
+    newer = "(i.updated_at > t.updated_at OR i.updated_at = t.updated_at AND ?)"
+    counts["kept_local"] = conn.execute(f"""
+    SELECT COUNT(*) FROM {incoming} i JOIN {table} t ON t.sync_uuid = i.sync_uuid WHERE NOT {newer}
+    """, (remote_wins,)).fetchone()[0]
+    counts["updated"] = conn.execute(f"""
+    UPDATE {table} AS t SET {', '.join(f'{column} = i.{column}' for column in columns)}, updated_at = i.updated_at
+    FROM {incoming} i
+    WHERE t.sync_uuid = i.sync_uuid AND {newer}
+      AND ({', '.join(f't.{column}' for column in columns)}) IS NOT ({', '.join(f'i.{column}' for column in columns)})
+    """, (remote_wins,)).rowcount
+
+    # Новые строки, если их не удалили здесь позже последнего изменения
+    counts["inserted"] = conn.execute(f"""
+    INSERT INTO {table} ({', '.join(names)})
+    SELECT {', '.join(f'i.{name}' for name in names)} FROM {incoming} i
+    WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.sync_uuid = i.sync_uuid)
+      AND NOT EXISTS (SELECT 1 FROM sync_tombstones d WHERE d.table_name = '{table}' AND d.sync_uuid = i.sync_uuid
+                      AND d.deleted_at >= i.updated_at)
+    """).rowcount
+    conn.execute(f"""
+    DELETE FROM sync_tombstones WHERE table_name = '{table}'
+      AND sync_uuid IN (SELECT i.sync_uuid FROM {incoming} i JOIN {table} t ON t.sync_uuid = i.sync_uuid)
+    """)
+    conn.executemany(f"UPDATE {table} SET updated_at = {SYNC_TIMESTAMP_SQL} WHERE id = ?",
+                     [(row_id,) for row_id, local_uuid, remote_uuid in merges if local_uuid < remote_uuid])
+    return counts
+
+def import_changes(path):
+    """
+    Сливает файл изменений другого филиала одной транзакцией: строки загружаются во временные таблицы
+    и применяются несколькими запросами на таблицу. Повторный импорт того же файла ничего не меняет.
+    Возвращает сводку по таблицам или строку ошибки.
+    """
+    changeset = load_changeset(path)
+    if isinstance(changeset, str): return changeset
+    started = time.perf_counter()
+    attached_archive = archive_database_exists()
+    conn = create_connection(attach_archive=attached_archive)
+    if conn is None: return "ConnectionError"
+    try:
+        local_site = _site_id(conn)
+        remote_site = changeset.get("site_id")
+        if remote_site == local_site: return "SyncSameSiteError"
+        conn.execute("BEGIN IMMEDIATE TRANSACTION;")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_in_tombstones (table_name TEXT, sync_uuid TEXT, deleted_at TEXT, PRIMARY KEY (table_name, sync_uuid))")
+        conn.execute("DELETE FROM temp.sync_in_tombstones")
+        conn.executemany("INSERT OR REPLACE INTO temp.sync_in_tombstones (table_name, sync_uuid, deleted_at) VALUES (?, ?, ?)",
+                         [tuple(tombstone) for tombstone in changeset.get("tombstones", []) if tombstone[0] in SYNC_TABLES])
+        summary = {}
+        for table, columns in SYNC_TABLES.items():
+            rows = changeset.get("tables", {}).get(table, {}).get("rows", [])
+            summary[table] = _merge_table(conn, table, columns, rows, remote_site > local_site, attached_archive)
+        _set_state(conn, f"import:{remote_site}", changeset.get("until"))
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        if conn.in_transaction: conn.rollback()
+        return f"IntegrityErrorSync: {e}"
+    except sqlite3.Error as e:
+        if conn.in_transaction: conn.rollback()
+        return f"SQLiteErrorSync: {e}"
+    finally:
+        conn.close()
+    summary["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return summary
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обмен изменениями товаров и клиентов между филиалами")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="выгрузить изменения в файл")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--peer", default=None, help="филиал-получатель: выгрузка с отметки прошлой выгрузки для него")
+    export_parser.add_argument("--since", default=None, help="выгрузить изменения после момента 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' (UTC)")
+    import_parser = commands.add_parser("import", help="слить изменения из файла")
+    import_parser.add_argument("path")
+    commands.add_parser("new-site-id", help="назначить этой копии БД новый идентификатор")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == "export": result = export_changes(args.path, args.peer, args.since)
+    elif args.command == "import": result = import_changes(args.path)
+    else: result = new_site_id()
+    print(json.dumps(result, ensure_ascii=False, indent=2) if isinstance(result, dict) else result)
@@ -0,0 +1,308 @@
+"""
+Запись и воспроизведение рабочей нагрузки CRUD-модулей.
+Запись (по желанию): python main.py --record session.jsonl.gz - каждый вызов функций product_crud,
+client_crud и order_crud пишется строкой JSON (время от начала, функция, аргументы, длительность, код результата).
+При начале записи рядом с файлом записи сохраняется снимок БД и архива (session.jsonl.gz.snapshot.db):
+записанные вызовы воспроизводятся на копии этого снимка, то есть на тех же данных, что видела запись.
+Каждый запуск приложения с записью - отдельный сеанс; дозапись в тот же файл добавляет сеансы, которые
+при воспроизведении идут после предыдущих, как и при записи.
+Воспроизведение на копии БД:
+    python workload.py session.jsonl.gz --speed 2 --operators 4
+    python workload.py session.jsonl.gz --flat-out --operators 8
+    python workload.py old.jsonl --db data/montazhzhilstroy.db   запись без снимка - копируется указанная БД
+Печатает пропускную способность, перцентили задержек по функциям, ошибки блокировок и расхождения
+кодов результата с записью.
+"""
+import argparse
+import functools
+import gzip
+import inspect
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import Decimal
+import database
+from api_loadtest import percentile
+
+RECORDED_MODULES = ("product_crud", "client_crud", "order_crud")
+SNAPSHOT_SUFFIX = ".snapshot.db"
+ARCHIVE_SNAPSHOT_SUFFIX = ".snapshot_archive.db"
+LOCK_ERROR_MARKERS = ("database is locked", "database table is locked", "database is busy")
+START_DELAY_S = 0.5 # Процессы операторов стартуют одновременно, после загрузки записи
+
+_recorder = None
+
+def result_code(result):
+    """Компактный код результата для записи и сравнения при воспроизведении."""
+    if result is True: return "ok"
+    if result is None or result is False: return str(result).lower()
+    if type(result) is int: return "id"
+    if isinstance(result, str): return result.split(":", 1)[0]
+    if isinstance(result, (list, dict)): return "rows"
+    return type(result).__name__
+
+def _json_default(value):
+    if isinstance(value, Decimal): return str(value) # Денежные функции принимают суммы строкой
+    if isinstance(value, (set, frozenset, tuple, range)): return list(value)
+    raise TypeError(f"Несериализуемый аргумент: {type(value).__name__}")
+
+def _open_log(path, mode):
+    return gzip.open(path, mode + "t", encoding="utf-8") if path.endswith(".gz") else open(path, mode, encoding="utf-8")
+
+class WorkloadRecorder:
+    """
+    Подменяет публичные функции модулей обертками, пишущими каждый вызов в файл.
+    Вызовы изнутри модулей по прямой ссылке (from product_crud import ...) не пишутся - только внешние.
+    Генераторы и вызовы с явным conn (часть чужой транзакции) пропускаются: воспроизвести их отдельно нельзя.
+    """
+    def __init__(self, path, module_names=RECORDED_MODULES):
+        self.path = path
+        self.modules = [__import__(name) for name in module_names]
+        self.originals = []
+        self.lock = threading.Lock()
+        self.file = None
+        self.started = None
+        self.session = None
+
+    def start(self):
+        take_snapshot(self.path)
+        self.file = _open_log(self.path, "a")
+        self.started = time.perf_counter()
+        started_at = time.time()
+        self.session = f"{os.getpid()}-{int(started_at)}" # pid повторяется между запусками, время начала - нет
+        self.write({"s": self.session, "w": round(started_at, 3)}) # Заголовок сеанса: по нему упорядочиваются сеансы при воспроизведении
+        for module in self.modules:
+            for name, func in list(vars(module).items()):
+                if name.startswith("_") or not inspect.isfunction(func) or func.__module__ != module.__name__: continue
+                if inspect.isgeneratorfunction(inspect.unwrap(func)): continue
+                self.originals.append((module, name, func))
+                setattr(module, name, self._wrap(f"{module.__name__}.{name}", func))
+
+    def _wrap(self, operation, func):
+        recorder = self
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if "conn" in kwargs or any(isinstance(arg, sqlite3.Connection) for arg in args): return func(*args, **kwargs)
+            offset = time.perf_counter() - recorder.started
+            result = func(*args, **kwargs)
+            duration = time.perf_counter() - recorder.started - offset
+            recorder.write({"t": round(offset, 4), "s": recorder.session, "op": operation, "args": args, "kwargs": kwargs,
+                            "ms": round(duration * 1000, 3), "res": result_code(result),
+                            **({"n": len(result)} if isinstance(result, (list, dict)) else {})})
+            return result
+        return wrapper
+
+    def write(self, record):
+        try: line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+        except TypeError: return # Аргумент нельзя сохранить (например, файл) - такой вызов не воспроизводим
+        with self.lock:
+            if self.file is not None: self.file.write(line + "\n")
+
+    def stop(self):
+        for module, name, func in self.originals:
+            setattr(module, name, func)
+        self.originals = []
+        with self.lock:
+            if self.file is not None:
+                self.file.close(); self.file = None
+
+def snapshot_paths(record_path):
+    """Пути снимка БД и архива, сделанного при начале записи record_path."""
+    return record_path + SNAPSHOT_SUFFIX, record_path + ARCHIVE_SNAPSHOT_SUFFIX
+
+def archive_path_for(db_path):
+    """Архив лежит рядом со своей БД (как database.ARCHIVE_DATABASE_NAME рядом с DATABASE_NAME)."""
+    return os.path.join(os.path.dirname(db_path), os.path.basename(database.ARCHIVE_DATABASE_NAME))
+
+def take_snapshot(record_path):
+    """
+    Снимает копию рабочей БД и архива для воспроизведения record_path.
+    При дозаписи в существующую запись снимок не переснимается: он предшествует всем ее вызовам.
+    """
+    snapshot_db, snapshot_archive = snapshot_paths(record_path)
+    if os.path.exists(snapshot_db): return
+    _copy_database(database.DATABASE_NAME, snapshot_db)
+    if os.path.exists(database.ARCHIVE_DATABASE_NAME): _copy_database(database.ARCHIVE_DATABASE_NAME, snapshot_archive)
+
+def start_recording(path, module_names=RECORDED_MODULES):
+    """Включает запись вызовов CRUD в path (.gz - со сжатием). Повторный вызов перезапускает запись."""
+    global _recorder
+    stop_recording()
+    _recorder = WorkloadRecorder(path, module_names)
+    _recorder.start()
+    return _recorder
+
+def stop_recording():
+    global _recorder
+    if _recorder is not None:
+        _recorder.stop()
+        _recorder = None
+
+def load_workload(path):
+    """
+    Сеансы записи в порядке начала: [{"s": id, "w": время начала (Unix), "records": вызовы по времени}].
+    У записей, сделанных до заголовков сеансов, время начала неизвестно (0): такие сеансы считаются одновременными.
+    """
+    sessions = {}
+    with _open_log(path, "r") as f:
+        for line in f:
+            if not line.strip(): continue
+            record = json.loads(line)
+            session = sessions.setdefault(record["s"], {"s": record["s"], "w": 0.0, "records": []})
+            if "op" in record: session["records"].append(record)
+            else: session["w"] = record["w"]
+    for session in sessions.values(): session["records"].sort(key=lambda record: record["t"])
+    return sorted((session for session in sessions.values() if session["records"]), key=lambda session: (session["w"], session["s"]))
+
+def _session_phases(sessions):
+    """
+    Делит сеансы (в порядке начала) на фазы: сеансы фазы пересекались по времени и при записи шли одновременно,
+    а каждая следующая фаза началась после окончания предыдущей.
+    """
+    phases, phase_end = [], None
+    for session in sessions:
+        end = session["w"] + max(record["t"] + record["ms"] / 1000 for record in session["records"])
+        if phases and session["w"] <= phase_end:
+            phases[-1].append(session)
+            phase_end = max(phase_end, end)
+        else:
+            phases.append([session])
+            phase_end = end
+    return phases
+
+def _copy_database(source_path, target_path):
+    """Согласованная копия БД через backup API (источник может быть открыт другими процессами)."""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try: source.backup(target)
+    finally:
+        target.close(); source.close()
+
+def _replay_operator(task):
+    """
+    Процесс одного оператора: выполняет свои сеансы друг за другом, вызовы сеанса - с заданной скоростью.
+    Возвращает измерения и время работы.
+    """
+    sessions, db_path, archive_path, speed, start_at = task
+    database.DATABASE_NAME, database.ARCHIVE_DATABASE_NAME = db_path, archive_path
+    functions = {}
+    for record in (record for session in sessions for record in session["records"]):
+        if record["op"] not in functions:
+            module_name, name = record["op"].rsplit(".", 1)
+            functions[record["op"]] = getattr(__import__(module_name), name)
+    time.sleep(max(0.0, start_at - time.time()))
+    started = time.perf_counter()
+    samples = []
+    for session in sessions:
+        session_started, first_offset = time.perf_counter(), session["records"][0]["t"]
+        for record in session["records"]:
+            samples.append(_replay_call(functions[record["op"]], record, speed, session_started, first_offset))
+    return samples, time.perf_counter() - started
+
+def _replay_call(func, record, speed, session_started, first_offset):
+    """Выполняет один записанный вызов (с паузой по времени записи, если задана скорость) и возвращает измерение."""
+    if speed:
+        delay = (record["t"] - first_offset) / speed - (time.perf_counter() - session_started)
+        if delay > 0: time.sleep(delay)
+    call_started = time.perf_counter()
+    try:
+        result = func(*record["args"], **record["kwargs"])
+        code, error = result_code(result), None
+        # CRUD-функции превращают "database is locked" в строку SQLiteError...: ищем признак в полном тексте
+        locked = isinstance(result, str) and any(marker in result for marker in LOCK_ERROR_MARKERS)
+    except Exception as e: # Воспроизведение продолжается: ошибка попадает в отчет
+        code, error = "Exception", f"{type(e).__name__}: {e}"
+        locked = any(marker in error for marker in LOCK_ERROR_MARKERS)
+    latency_ms = (time.perf_counter() - call_started) * 1000
+    return record["op"], latency_ms, code, code == record["res"], error, locked
+
+def replay_workload(record_path, db_path=database.DATABASE_NAME, speed=1.0, operators=1, keep_copy=False):
+    """
+    Воспроизводит запись на копии снимка, сделанного при начале записи (нет снимка - на копии db_path и архива рядом с ней).
+    speed - множитель скорости (1 - как в записи, None - без пауз).
+    Сеансы, шедшие при записи одновременно, образуют фазу (_session_phases); фазы воспроизводятся одна за другой.
+    Сеансы фазы распределяются по operators процессам по кругу, процесс выполняет свои сеансы друг за другом,
+    и все они, как при записи, работают с одной копией.
+    Если операторов больше, чем сеансов в самой широкой фазе, каждый следующий проход по сеансам получает свою копию:
+    повтор тех же вставок в одну БД упирался бы в UNIQUE и чужие id, а не в производительность.
+    Возвращает сводку: пропускная способность, перцентили задержек по функциям, ошибки блокировок.
+    """
+    sessions = load_workload(record_path)
+    if not sessions: return "EmptyWorkloadError"
+    phases = _session_phases(sessions)
+    passes = max(1, operators // max(len(phase) for phase in phases))
+    lanes_per_pass = max(1, operators // passes)
+    source_db, source_archive = snapshot_paths(record_path)
+    from_snapshot = os.path.exists(source_db)
+    if not from_snapshot: source_db, source_archive = db_path, archive_path_for(db_path)
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    copies, results = [], []
+    try:
+        for replay_pass in range(passes):
+            pass_dir = os.path.join(workdir, f"pass{replay_pass}")
+            os.makedirs(pass_dir)
+            copy_path, archive_copy = os.path.join(pass_dir, os.path.basename(db_path)), os.path.join(pass_dir, os.path.basename(archive_path_for(db_path)))
+            _copy_database(source_db, copy_path)
+            if os.path.exists(source_archive): _copy_database(source_archive, archive_copy)
+            copies.append((copy_path, archive_copy))
+        with multiprocessing.get_context("spawn").Pool(operators) as pool:
+            for phase in phases:
+                lanes = min(len(phase), lanes_per_pass)
+                start_at = time.time() + START_DELAY_S
+                tasks = [(phase[lane::lanes], *copies[replay_pass], speed, start_at) for replay_pass in range(passes) for lane in range(lanes)]
+                results.append(pool.map(_replay_operator, tasks))
+    finally:
+        if not keep_copy: shutil.rmtree(workdir, ignore_errors=True)
+    report = _summarize(results, operators, speed, copies[0][0] if keep_copy and copies else None)
+    report.update(sessions=len(sessions), phases=len(phases), baseline="snapshot" if from_snapshot else db_path)
+    return report
+
+def _summarize(phase_results, operators, speed, copy_path):
+    """phase_results - по каждой фазе список (измерения, время работы) процессов; фазы шли одна за другой."""
+    samples = [sample for results in phase_results for operator_samples, _ in results for sample in operator_samples]
+    wall = sum(max((elapsed for _, elapsed in results), default=0.0) for results in phase_results)
+    by_operation = {}
+    for operation, latency_ms, *_ in samples:
+        by_operation.setdefault(operation, []).append(latency_ms)
+    latency = {}
+    for operation, values in sorted(by_operation.items()):
+        values.sort()
+        latency[operation] = {"calls": len(values), "p50_ms": round(percentile(values, 50), 3), "p90_ms": round(percentile(values, 90), 3),
+                              "p99_ms": round(percentile(values, 99), 3), "max_ms": round(values[-1], 3)}
+    lock_errors = [sample for sample in samples if sample[5]]
+    exceptions = [sample[4] for sample in samples if sample[4]]
+    return {"operators": operators, "speed": speed or "max", "calls": len(samples), "elapsed_s": round(wall, 3),
+            "calls_per_second": round(len(samples) / wall, 1) if wall else len(samples),
+            "latency": latency, "lock_errors": len(lock_errors), "exceptions": len(exceptions), "exception_samples": exceptions[:5],
+            "result_mismatches": sum(1 for sample in samples if not sample[3]), "database_copy": copy_path}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанной нагрузки на копии БД")
+    parser.add_argument("record", help="файл записи (python main.py --record ...)")
+    parser.add_argument("--db", default=database.DATABASE_NAME, help="БД для копии, если у записи нет снимка")
+    parser.add_argument("--speed", type=float, default=1.0, help="множитель скорости относительно записи")
+    parser.add_argument("--flat-out", action="store_true", help="без пауз между вызовами")
+    parser.add_argument("--operators", type=int, default=1, help="число параллельных операторов (процессов)")
+    parser.add_argument("--keep-copy", action="store_true", help="не удалять копию БД после воспроизведения")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = replay_workload(args.record, args.db, None if args.flat_out else args.speed, args.operators, args.keep_copy)
+    if isinstance(report, str): print(report)
+    else:
+        print(f"Операторов: {report['operators']}, скорость: {report['speed']}, вызовов: {report['calls']} за {report['elapsed_s']} с "
+              f"({report['calls_per_second']} в секунду)")
+        print(f"Сеансов записи: {report['sessions']}, последовательных фаз: {report['phases']}")
+        if report["baseline"] != "snapshot": print(f"У записи нет снимка БД - воспроизведение на копии {report['baseline']}, расхождения с записью ожидаемы")
+        print(f"Ошибок блокировки: {report['lock_errors']}, исключений: {report['exceptions']}, расхождений с записью: {report['result_mismatches']}")
+        print(f"{'функция':<45} {'вызовов':>8} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+        for operation, row in report["latency"].items():
+            print(f"{operation:<45} {row['calls']:>8} {row['p50_ms']:>9} {row['p90_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+        for sample in report["exception_samples"]: print("  ", sample)
+        if report["database_copy"]: print(f"Копия БД: {report['database_copy']}")